@@ -7,6 +7,9 @@ from typing import List, Dict, Optional
 from dataclasses import dataclass, field
 from abc import ABC, abstractmethod
 
+from costes import add_cost_columns, cost_totals, preprocess_cuenta_motivos
+from export_writers import supervisor_en_fichero
+
 st.set_page_config(
     page_title="Registro de Incidencias",
     page_icon="📋",
@@ -443,13 +446,10 @@ class TablaUnificadaIncidencias:
 
 class ExportManager:
     @staticmethod
-    def export_to_excel(incidencias: List[Incidencia], data_manager: DataManager) -> Optional[bytes]:
-        incidencias_validas = [inc for inc in incidencias if inc.is_valid()]
-        if not incidencias_validas:
-            return None
-        
+    def build_export_frame(incidencias: List[Incidencia], data_manager: DataManager):
+        """DataFrame del export con las columnas de coste y el resultado del motor de costes"""
         data = []
-        for inc in incidencias_validas:
+        for inc in incidencias:
             # Calcular precio_nocturnidad dinámicamente
             precio_nocturnidad = data_manager.get_precio_nocturnidad(inc.categoria, inc.cod_reg_convenio)
             
@@ -476,104 +476,35 @@ class ExportManager:
                 'coste_hora': inc.coste_hora  # Nueva línea
             })
         
-        df = pd.DataFrame(data)
+        df = pd.DataFrame(data, columns=[
+            'jefe_ope', 'nombre_empleado', 'imputacion_nomina', 'facturable', 'motivo',
+            'codigo_crown_origen', 'codigo_crown_destino', 'empresa_destino', 'incidencia_horas',
+            'incidencia_precio', 'nocturnidad_horas', 'precio_nocturnidad', 'traslados_total',
+            'fecha', 'observaciones', 'centro_preferente', 'categoria', 'servicio',
+            'cod_reg_convenio', 'coste_hora'
+        ])
         
-        # Agregar columnas calculadas adicionales para el Excel
-        ExportManager._add_calculated_columns(df, data_manager)
-        ExportManager._add_final_calculations(df)
+        # Columnas de cuenta y Coste_total: mismo motor de costes que app_optimized
+        cuenta_columnas = preprocess_cuenta_motivos(data_manager.maestros.get('cuenta_motivos', pd.DataFrame()))
+        costes = add_cost_columns(df, cuenta_columnas)
+        return df, costes
 
+    @staticmethod
+    def export_to_excel(incidencias: List[Incidencia], data_manager: DataManager) -> Optional[bytes]:
+        incidencias_validas = [inc for inc in incidencias if inc.is_valid()]
+        if not incidencias_validas:
+            return None
+        
+        df, _ = ExportManager.build_export_frame(incidencias_validas, data_manager)
+        return ExportManager.frame_to_excel(df)
+
+    @staticmethod
+    def frame_to_excel(df: pd.DataFrame) -> bytes:
+        """Excel de un frame ya construido por build_export_frame"""
         excel_buffer = io.BytesIO()
         df.to_excel(excel_buffer, index=False, engine='openpyxl')
         excel_buffer.seek(0)
         return excel_buffer.getvalue()
-    
-    @staticmethod
-    def _add_calculated_columns(df: pd.DataFrame, data_manager: DataManager) -> None:
-        """
-        Agrega columnas calculadas basadas en los valores de cuenta_motivos.
-        Estas columnas solo aparecen en el Excel de descarga, no en la interfaz.
-        """
-        # Calcular el total de incidencia por fila
-        df['total_incidencia'] = df['incidencia_precio'] * df['incidencia_horas']
-        
-        # Inicializar las columnas calculadas en 0
-        df['73_plus_sustitucion'] = 0.0
-        df['72_incentivos'] = 0.0 
-        df['70_71_festivos'] = 0.0
-        df['74_plus_nocturnidad'] = 0.0
-        
-        # Obtener el mapeo de motivos a cuentas
-        df_motivos = data_manager.maestros.get('cuenta_motivos', pd.DataFrame())
-        
-        if not df_motivos.empty and 'Motivo' in df_motivos.columns and 'desc_cuenta' in df_motivos.columns:
-            # Crear diccionario de mapeo motivo -> código de cuenta
-            motivo_to_cuenta = {}
-            for _, row in df_motivos.iterrows():
-                motivo = row['Motivo']
-                desc_cuenta = str(row['desc_cuenta'])
-                
-                # Extraer el código numérico de desc_cuenta
-                if '70/71' in desc_cuenta:
-                    codigo_cuenta = '70/71'
-                elif desc_cuenta.startswith('73'):
-                    codigo_cuenta = '73'
-                elif desc_cuenta.startswith('72'):
-                    codigo_cuenta = '72'
-                elif desc_cuenta.startswith('74'):
-                    codigo_cuenta = '74'
-                else:
-                    # Intentar extraer el primer número
-                    import re
-                    match = re.search(r'(\d+)', desc_cuenta)
-                    codigo_cuenta = match.group(1) if match else None
-                
-                if codigo_cuenta:
-                    motivo_to_cuenta[motivo] = codigo_cuenta
-            
-            # Aplicar el mapeo y calcular valores para cada fila
-            for idx, row in df.iterrows():
-                motivo = row['motivo']
-                cuenta = motivo_to_cuenta.get(motivo, None)
-                total_incidencia = row['total_incidencia']
-                
-                # Asignar a la columna correspondiente según la cuenta
-                if cuenta == '73':
-                    df.at[idx, '73_plus_sustitucion'] = total_incidencia
-                elif cuenta == '72':
-                    df.at[idx, '72_incentivos'] = total_incidencia
-                elif cuenta in ['70/71', '70', '71']:
-                    df.at[idx, '70_71_festivos'] = total_incidencia
-                elif cuenta == '74':
-                    df.at[idx, '74_plus_nocturnidad'] = 0.0  # Se calcula después
-        
-        # Eliminar la columna auxiliar total_incidencia
-        df.drop('total_incidencia', axis=1, inplace=True)
-    
-    @staticmethod
-    def _add_final_calculations(df: pd.DataFrame) -> None:
-        """
-        Agrega los cálculos finales:
-        1. 74_plus_nocturnidad = precio_nocturnidad * nocturnidad_horas
-        2. Coste_total = (incidencia_horas*incidencia_precio + nocturnidad_horas*precio_nocturnidad)*1.3195 + traslados_total
-        """
-        # 1. Calcular 74_plus_nocturnidad
-        if 'precio_nocturnidad' in df.columns and 'nocturnidad_horas' in df.columns:
-            df['74_plus_nocturnidad'] = df['precio_nocturnidad'] * df['nocturnidad_horas']
-        else:
-            df['74_plus_nocturnidad'] = 0.0
-        
-        # 2. Calcular Coste_total
-        required_cols_coste = ['incidencia_horas', 'incidencia_precio', 'nocturnidad_horas', 'precio_nocturnidad', 'traslados_total']
-        missing_cols = [col for col in required_cols_coste if col not in df.columns]
-        
-        if not missing_cols:
-            # Coste_total = (incidencia_horas*incidencia_precio + nocturnidad_horas*precio_nocturnidad)*1.3195 + traslados_total
-            coste_incidencias = df['incidencia_horas'] * df['incidencia_precio']
-            coste_nocturnidad = df['nocturnidad_horas'] * df['precio_nocturnidad']
-            coste_con_ss = (coste_incidencias + coste_nocturnidad) * 1.3195
-            df['Coste_total'] = coste_con_ss + df['traslados_total']
-        else:
-            df['Coste_total'] = 0.0
 
 class IncidenciasApp:
     def __init__(self):
@@ -648,38 +579,31 @@ class IncidenciasApp:
         
         incidencias_validas = [inc for inc in st.session_state.incidencias if inc.is_valid()]
         
-        # Calcular métricas usando precio_nocturnidad dinámico
-        monto_total_incidencias = sum(inc.incidencia_precio * inc.incidencia_horas for inc in incidencias_validas)
-        monto_total_traslados = sum(inc.traslados_total*inc.coste_hora for inc in incidencias_validas)
-        # Calcular nocturnidad usando precio_nocturnidad de la tabla
-        monto_total_nocturnidad = 0.0
-        for inc in incidencias_validas:
-            precio_noct = data_manager.get_precio_nocturnidad(inc.categoria, inc.cod_reg_convenio)
-            monto_total_nocturnidad += precio_noct * inc.nocturnidad_horas
-        
-        monto_total_con_ss = (monto_total_incidencias + monto_total_nocturnidad) * 1.3195 + monto_total_traslados
+        # Métricas y Excel salen del mismo frame: el motor de costes corre una vez por rerun
+        df_export, costes = ExportManager.build_export_frame(incidencias_validas, data_manager)
+        metricas = cost_totals(costes)
 
         col1, col2, col3, col4, col5 = st.columns(5)
         with col1:
-            st.metric("📋 Total Incidencias", f"€{monto_total_incidencias:,.2f}")
+            st.metric("📋 Total Incidencias", f"€{metricas['total_incidencias']:,.2f}")
         with col2:
-            st.metric("✅ Total Nocturnidad", f"€{monto_total_nocturnidad:,.2f}")
+            st.metric("✅ Total Nocturnidad", f"€{metricas['total_nocturnidad']:,.2f}")
         with col3:
-            st.metric("⚠️ Total Traslados", f"€{monto_total_traslados:,.2f}")
+            st.metric("⚠️ Total Traslados", f"€{metricas['total_traslados']:,.2f}")
         with col4:
-            st.metric("🔧 Total", f"€{monto_total_incidencias + monto_total_nocturnidad + monto_total_traslados:,.2f}")
+            st.metric("🔧 Total", f"€{metricas['total_simple']:,.2f}")
         with col5:
-            st.metric("📊 Total coste", f"€{monto_total_con_ss:,.2f}")
+            st.metric("📊 Total coste", f"€{metricas['total_con_ss']:,.2f}")
 
         if not incidencias_validas:
             st.warning("⚠️ No hay incidencias válidas para exportar.")
             st.info("💡 Complete todos los campos obligatorios: Trabajador, Imputación Nómina, Facturable, Motivo, Código Crown Destino, Fecha y Observaciones.")
             return
             
-        excel_data = ExportManager.export_to_excel(incidencias_validas, data_manager)        
+        excel_data = ExportManager.frame_to_excel(df_export)
         if excel_data:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"incidencias_{st.session_state.selected_jefe.replace(' ', '_')}_{timestamp}.xlsx"
+            filename = f"incidencias_{supervisor_en_fichero(st.session_state.selected_jefe)}_{timestamp}.xlsx"
             
             st.download_button(
                 label="💾 Descargar Excel de Incidencias",
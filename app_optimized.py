@@ -1,13 +1,62 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from datetime import datetime
-import io
-from typing import List, Dict, Optional, Tuple
-from dataclasses import dataclass, field
-from abc import ABC, abstractmethod
+import pyarrow as pa
+from datetime import date, datetime
+from typing import Callable, List, Dict, Hashable, Iterator, Optional, Sequence, Tuple
+from dataclasses import dataclass, field, fields, replace
 import hashlib
-import pickle
+import itertools
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from archivo import archivar_mes
+from autoguardado import GuardadoDiferido, PuntoGuardado, conjuntos_guardados, directorio_guardado
+from costes import (
+    DEFAULT_COSTING, CostingConfig, add_cost_columns, cost_totals, metric_totals, preprocess_cuenta_motivos
+)
+from export_writers import (
+    CUENTA_EXPORT_COLUMNS, DEFAULT_EXCEL_WRITER, EXPORT_DTYPES, EXPORT_NUMBER_FORMATS, STREAM_FORMATS,
+    FicheroExport, apply_export_dtypes, frame_to_fichero, get_excel_writer, iter_partitioned_zip,
+    iter_stream_format, supervisor_en_fichero
+)
+from memoria import CacheDerivada, PresupuestoMemoria, tamano_bytes
+from perfil_memoria import PerfilMemoria
+from reglas import DEFAULT_REGLAS, DESCRIPCION_REGLAS, MotorReglas
+from trazas import RegistroTrazas
+
+# Con INCIDENCIAS_DEBUG_METRICAS=1 las métricas incrementales se contrastan con un
+# recálculo completo del export, como mucho cada INTERVALO_VERIFICACION_METRICAS segundos por sesión
+DEBUG_METRICAS = os.environ.get('INCIDENCIAS_DEBUG_METRICAS') == '1'
+INTERVALO_VERIFICACION_METRICAS = 30.0
+
+# Límite global para los datos derivados de todas las sesiones (frames de página, export, ficheros generados)
+MEMORIA_DERIVADOS_MB = int(os.environ.get('INCIDENCIAS_MEMORIA_MB', '1024'))
+# Con INCIDENCIAS_ADMIN=1 la barra lateral muestra los paneles de administración
+ADMIN = os.environ.get('INCIDENCIAS_ADMIN') == '1'
+# Segundos mínimos entre dos medidas del estado base de una sesión
+INTERVALO_MEDIDA_MEMORIA = 10.0
+# Autoguardado en data/autoguardado/ de cada (imputación, jefe); INCIDENCIAS_AUTOGUARDADO=0 lo desactiva
+AUTOGUARDADO = os.environ.get('INCIDENCIAS_AUTOGUARDADO', '1') == '1'
+# Segundos sin cambios antes de autoguardar, y máximo con cambios pendientes
+AUTOGUARDADO_ESPERA = 2.0
+AUTOGUARDADO_ESPERA_MAX = 10.0
+# Con INCIDENCIAS_TRAZAS=1 se cronometran las etapas de cada rerun (panel en la barra lateral con INCIDENCIAS_ADMIN=1);
+# INCIDENCIAS_TRAZAS_JSONL=<fichero> además añade cada traza a ese fichero como una línea JSON
+TRAZAS_JSONL = os.environ.get('INCIDENCIAS_TRAZAS_JSONL', '')
+TRAZAS = os.environ.get('INCIDENCIAS_TRAZAS') == '1' or bool(TRAZAS_JSONL)
+# Trazas que se conservan en memoria para el panel
+TRAZAS_MAX = 500
+# Con INCIDENCIAS_PERFIL_MEMORIA=1 se mide con tracemalloc lo que asigna cada etapa pesada (ralentiza el proceso);
+# INCIDENCIAS_PERFIL_MEMORIA_JSONL=<fichero> además añade cada medida a ese fichero (python perfil_memoria.py compara dos)
+PERFIL_MEMORIA_JSONL = os.environ.get('INCIDENCIAS_PERFIL_MEMORIA_JSONL', '')
+PERFIL_MEMORIA = os.environ.get('INCIDENCIAS_PERFIL_MEMORIA') == '1' or bool(PERFIL_MEMORIA_JSONL)
 
 st.set_page_config(
     page_title="Registro de Incidencias",
@@ -15,10 +64,29 @@ st.set_page_config(
     layout="wide"
 )
 
+# =============================================================================
+# TRAZAS DE RENDIMIENTO
+# =============================================================================
+
+@st.cache_resource
+def get_registro_trazas() -> RegistroTrazas:
+    """Registro de trazas único en el proceso: lo comparten todas las sesiones y los hilos de export"""
+    return RegistroTrazas(TRAZAS, TRAZAS_MAX, TRAZAS_JSONL or None)
+
+trazas = get_registro_trazas()
+
+@st.cache_resource
+def get_perfil_memoria() -> PerfilMemoria:
+    """Perfil de memoria único en el proceso (tracemalloc es global)"""
+    return PerfilMemoria(PERFIL_MEMORIA, jsonl=PERFIL_MEMORIA_JSONL or None)
+
+perfil = get_perfil_memoria()
+
 # =============================================================================
 # FUNCIONES DE CARGA OPTIMIZADAS
 # =============================================================================
 
+@trazas.cronometrado()  # Fuera de la caché: también cuenta la copia que devuelve cada acierto
 @st.cache_data(ttl=3600)  # Cache por 1 hora
 def _load_single_sheet(file_path: str, sheet_name: str, **kwargs) -> pd.DataFrame:
     """Carga una sola hoja del Excel bajo demanda"""
@@ -109,6 +177,35 @@ def preprocess_maestro_centros(df: pd.DataFrame) -> pd.DataFrame:
 def preprocess_tarifas_incidencias(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
+# Zona horaria al final de una fecha ISO: 'Z', o '+hh:mm' / '-hhmm' tras la hora
+_ZONA_ISO = re.compile(r'^(.*\d:\d\d(?::\d\d(?:[.,]\d+)?)?)\s*(?:Z|[+-]\d\d(?::?\d\d)?)$|^(\d{4}-\d\d-\d\d)Z$', re.IGNORECASE)
+
+def _sin_zona(valor):
+    """Quita la zona horaria conservando la hora local del valor (y por tanto su día)"""
+    if isinstance(valor, str):
+        return _ZONA_ISO.sub(lambda m: m.group(1) or m.group(2), valor.strip())
+    if isinstance(valor, datetime) and valor.tzinfo is not None:
+        return valor.replace(tzinfo=None)
+    return valor
+
+def normalize_fechas(values) -> pd.Series:
+    """Convierte un lote de fechas (datetime, str ISO 8601, None, NaT) a datetime64 en una sola pasada.
+
+    Con zona horaria (sufijo Z, desfases distintos en el mismo lote) cuenta
+    el día de la hora local del valor. Lo que no se reconoce como fecha
+    queda NaT (ver fechas_invalidas).
+    """
+    valores = pd.Series(values, dtype=object).map(_sin_zona)
+    # utc=True por seguridad: un lote con zonas mezcladas no debe fallar entero
+    fechas = pd.to_datetime(valores, errors='coerce', format='ISO8601', utc=True)
+    return fechas.dt.tz_convert(None).dt.normalize().astype('datetime64[ns]')
+
+def fechas_invalidas(values, fechas: pd.Series) -> np.ndarray:
+    """Máscara de los valores con contenido que normalize_fechas no pudo convertir"""
+    originales = pd.Series(values, dtype=object)
+    vacios = originales.isna() | originales.map(lambda v: isinstance(v, str) and not v.strip())
+    return (fechas.isna() & ~vacios).to_numpy()
+
 # =============================================================================
 # MODELO DE DATOS
 # =============================================================================
@@ -127,13 +224,16 @@ class Incidencia:
     nocturnidad_horas: float = 0.0
     traslados_total: float = 0.0
     coste_hora: float = 0.0
-    fecha: Optional[datetime] = None
+    fecha: Optional[pd.Timestamp] = None  # Siempre pd.Timestamp normalizado (ver normalize_fechas)
     observaciones: str = ""
     centro_preferente: Optional[int] = None
     nombre_jefe_ope: str = ""
     categoria: str = ""
     servicio: str = ""
     cod_reg_convenio: str = ""
+    id_incidencia: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # Código de (categoría, convenio) en la tabla de tarifas; None hasta codificarlo (ver OptimizedDataManager.codigo_tarifa)
+    cod_tarifa: Optional[int] = field(default=None, compare=False, repr=False)
     
     def to_dict(self, precio_nocturnidad: float = 0.0) -> Dict:
         """Optimizado: Recibe el precio pre-calculado"""
@@ -167,11 +267,574 @@ class Incidencia:
         ]
         return all(field is not None and field != "" and (not isinstance(field, (float, int)) or field >= 0) for field in required_fields)
 
+class IncidenciaChangeLog:
+    """Registro secuencial de altas, modificaciones y bajas de incidencias.
+
+    Cada cambio recibe un número de secuencia creciente; un watermark es el
+    último número ya exportado. Las secuencias son consecutivas, así que
+    changes_since() localiza el primer cambio posterior por desplazamiento y
+    su coste depende solo del número de cambios. Cada almacén lleva el suyo
+    (ver AlmacenIncidencias.cambios_export).
+    """
+    ALTA = "alta"
+    MODIFICACION = "modificacion"
+    BAJA = "baja"
+
+    def __init__(self):
+        self._entries: List[Tuple[str, Incidencia]] = []
+        self._base = 0  # Secuencia del último cambio olvidado: _entries[i] es el cambio _base + i + 1
+        self._log_id = uuid.uuid4().hex
+
+    @property
+    def watermark(self) -> int:
+        """Secuencia del último cambio registrado"""
+        return self._base + len(self._entries)
+
+    @property
+    def version(self) -> str:
+        """Versión de los datos: cambia con cada alta, modificación o baja"""
+        return f"{self._log_id}:{self.watermark}"
+
+    def record(self, operacion: str, incidencia: Incidencia) -> None:
+        self._entries.append((operacion, incidencia))
+
+    def discard_until(self, watermark: int) -> None:
+        """Olvida los cambios ya exportados (secuencia <= watermark)"""
+        hasta = min(watermark, self.watermark) - self._base
+        if hasta > 0:
+            del self._entries[:hasta]
+            self._base += hasta
+
+    def changes_since(self, watermark: int) -> List[Tuple[str, Incidencia]]:
+        """Cambios netos por incidencia posteriores al watermark, en orden de primer cambio"""
+        netos: Dict[str, List] = {}
+        for operacion, inc in self._entries[max(watermark - self._base, 0):]:
+            if inc.id_incidencia in netos:
+                # La última entrada lleva la copia vigente (el almacén guarda una copia por versión)
+                netos[inc.id_incidencia][1:] = [operacion, inc]
+            else:
+                netos[inc.id_incidencia] = [operacion, operacion, inc]
+
+        cambios = []
+        for primera, ultima, inc in netos.values():
+            if ultima == self.BAJA:
+                if primera != self.ALTA:  # Alta y baja en la misma ventana: nada que emitir
+                    cambios.append((self.BAJA, inc))
+            else:
+                cambios.append((self.ALTA if primera == self.ALTA else self.MODIFICACION, inc))
+        return cambios
+
+class MetricasIncrementales:
+    """Totales de cabecera mantenidos como agregados en curso.
+
+    Guarda la aportación (incidencia, nocturnidad, traslados) de cada
+    incidencia por id; un alta, modificación, baja o cambio de validez
+    resta la aportación anterior y suma la nueva, así que cada
+    actualización es O(1) y leer las métricas no recorre las incidencias.
+    """
+
+    def __init__(self, config: CostingConfig = DEFAULT_COSTING):
+        self.config = config
+        self._aportaciones: Dict[str, Tuple[float, float, float]] = {}
+        self._validas: set = set()
+        self._sumas = [0.0, 0.0, 0.0]
+
+    @property
+    def n_validas(self) -> int:
+        return len(self._validas)
+
+    @staticmethod
+    def _num(valor) -> float:
+        try:
+            valor = float(valor)
+        except (TypeError, ValueError):
+            return 0.0
+        return 0.0 if math.isnan(valor) else valor
+
+    def _aportacion(self, inc: Incidencia, data_manager: 'OptimizedDataManager') -> Tuple[float, float, float]:
+        """Misma valoración por fila que compute_costs"""
+        num = self._num
+        precio_noct = data_manager.precio_incidencia(inc)
+        traslados = num(inc.traslados_total)
+        if self.config.traslados_a_coste_hora:
+            traslados *= num(inc.coste_hora)
+        return (
+            num(inc.incidencia_horas) * num(inc.incidencia_precio),
+            num(inc.nocturnidad_horas) * num(precio_noct),
+            traslados,
+        )
+
+    def actualizar(self, inc: Incidencia, data_manager: 'OptimizedDataManager') -> None:
+        """Alta o modificación: sustituye la aportación anterior de la incidencia"""
+        self.quitar(inc)
+        if inc.is_valid():
+            aportacion = self._aportacion(inc, data_manager)
+            self._aportaciones[inc.id_incidencia] = aportacion
+            self._validas.add(inc.id_incidencia)
+            for i, valor in enumerate(aportacion):
+                self._sumas[i] += valor
+
+    def quitar(self, inc: Incidencia) -> None:
+        """Baja, o paso a inválida dentro de actualizar()"""
+        aportacion = self._aportaciones.pop(inc.id_incidencia, None)
+        if aportacion is not None:
+            self._validas.discard(inc.id_incidencia)
+            for i, valor in enumerate(aportacion):
+                self._sumas[i] -= valor
+
+    def totales(self) -> Dict[str, float]:
+        return metric_totals(*self._sumas, config=self.config)
+
+    def verificar(self, recalculo: Dict[str, float]) -> None:
+        """Modo depuración: los agregados deben coincidir con un recálculo completo"""
+        for nombre, valor in self.totales().items():
+            assert math.isclose(valor, recalculo[nombre], rel_tol=1e-9, abs_tol=1e-6), (
+                f"Métrica incremental '{nombre}' desincronizada: {valor} != {recalculo[nombre]}"
+            )
+
+ClaveDuplicado = Tuple[str, pd.Timestamp, str, str]
+
+
+class IndiceDuplicados:
+    """Índice hash de incidencias por (trabajador, fecha, motivo, centro destino).
+
+    Es único en el proceso (get_indice_duplicados) y lo comparten todas las
+    sesiones: detecta al mismo trabajador registrado el mismo día por el mismo
+    motivo en el mismo centro por dos supervisores, o dos veces por el mismo.
+    Registrar, quitar y consultar son O(1). Los cerrojos van por franjas de
+    claves, así que escrituras sobre claves distintas no se esperan entre sí.
+    Las escrituras de una misma incidencia llegan ya ordenadas por su almacén.
+    Se llena al abrir los almacenes; con autoguardado, abrir el primero de
+    una imputación abre todos los guardados de esa imputación (ver
+    get_almacen), así que tras un reinicio no depende de qué supervisores
+    hayan entrado ya.
+
+    Cada incidencia pertenece a un grupo (el almacén de su imputación y jefe).
+    Por grupo se lleva cuántas de sus filas están duplicadas y una versión
+    que solo cambia cuando alguna de ellas gana o pierde la marca: la edición
+    de otro supervisor no invalida lo cacheado por las demás sesiones salvo
+    que choque con sus filas.
+    """
+    FRANJAS = 64
+
+    def __init__(self):
+        self._locks = [threading.Lock() for _ in range(self.FRANJAS)]
+        self._buckets: Dict[ClaveDuplicado, Dict[str, str]] = {}
+        self._clave_de: Dict[str, ClaveDuplicado] = {}
+        self._grupo_de: Dict[str, Hashable] = {}
+        self._lock_grupos = threading.Lock()
+        self._versiones: Dict[Hashable, int] = {}
+        self._n_duplicadas: Dict[Hashable, int] = {}
+        self._contador = itertools.count(1)
+
+    def version(self, grupo: Hashable) -> int:
+        """Cambia cuando alguna fila del grupo gana o pierde la marca de duplicada, la cambie la sesión que sea"""
+        return self._versiones.get(grupo, 0)
+
+    def n_duplicadas(self, grupo: Hashable) -> int:
+        """Filas del grupo que coinciden con alguna otra incidencia"""
+        return self._n_duplicadas.get(grupo, 0)
+
+    @staticmethod
+    def clave(inc: Incidencia) -> Optional[ClaveDuplicado]:
+        """Clave normalizada, o None si la incidencia aún no tiene los cuatro campos"""
+        destino = inc.codigo_crown_destino
+        if not inc.trabajador or not inc.motivo or inc.fecha is None or pd.isna(inc.fecha) \
+                or destino is None or destino == "":
+            return None
+        try:
+            destino = str(int(float(destino)))
+        except (TypeError, ValueError):
+            destino = str(destino).strip()
+        return (str(inc.trabajador).strip().upper(), pd.Timestamp(inc.fecha).normalize(), str(inc.motivo), destino)
+
+    def _franjas(self, *claves) -> List[threading.Lock]:
+        """Cerrojos de las claves, en orden fijo para no bloquearse mutuamente"""
+        indices = sorted({hash(clave) % self.FRANJAS for clave in claves if clave is not None})
+        return [self._locks[i] for i in indices]
+
+    def _marcar(self, grupo: Hashable, delta: int) -> None:
+        """Una fila del grupo gana (+1) o pierde (-1) la marca de duplicada"""
+        with self._lock_grupos:
+            self._n_duplicadas[grupo] = self._n_duplicadas.get(grupo, 0) + delta
+            self._versiones[grupo] = next(self._contador)
+
+    def registrar(self, inc: Incidencia, propietario: str, grupo: Optional[Hashable] = None) -> bool:
+        """Alta o modificación; devuelve True si la incidencia queda duplicada"""
+        clave = self.clave(inc)
+        anterior = self._clave_de.get(inc.id_incidencia)
+        if anterior == clave:
+            return self.es_duplicada(inc)
+        locks = self._franjas(anterior, clave)
+        for lock in locks:
+            lock.acquire()
+        try:
+            self._quitar_locked(inc.id_incidencia)
+            if clave is None:
+                return False
+            bucket = self._buckets.setdefault(clave, {})
+            bucket[inc.id_incidencia] = propietario
+            self._clave_de[inc.id_incidencia] = clave
+            self._grupo_de[inc.id_incidencia] = propietario if grupo is None else grupo
+            # Con la segunda fila de la clave ambas pasan a duplicadas; a partir de ahí solo la nueva
+            if len(bucket) == 2:
+                for id_incidencia in bucket:
+                    self._marcar(self._grupo_de[id_incidencia], +1)
+            elif len(bucket) > 2:
+                self._marcar(self._grupo_de[inc.id_incidencia], +1)
+            return len(bucket) > 1
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def quitar(self, inc: Incidencia) -> None:
+        locks = self._franjas(self._clave_de.get(inc.id_incidencia))
+        for lock in locks:
+            with lock:
+                self._quitar_locked(inc.id_incidencia)
+
+    def _quitar_locked(self, id_incidencia: str) -> None:
+        clave = self._clave_de.pop(id_incidencia, None)
+        if clave is None:
+            return
+        grupo = self._grupo_de.pop(id_incidencia)
+        bucket = self._buckets[clave]
+        bucket.pop(id_incidencia, None)
+        if bucket:
+            # Estaba duplicada; si solo queda otra, esa también deja de estarlo
+            self._marcar(grupo, -1)
+            if len(bucket) == 1:
+                self._marcar(self._grupo_de[next(iter(bucket))], -1)
+        else:
+            del self._buckets[clave]
+
+    def es_duplicada(self, inc: Incidencia) -> bool:
+        clave = self._clave_de.get(inc.id_incidencia)
+        return clave is not None and len(self._buckets.get(clave, ())) > 1
+
+    def otros_propietarios(self, inc: Incidencia) -> List[str]:
+        """Supervisores de las demás incidencias con la misma clave"""
+        clave = self._clave_de.get(inc.id_incidencia)
+        if clave is None:
+            return []
+        with self._franjas(clave)[0]:
+            bucket = self._buckets.get(clave, {})
+            return sorted({p for id_, p in bucket.items() if id_ != inc.id_incidencia})
+
+
+@st.cache_resource
+def get_presupuesto_memoria() -> PresupuestoMemoria:
+    """Presupuesto de memoria del proceso: contabilidad por sesión y expulsión LRU de derivados"""
+    return PresupuestoMemoria(MEMORIA_DERIVADOS_MB * 1024 * 1024)
+
+
+@st.cache_resource
+def get_indice_duplicados() -> IndiceDuplicados:
+    """Índice de duplicados del proceso, compartido por todas las sesiones"""
+    return IndiceDuplicados()
+
+# Columnas del autoguardado: los códigos (centros, convenio) llegan como int o str según el origen y se guardan como texto
+_CAMPOS_GUARDADO_NUMERICOS = ['incidencia_horas', 'incidencia_precio', 'nocturnidad_horas', 'traslados_total', 'coste_hora']
+ESQUEMA_GUARDADO = pa.schema([
+    (f.name, pa.float64() if f.name in _CAMPOS_GUARDADO_NUMERICOS else pa.timestamp('ns') if f.name == 'fecha' else pa.string())
+    for f in fields(Incidencia) if f.name not in ('id_incidencia', 'cod_tarifa')  # El código se deriva al leer
+])
+_CAMPOS_GUARDADO_TEXTO = [nombre for nombre in ESQUEMA_GUARDADO.names if nombre not in _CAMPOS_GUARDADO_NUMERICOS + ['fecha']]
+
+
+def _texto(valor) -> Optional[str]:
+    if valor is None or (isinstance(valor, float) and math.isnan(valor)):
+        return None
+    if isinstance(valor, (float, np.floating)) and float(valor).is_integer():
+        valor = int(valor)
+    return str(valor)
+
+
+def _valores_guardado(inc: Incidencia) -> Dict:
+    valores = {campo: _texto(getattr(inc, campo)) for campo in _CAMPOS_GUARDADO_TEXTO}
+    for campo in _CAMPOS_GUARDADO_NUMERICOS:
+        valores[campo] = getattr(inc, campo)
+    valores['fecha'] = inc.fecha
+    return valores
+
+
+def _incidencia_guardada(id_incidencia: str, valores: Dict) -> Incidencia:
+    return Incidencia(**valores, id_incidencia=id_incidencia)
+
+
+class AlmacenIncidencias:
+    """Incidencias compartidas de una (imputación, jefe) entre todas las sesiones que la editan.
+
+    Cada fila lleva un número de versión; las escrituras son compare-and-swap
+    sobre la versión que la sesión leyó, así que un cambio hecho sobre una
+    fila que otro ya modificó se rechaza en vez de pisarlo. El cerrojo es por
+    almacén: sesiones de distintos supervisores no compiten entre sí.
+
+    El registro de cambios del export "Solo cambios" y su watermark también
+    son del almacén: lo descargado por un editor ya no sale en el siguiente
+    delta de otro, y con autoguardado los cambios sin exportar sobreviven a
+    un reinicio (las filas restauradas no cuentan como altas).
+
+    El registro de escrituras (_log) solo conserva lo que aún tiene que leer
+    alguien: las sesiones que sincronizan (cada una con su secuencia) y el
+    autoguardado. Se recorta tras cada descarga de cambios y cada guardado;
+    una sesión que deja de sincronizar más de LECTOR_INACTIVO segundos deja
+    de contar, y si vuelve recibe todas las filas vigentes.
+    """
+    LECTOR_INACTIVO = 15 * 60.0
+
+    def __init__(self, imputacion: str, jefe: str, punto: Optional[PuntoGuardado] = None,
+                 guardado: Optional[GuardadoDiferido] = None):
+        self.jefe = jefe
+        # Grupo de sus filas en el índice de duplicados
+        self.grupo = (imputacion, jefe)
+        self._lock = threading.Lock()
+        self._filas: Dict[str, Tuple[int, Incidencia]] = {}
+        self._log: List[str] = []
+        self._base = 0  # Secuencia de la última escritura recortada: _log[i] es la escritura _base + i + 1
+        self._lectores: Dict[str, Tuple[int, float]] = {}  # Sesión -> (secuencia leída, instante)
+        self.cambios = IncidenciaChangeLog()
+        self.watermark_export = 0
+        # Autoguardado: punto en disco y hilo que lo escribe cuando el almacén deja de cambiar
+        self._punto = punto
+        self._guardado = guardado
+        self._restaurado = punto is None
+        self._lock_guardado = threading.Lock()
+        self._seq_guardada = 0
+        self.error_guardado: Optional[str] = None
+
+    @property
+    def seq(self) -> int:
+        """Secuencia de la última escritura"""
+        return self._base + len(self._log)
+
+    def version(self, id_incidencia: str) -> int:
+        fila = self._filas.get(id_incidencia)
+        return fila[0] if fila else 0
+
+    def cas(self, inc: Incidencia, version_leida: int) -> Tuple[bool, int]:
+        """Alta (version_leida=0) o modificación. Devuelve (éxito, versión vigente)"""
+        with self._lock:
+            actual = self.version(inc.id_incidencia)
+            if actual != version_leida:
+                return False, actual
+            nueva = actual + 1
+            copia = replace(inc)
+            self._filas[inc.id_incidencia] = (nueva, copia)
+            self._anotar(inc.id_incidencia)
+            self.cambios.record(IncidenciaChangeLog.ALTA if actual == 0 else IncidenciaChangeLog.MODIFICACION, copia)
+            # Dentro del cerrojo del almacén: el índice ve las versiones de la fila en orden
+            get_indice_duplicados().registrar(inc, self.jefe, self.grupo)
+        self._avisar_guardado()
+        return True, nueva
+
+    def borrar(self, inc: Incidencia, version_leida: int) -> bool:
+        with self._lock:
+            if self.version(inc.id_incidencia) != version_leida:
+                return False
+            _, copia = self._filas.pop(inc.id_incidencia)
+            self._anotar(inc.id_incidencia)
+            self.cambios.record(IncidenciaChangeLog.BAJA, copia)
+            get_indice_duplicados().quitar(inc)
+        self._avisar_guardado()
+        return True
+
+    def _anotar(self, id_incidencia: str) -> None:
+        self._log.append(id_incidencia)
+
+    def _recortar(self) -> None:
+        """Olvida las escrituras que ya han leído todas las sesiones activas y el autoguardado (con el cerrojo tomado)"""
+        limite = time.monotonic() - self.LECTOR_INACTIVO
+        for lector in [l for l, (_, instante) in self._lectores.items() if instante < limite]:
+            del self._lectores[lector]
+        hasta = min([seq for seq, _ in self._lectores.values()] + [self.seq if self._punto is None else self._seq_guardada])
+        if hasta > self._base:
+            del self._log[:hasta - self._base]
+            self._base = hasta
+
+    def cambios_export(self) -> Tuple[int, List[Tuple[str, Incidencia]]]:
+        """(watermark actual, cambios netos desde la última descarga de cambios) para el export delta"""
+        with self._lock:
+            return self.cambios.watermark, self.cambios.changes_since(self.watermark_export)
+
+    def avanzar_watermark_export(self, watermark: int) -> None:
+        """Descargado el delta hasta watermark: el siguiente parte de ahí, para todos los editores"""
+        with self._lock:
+            if watermark <= self.watermark_export:
+                return
+            self.watermark_export = watermark
+            self.cambios.discard_until(watermark)
+            self._recortar()
+        self._avisar_guardado()
+
+    def cambios_desde(self, seq: int, lector: Optional[str] = None
+                      ) -> Tuple[int, List[Tuple[str, int, Optional[Incidencia]]], bool]:
+        """(secuencia actual, [(id, versión, copia o None si se borró)] escritos después de seq, completo).
+
+        Si las escrituras posteriores a seq ya se recortaron, devuelve todas las
+        filas vigentes con completo=True: las que el lector tenga y no estén ahí
+        se borraron. lector (la sesión) cuenta para el recorte hasta que deja de leer.
+        """
+        with self._lock:
+            completo = seq < self._base
+            ids = self._filas if completo else dict.fromkeys(self._log[seq - self._base:])
+            cambios = []
+            for id_incidencia in ids:
+                fila = self._filas.get(id_incidencia)
+                cambios.append((id_incidencia, fila[0], replace(fila[1])) if fila else (id_incidencia, 0, None))
+            if lector is not None:
+                self._lectores[lector] = (self.seq, time.monotonic())
+            return self.seq, cambios, completo
+
+    # -- Autoguardado ----------------------------------------------------------
+
+    def _avisar_guardado(self) -> None:
+        if self._guardado is not None:
+            self._guardado.avisar(self)
+
+    def restaurar(self) -> int:
+        """Carga el último autoguardado la primera vez que se abre el almacén; devuelve las filas cargadas"""
+        if self._restaurado:
+            return 0
+        with self._lock:
+            if self._restaurado:
+                return 0
+            indice = get_indice_duplicados()
+            filas = self._punto.restaurar()
+            for id_incidencia, (version, valores) in filas.items():
+                inc = _incidencia_guardada(id_incidencia, valores)
+                self._filas[id_incidencia] = (version, inc)
+                self._anotar(id_incidencia)
+                indice.registrar(inc, self.jefe, self.grupo)
+            self._restaurar_cambios_export(self._punto.metadatos())
+            self._seq_guardada = self.seq
+            self._restaurado = True
+            return len(filas)
+
+    def _restaurar_cambios_export(self, metadatos: Optional[Dict]) -> None:
+        """Vuelve a anotar los cambios que quedaron sin exportar; sin metadatos (guardado antiguo) todo está pendiente"""
+        if metadatos is None:
+            pendientes = [(IncidenciaChangeLog.ALTA, id_incidencia) for id_incidencia in self._filas]
+        else:
+            pendientes = metadatos.get('cambios_sin_exportar', [])
+        for operacion, id_incidencia in pendientes:
+            fila = self._filas.get(id_incidencia)
+            if fila is not None and operacion != IncidenciaChangeLog.BAJA:
+                self.cambios.record(operacion, fila[1])
+            elif operacion != IncidenciaChangeLog.ALTA:
+                # Ya exportada y ahora sin fila: hay que darla de baja
+                self.cambios.record(IncidenciaChangeLog.BAJA, Incidencia(id_incidencia=id_incidencia))
+
+    def guardar(self) -> None:
+        """Escribe los cambios desde el último guardado: un segmento delta, o la instantánea al compactar"""
+        with self._lock_guardado:
+            with self._lock:
+                seq = self.seq
+                if self._punto.compactar:
+                    filas = list(self._filas.items())
+                    cambios = None
+                else:
+                    ids = dict.fromkeys(self._log[self._seq_guardada - self._base:])
+                    cambios = [(i, *self._filas[i]) if i in self._filas else (i, 0, None) for i in ids]
+                sin_exportar = [(operacion, inc.id_incidencia) for operacion, inc in self.cambios.changes_since(self.watermark_export)]
+            # Las filas del almacén no se modifican en sitio (cas guarda copias): se serializan fuera del cerrojo
+            try:
+                if cambios is None:
+                    self._punto.guardar_completa([(i, version, _valores_guardado(inc)) for i, (version, inc) in filas])
+                else:
+                    self._punto.guardar_delta(
+                        [(i, version, None if inc is None else _valores_guardado(inc)) for i, version, inc in cambios]
+                    )
+                # Después de las filas: al restaurar, cada cambio pendiente encuentra su fila
+                self._punto.guardar_metadatos({'cambios_sin_exportar': sin_exportar})
+            except Exception as e:  # Disco lleno, permisos...: se reintenta con el siguiente cambio
+                self.error_guardado = str(e)
+                return
+            with self._lock:
+                self._seq_guardada = seq
+                self._recortar()
+            self.error_guardado = None
+
+
+@st.cache_resource
+def get_almacenes() -> Dict[Tuple[str, str], AlmacenIncidencias]:
+    """Almacenes compartidos del proceso, uno por (imputación, jefe)"""
+    return {}
+
+
+@st.cache_resource
+def get_guardado_diferido() -> GuardadoDiferido:
+    """Hilo de autoguardado del proceso, compartido por todos los almacenes"""
+    return GuardadoDiferido(AUTOGUARDADO_ESPERA, AUTOGUARDADO_ESPERA_MAX)
+
+
+@st.cache_resource
+def get_imputaciones_indexadas() -> Dict[str, object]:
+    """Imputaciones cuyos almacenes guardados en disco ya están abiertos (y en el índice de duplicados)"""
+    return {}
+
+
+def _indexar_imputacion(imputacion: str) -> None:
+    """Abre todos los almacenes guardados de la imputación la primera vez que se abre uno de ellos.
+
+    Sin esto, tras un reinicio el índice de duplicados solo contendría los
+    almacenes de los supervisores que ya han entrado y no marcaría las
+    coincidencias con los demás.
+    """
+    marca = object()
+    # setdefault es atómico: solo la primera sesión que llega recorre el disco
+    if get_imputaciones_indexadas().setdefault(imputacion, marca) is not marca:
+        return
+    for jefe in conjuntos_guardados(imputacion):
+        get_almacen(imputacion, jefe)
+
+
+def get_almacen(imputacion: str, jefe: str) -> AlmacenIncidencias:
+    almacenes = get_almacenes()
+    almacen = almacenes.get((imputacion, jefe))
+    if almacen is None:
+        if AUTOGUARDADO:
+            nuevo = AlmacenIncidencias(imputacion, jefe, PuntoGuardado(directorio_guardado(imputacion, jefe), ESQUEMA_GUARDADO),
+                                       get_guardado_diferido())
+        else:
+            nuevo = AlmacenIncidencias(imputacion, jefe)
+        # setdefault es atómico: no hace falta un cerrojo global para crear el almacén
+        almacen = almacenes.setdefault((imputacion, jefe), nuevo)
+    # Quien llegue mientras otro restaura espera en el cerrojo del almacén
+    almacen.restaurar()
+    if AUTOGUARDADO:
+        _indexar_imputacion(imputacion)
+    return almacen
+
+
+def _nueva_version_vista() -> None:
+    """La vista de la sesión cambió: el frame del export cacheado con la versión anterior deja de valer"""
+    st.session_state.version_vista = uuid.uuid4().hex
+
+
+REGLAS_JORNADA = DEFAULT_REGLAS
+
+
+def registro_reglas(inc: Incidencia, data_manager: 'OptimizedDataManager') -> Dict:
+    """Fila de entrada del motor de reglas: jornada del trabajador y si su convenio paga nocturnidad"""
+    empleado = data_manager.get_empleado_info(inc.trabajador) if inc.trabajador else {}
+    return {
+        'trabajador': inc.trabajador,
+        'fecha': inc.fecha,
+        'incidencia_horas': inc.incidencia_horas,
+        'nocturnidad_horas': inc.nocturnidad_horas,
+        'porcen_contrato': empleado.get('porcen_contrato'),
+        'nocturnidad_permitida': data_manager.precio_incidencia(inc) > 0,
+    }
+
 # =============================================================================
 # DATA MANAGER OPTIMIZADO
 # =============================================================================
 
 class OptimizedDataManager:
+    # Código de tarifa de un par (categoría, convenio) sin tarifa: apunta al 0.0 final del array de precios
+    SIN_TARIFA = -1
+
     def __init__(self):
         self.file_path = 'data/maestros.xlsx'
         
@@ -181,6 +844,9 @@ class OptimizedDataManager:
         
         # Lookup tables para búsquedas rápidas
         self._tarifa_lookup = None
+        self._tarifa_codigos = None
+        self._tarifa_precios = None
+        self._cuenta_lookup = None
         self._empleado_lookup = None
         self._jefes_list = None
         self._empleados_list = None
@@ -200,35 +866,36 @@ class OptimizedDataManager:
     @property
     def df_trabajadores(self) -> pd.DataFrame:
         if self._df_trabajadores is None:
-            df = _load_single_sheet(self.file_path, 'trabajadores')
-            df = preprocess_trabajadores(df)
+            with perfil.etapa('df_trabajadores'):
+                df = _load_single_sheet(self.file_path, 'trabajadores')
+                df = preprocess_trabajadores(df)
             
-            # Merge con centros
-            if not df.empty and not self.df_centros.empty and 'cod_crown' in df.columns:
-                df['cod_crown'] = df['cod_crown'].astype(str)
-                df = pd.merge(
-                    df,
-                    self.df_centros[['codigo_centro', 'nombre_jefe_ope']],
-                    left_on='cod_crown',
-                    right_on='codigo_centro',
-                    how='left'
-                ).drop(columns='codigo_centro')
+                # Merge con centros
+                if not df.empty and not self.df_centros.empty and 'cod_crown' in df.columns:
+                    df['cod_crown'] = df['cod_crown'].astype(str)
+                    df = pd.merge(
+                        df,
+                        self.df_centros[['codigo_centro', 'nombre_jefe_ope']],
+                        left_on='cod_crown',
+                        right_on='codigo_centro',
+                        how='left'
+                    ).drop(columns='codigo_centro')
             
-            # Merge con maestro_centros
-            df_maestro = preprocess_maestro_centros(
-                _load_single_sheet(self.file_path, 'maestro_centros')
-            )
-            if not df.empty and not df_maestro.empty and 'centro_preferente' in df.columns:
-                df['centro_preferente'] = df['centro_preferente'].astype(str).str.replace('.0', '', regex=False)
-                df_maestro['codigo_centro'] = df_maestro['codigo_centro'].astype(str)
+                # Merge con maestro_centros
+                df_maestro = preprocess_maestro_centros(
+                    _load_single_sheet(self.file_path, 'maestro_centros')
+                )
+                if not df.empty and not df_maestro.empty and 'centro_preferente' in df.columns:
+                    df['centro_preferente'] = df['centro_preferente'].astype(str).str.replace('.0', '', regex=False)
+                    df_maestro['codigo_centro'] = df_maestro['codigo_centro'].astype(str)
                 
-                df = pd.merge(
-                    df,
-                    df_maestro[['codigo_centro', 'nombre_centro']],
-                    left_on='centro_preferente',
-                    right_on='codigo_centro',
-                    how='left'
-                ).rename(columns={'codigo_centro': 'codigo_centro_preferente', 'nombre_centro': 'nombre_centro_preferente'})
+                    df = pd.merge(
+                        df,
+                        df_maestro[['codigo_centro', 'nombre_centro']],
+                        left_on='centro_preferente',
+                        right_on='codigo_centro',
+                        how='left'
+                    ).rename(columns={'codigo_centro': 'codigo_centro_preferente', 'nombre_centro': 'nombre_centro_preferente'})
             
             self._df_trabajadores = df
         return self._df_trabajadores
@@ -252,6 +919,12 @@ class OptimizedDataManager:
                         continue
         return lookup
 
+    @st.cache_data
+    def _build_cuenta_lookup(_self, file_path: str) -> Dict[str, str]:
+        """Compilar el mapeo motivo -> columna de cuenta una sola vez"""
+        return preprocess_cuenta_motivos(_load_single_sheet(file_path, 'cuenta_motivos'))
+
+    @perfil.medido()  # Fuera de la caché: un acierto también copia el diccionario entero
     @st.cache_data
     def _build_empleado_lookup(_self, df_trabajadores: pd.DataFrame) -> Dict[str, Dict]:
         """Construir lookup table de empleados - O(1) lookup"""
@@ -282,9 +955,17 @@ class OptimizedDataManager:
 
     def _ensure_cache_built(self):
         """Construir todas las lookup tables si no existen"""
-        if not self._cache_built:
+        if self._cache_built:
+            return
+        with trazas.tramo('_ensure_cache_built'):
             # Lookup de tarifas
             self._tarifa_lookup = self._build_tarifa_lookup(self.file_path)
+            # Claves de tarifa codificadas: código -> posición en el array de precios
+            self._tarifa_codigos = {clave: codigo for codigo, clave in enumerate(self._tarifa_lookup)}
+            self._tarifa_precios = np.array([*self._tarifa_lookup.values(), 0.0])
+            
+            # Lookup de cuentas por motivo
+            self._cuenta_lookup = self._build_cuenta_lookup(self.file_path)
             
             # Lookup de empleados
             self._empleado_lookup = self._build_empleado_lookup(self.df_trabajadores)
@@ -310,20 +991,57 @@ class OptimizedDataManager:
             
             self._cache_built = True
 
+    @staticmethod
+    def _clave_tarifa(categoria, cod_convenio) -> Optional[Tuple[str, str]]:
+        """Clave normalizada de la tabla de tarifas; None si falta la categoría o el convenio"""
+        categoria_norm = str(categoria).strip().upper() if pd.notna(categoria) else ""
+        convenio_norm = str(cod_convenio).strip() if pd.notna(cod_convenio) else ""
+        return (categoria_norm, convenio_norm) if categoria_norm and convenio_norm else None
+
+    def codigo_tarifa(self, categoria: str, cod_convenio: str) -> int:
+        """Código de la tarifa del par (SIN_TARIFA si no tiene); se normaliza aquí una sola vez"""
+        self._ensure_cache_built()
+        return self._tarifa_codigos.get(self._clave_tarifa(categoria, cod_convenio), self.SIN_TARIFA)
+
+    def codigos_tarifa(self, categorias: Sequence, convenios: Sequence) -> np.ndarray:
+        """codigo_tarifa de muchos pares: cada par distinto se normaliza una sola vez"""
+        self._ensure_cache_built()
+        pares, unicos = pd.factorize(pd.Series(list(zip(categorias, convenios)), dtype=object))
+        codigos = np.fromiter(
+            (self._tarifa_codigos.get(self._clave_tarifa(categoria, convenio), self.SIN_TARIFA) for categoria, convenio in unicos),
+            dtype=np.intp, count=len(unicos)
+        )
+        return codigos[pares]
+
     def get_precio_nocturnidad(self, categoria: str, cod_convenio: str) -> float:
         """Lookup O(1) optimizado"""
+        return float(self._tarifa_precios[self.codigo_tarifa(categoria, cod_convenio)])
+
+    def get_precios_nocturnidad(self, categorias: Sequence, convenios: Sequence) -> np.ndarray:
+        """Precios de nocturnidad de muchos pares (categoría, convenio) en una llamada"""
+        return self._tarifa_precios[self.codigos_tarifa(categorias, convenios)]
+
+    def precio_incidencia(self, inc: Incidencia) -> float:
+        """Precio de nocturnidad desde el código de tarifa de la incidencia (se codifica si aún no lo tiene)"""
+        if inc.cod_tarifa is None:
+            inc.cod_tarifa = self.codigo_tarifa(inc.categoria, inc.cod_reg_convenio)
         self._ensure_cache_built()
-        
-        if not self._tarifa_lookup:
-            return 0.0
-            
-        categoria_norm = str(categoria).strip().upper() if pd.notna(categoria) else ""
-        convenio_norm = str(cod_convenio).strip() if pd.notna(cod_convenio) else ""
-        
-        if not categoria_norm or not convenio_norm:
-            return 0.0
-        
-        return self._tarifa_lookup.get((categoria_norm, convenio_norm), 0.0)
+        return float(self._tarifa_precios[inc.cod_tarifa])
+
+    def precios_incidencias(self, incidencias: Sequence[Incidencia]) -> np.ndarray:
+        """Precio de nocturnidad de cada incidencia, indexando el array de precios con sus códigos de tarifa"""
+        sin_codigo = [inc for inc in incidencias if inc.cod_tarifa is None]
+        if sin_codigo:
+            codigos = self.codigos_tarifa([inc.categoria for inc in sin_codigo], [inc.cod_reg_convenio for inc in sin_codigo])
+            for inc, codigo in zip(sin_codigo, codigos.tolist()):
+                inc.cod_tarifa = codigo
+        self._ensure_cache_built()
+        return self._tarifa_precios[np.fromiter((inc.cod_tarifa for inc in incidencias), dtype=np.intp, count=len(incidencias))]
+
+    def get_cuenta_columnas(self) -> Dict[str, str]:
+        """Mapeo pre-compilado motivo -> columna de cuenta del export"""
+        self._ensure_cache_built()
+        return self._cuenta_lookup
 
     def get_empleado_info(self, nombre_empleado: str) -> Dict:
         """Lookup O(1) optimizado"""
@@ -355,11 +1073,20 @@ class OptimizedTablaIncidencias:
     def __init__(self, data_manager: OptimizedDataManager):
         self.data_manager = data_manager
 
+    @trazas.cronometrado()
     def render(self, selected_jefe: str) -> None:
         st.header("📋 Registro de Incidencias de Personal")
         
         incidencias = st.session_state.incidencias
         
+        if st.session_state.conflictos:
+            st.warning("⚠️ Otro editor cambió antes estas filas y se ha conservado su versión: "
+                       + ", ".join(dict.fromkeys(st.session_state.conflictos)))
+            st.session_state.conflictos = []
+        error_guardado = get_almacen(st.session_state.selected_imputacion, selected_jefe).error_guardado
+        if error_guardado:
+            st.warning(f"⚠️ No se pudo autoguardar en disco ({error_guardado}); se reintenta con el siguiente cambio")
+        
         with st.expander("Añadir Nueva Incidencia"):
             self._render_add_form(selected_jefe)
         
@@ -395,7 +1122,7 @@ class OptimizedTablaIncidencias:
                 key="num_rows_unificado"
             )
 
-        if st.button("➕ Añadir a la tabla"):
+        if st.button("➕ Añadir a la tabla", key="anadir_incidencia"):
             self._add_incidencia(trabajador_seleccionado, num_rows, selected_jefe)
             
 
@@ -409,25 +1136,111 @@ class OptimizedTablaIncidencias:
         for _ in range(num_rows):
             incidencia = Incidencia(imputacion_nomina=st.session_state.selected_imputacion)
             self._actualizar_datos_empleado(incidencia, nombre_trabajador, selected_jefe)
-            incidents.append(incidencia)
+            if self._escribir(IncidenciaChangeLog.ALTA, incidencia):
+                incidents.append(incidencia)
         
         st.session_state.incidencias = incidents
         st.success(f"Agregado {num_rows} fila(s) para {nombre_trabajador}")
         st.rerun()
 
+    def _propagar_cambio(self, operacion: str, incidencia: Incidencia) -> None:
+        """Lleva un alta, modificación o baja a la versión de la vista y a los índices de la sesión (O(1) cada uno)"""
+        _nueva_version_vista()
+        if operacion == IncidenciaChangeLog.BAJA:
+            st.session_state.metricas.quitar(incidencia)
+            st.session_state.reglas.quitar(incidencia.id_incidencia)
+        else:
+            st.session_state.metricas.actualizar(incidencia, self.data_manager)
+            st.session_state.reglas.actualizar(incidencia.id_incidencia, registro_reglas(incidencia, self.data_manager))
+
+    @staticmethod
+    def _almacen() -> AlmacenIncidencias:
+        return get_almacen(st.session_state.selected_imputacion, st.session_state.selected_jefe)
+
+    def _escribir(self, operacion: str, incidencia: Incidencia) -> bool:
+        """Compare-and-swap contra el almacén compartido sobre la versión que leyó esta sesión.
+
+        Si otro editor cambió la fila entretanto, el cambio local se descarta:
+        la siguiente sincronización trae la versión vigente.
+        """
+        almacen = self._almacen()
+        versiones = st.session_state.versiones
+        leida = versiones.get(incidencia.id_incidencia, 0)
+        if operacion == IncidenciaChangeLog.BAJA:
+            ok = almacen.borrar(incidencia, leida)
+            if ok:
+                versiones.pop(incidencia.id_incidencia, None)
+        else:
+            ok, version = almacen.cas(incidencia, leida)
+            if ok:
+                versiones[incidencia.id_incidencia] = version
+        if ok:
+            self._propagar_cambio(operacion, incidencia)
+        else:
+            st.session_state.conflictos.append(incidencia.trabajador or incidencia.id_incidencia)
+        return ok
+
+    @trazas.cronometrado()
+    def sincronizar(self) -> None:
+        """Trae los cambios que otros editores escribieron en el almacén desde la última sincronización"""
+        seq, cambios, completo = self._almacen().cambios_desde(st.session_state.almacen_seq, st.session_state.sesion_id)
+        st.session_state.almacen_seq = seq
+        versiones = st.session_state.versiones
+        if completo:
+            # La vista llevaba tanto sin sincronizar que el almacén ya recortó esas escrituras: llegan sus
+            # filas vigentes, y las que la vista tenga y no estén se borraron
+            vigentes = {id_incidencia for id_incidencia, _, _ in cambios}
+            cambios += [(id_incidencia, 0, None) for id_incidencia in versiones if id_incidencia not in vigentes]
+        cambios = [c for c in cambios if c[2] is None and c[0] in versiones or c[2] is not None and c[1] > versiones.get(c[0], 0)]
+        if not cambios:
+            return
+        if not versiones:
+            self._cargar(cambios)
+            return
+
+        incidencias = st.session_state.incidencias
+        posiciones = {inc.id_incidencia: i for i, inc in enumerate(incidencias)}
+        borradas = set()
+        for id_incidencia, version, copia in cambios:
+            if copia is None:
+                borradas.add(id_incidencia)
+                versiones.pop(id_incidencia, None)
+                self._propagar_cambio(IncidenciaChangeLog.BAJA, incidencias[posiciones[id_incidencia]])
+                continue
+            versiones[id_incidencia] = version
+            if id_incidencia in posiciones:
+                local = incidencias[posiciones[id_incidencia]]
+                local.__dict__.update(copia.__dict__)
+                self._propagar_cambio(IncidenciaChangeLog.MODIFICACION, local)
+            else:
+                posiciones[id_incidencia] = len(incidencias)
+                incidencias.append(copia)
+                self._propagar_cambio(IncidenciaChangeLog.ALTA, copia)
+        if borradas:
+            st.session_state.incidencias = [inc for inc in incidencias if inc.id_incidencia not in borradas]
+        st.session_state.derivados.descartar('pagina')
+
+    def _cargar(self, cambios: List[Tuple[str, int, Optional[Incidencia]]]) -> None:
+        """Primera sincronización de la vista (almacén recién abierto o restaurado): carga masiva.
+
+        Las métricas se suman fila a fila, pero las reglas de jornada se
+        evalúan una sola vez sobre todo el conjunto en vez de grupo a grupo.
+        """
+        metricas = st.session_state.metricas
+        versiones = st.session_state.versiones
+        incidencias = []
+        for id_incidencia, version, copia in cambios:
+            versiones[id_incidencia] = version
+            incidencias.append(copia)
+            metricas.actualizar(copia, self.data_manager)
+        # Cargar no es dar de alta: el registro de cambios del export es del almacén
+        _nueva_version_vista()
+        st.session_state.reglas.cargar({inc.id_incidencia: registro_reglas(inc, self.data_manager) for inc in incidencias})
+        st.session_state.incidencias = incidencias
+        st.session_state.derivados.descartar('pagina')
+
     def _actualizar_datos_empleado(self, incidencia: Incidencia, nombre_trabajador: str, jefe: str):
-        if nombre_trabajador:
-            empleado_info = self.data_manager.get_empleado_info(nombre_trabajador)
-            if empleado_info:
-                incidencia.trabajador = empleado_info.get('nombre_empleado', '')
-                incidencia.categoria = empleado_info.get('cat_empleado', '')
-                incidencia.servicio = empleado_info.get('servicio', '')
-                incidencia.centro_preferente = empleado_info.get('centro_preferente')
-                incidencia.codigo_crown_origen = empleado_info.get('cod_crown')
-                incidencia.cod_reg_convenio = empleado_info.get('cod_reg_convenio', '')
-                incidencia.coste_hora = empleado_info.get('coste_hora', 0.0)
-                empleado_jefe = empleado_info.get('nombre_jefe_ope', '')
-                incidencia.nombre_jefe_ope = empleado_jefe if empleado_jefe else "N/A"
+        enriquecer_incidencia(incidencia, nombre_trabajador, self.data_manager)
 
     def _render_main_table_paginated(self, incidencias: List[Incidencia], selected_jefe: str) -> None:
         total_incidencias = len(incidencias)
@@ -456,17 +1269,15 @@ class OptimizedTablaIncidencias:
         # Renderizar tabla para esta página solamente
         self._render_table_page(incidencias_pagina, selected_jefe, start_idx)
 
+    @trazas.cronometrado()
     def _render_table_page(self, incidencias_pagina: List[Incidencia], selected_jefe: str, start_idx: int) -> None:
-        # Optimización: Solo actualizar si hay cambios reales
-        cache_key = "table_data_hash"
+        # Optimización: Solo actualizar si hay cambios reales (el frame puede expulsarse y se reconstruye aquí)
         current_hash = self._get_incidencias_hash(incidencias_pagina)
-        
-        if cache_key not in st.session_state or st.session_state[cache_key] != current_hash:
-            # Pre-calcular todos los precios de nocturnidad en una sola pasada
-            precios_nocturnidad = []
-            for inc in incidencias_pagina:
-                precio = self.data_manager.get_precio_nocturnidad(inc.categoria, inc.cod_reg_convenio)
-                precios_nocturnidad.append(precio)
+
+        @perfil.medido('pagina')
+        def construir_pagina() -> pd.DataFrame:
+            # Todos los precios de nocturnidad en una sola indexación por código de tarifa
+            precios_nocturnidad = self.data_manager.precios_incidencias(incidencias_pagina)
             
             # Crear DataFrame una sola vez
             df_data = []
@@ -475,9 +1286,9 @@ class OptimizedTablaIncidencias:
             
             df = pd.DataFrame(df_data)
             
-            # Manejo seguro de fechas
+            # Fechas: una sola conversión vectorizada (ya se almacenan como Timestamp)
             if not df.empty and 'Fecha' in df.columns:
-                df['Fecha'] = df['Fecha'].apply(self._format_fecha_safe)
+                df['Fecha'] = normalize_fechas(df['Fecha'])
                 
             # 🔧 Normalización de columnas numéricas
             numeric_cols = [
@@ -488,23 +1299,39 @@ class OptimizedTablaIncidencias:
             for col in numeric_cols:
                 if col in df.columns:
                     df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+            return df
 
-            # Guardar en cache
-            st.session_state.cached_df = df
-            st.session_state[cache_key] = current_hash
-        else:
-            df = st.session_state.cached_df
+        df = st.session_state.derivados.obtener('pagina', current_hash, construir_pagina)
 
         if df.empty:
             st.info("No hay datos para mostrar")
             return
 
+        # Duplicados: consulta O(1) por fila al índice compartido, fuera de la caché de la página
+        indice = get_indice_duplicados()
+        duplicadas = [indice.es_duplicada(inc) for inc in incidencias_pagina]
+        # Reglas de jornada: máscara fila x regla de la página, leída del motor sin reevaluar
+        reglas = st.session_state.reglas
+        mascara = reglas.mascara([inc.id_incidencia for inc in incidencias_pagina])
+        df = df.copy()
+        df.insert(1, "Duplicada", duplicadas)
+        df.insert(2, "Reglas", [", ".join(DESCRIPCION_REGLAS[r] for r in mascara.columns[fila]) for fila in mascara.to_numpy()])
+        if reglas.n_infracciones:
+            st.error(f"⛔ {reglas.n_infracciones} filas incumplen las reglas de jornada (ver columna 'Reglas')")
+        for inc, duplicada in zip(incidencias_pagina, duplicadas):
+            if duplicada:
+                otros = ", ".join(indice.otros_propietarios(inc)) or selected_jefe
+                st.warning(f"⚠️ {inc.trabajador} ({inc.motivo}, {inc.fecha:%d/%m/%Y}, centro {inc.codigo_crown_destino}) "
+                           f"ya está registrada por: {otros}")
+
         # Configuración de columnas
         todos_empleados = self.data_manager.get_all_employees()
         centros_crown = self.data_manager.get_centros_crown()
 
         column_config = {
             "Borrar": st.column_config.CheckboxColumn("Borrar", help="Selecciona las filas a borrar", default=False),
+            "Reglas": st.column_config.TextColumn("⛔ Reglas", help="Reglas de jornada que incumple la fila", disabled=True, width="medium"),
+            "Duplicada": st.column_config.CheckboxColumn("Duplicada", help="Mismo trabajador, fecha, motivo y centro destino que otra incidencia", disabled=True),
             "Trabajador": st.column_config.SelectboxColumn("Trabajador", options=[""] + todos_empleados, required=True, width="medium"),
             "Imputación Nómina": st.column_config.SelectboxColumn("Imputación Nómina", options=[""] + ["01 Enero", "02 Febrero", "03 Marzo", "04 Abril", "05 Mayo", "06 Junio", "07 Julio", "08 Agosto", "09 Septiembre", "10 Octubre", "11 Noviembre", "12 Diciembre"], required=True, width="small", disabled=True),
             "Facturable": st.column_config.SelectboxColumn("Facturable", options=["", "Sí", "No"], required=True, width="small"),
@@ -536,24 +1363,9 @@ class OptimizedTablaIncidencias:
 )
 
         # Botón para guardar cambios
-        if st.button("💾 Guardar cambios"):
+        if st.button("💾 Guardar cambios", key="guardar_cambios"):
             self._process_page_changes(start_idx, selected_jefe)
 
-    def _format_fecha_safe(self, fecha):
-        """Formateo seguro de fechas"""
-        if fecha is None or pd.isna(fecha):
-            return pd.NaT
-        if isinstance(fecha, datetime):
-            return fecha
-        if isinstance(fecha, str):
-            try:
-                fecha_dt = pd.to_datetime(fecha, errors='coerce')
-                return fecha_dt if not pd.isna(fecha_dt) else pd.NaT
-            except:
-                return pd.NaT
-        return pd.NaT
-
-
     def _get_incidencias_hash(self, incidencias: List[Incidencia]) -> str:
         """Genera hash para detectar cambios en las incidencias"""
         data = []
@@ -561,16 +1373,50 @@ class OptimizedTablaIncidencias:
             data.append(f"{inc.trabajador}|{inc.motivo}|{inc.fecha}|{inc.incidencia_horas}|{inc.incidencia_precio}")
         return hashlib.md5("||".join(data).encode()).hexdigest()
 
+    @trazas.cronometrado()
     def _process_page_changes(self, start_idx: int, selected_jefe: str) -> None:
         """Procesa cambios solo de la página actual"""
+        if not self._aplicar_cambios_pagina(start_idx, selected_jefe):
+            return
+        
+        if st.session_state.conflictos:
+            st.warning("⚠️ Algunas filas las había cambiado otro editor; se recargan con su versión")
+        else:
+            st.success("✅ ¡Cambios guardados con éxito!")
+        st.rerun()
+
+    def guardar_pendientes(self) -> int:
+        """Guarda en el almacén las ediciones de la página aún sin guardar, sin aplicar los borrados marcados.
+
+        Se llama antes de vaciar la vista al cambiar de jefe o imputación.
+        Devuelve el número de filas editadas.
+        """
+        editor_key = f"unificado_editor_page_{st.session_state.get('current_page', 1)}"
+        edited_rows = st.session_state.get(editor_key, {}).get("edited_rows", {})
+        editadas = sum(1 for row_data in edited_rows.values() if set(row_data) - {"Borrar"})
+        if editadas:
+            start_idx = (st.session_state.get('current_page', 1) - 1) * self.ROWS_PER_PAGE
+            self._aplicar_cambios_pagina(start_idx, st.session_state.selected_jefe, borrar=False)
+        return editadas
+
+    def _aplicar_cambios_pagina(self, start_idx: int, selected_jefe: str, borrar: bool = True) -> bool:
+        """Escribe en el almacén las ediciones (y, con borrar, los borrados) de la página; False si no hay editor"""
         editor_key = f"unificado_editor_page_{st.session_state.get('current_page', 1)}"
         
         if editor_key not in st.session_state:
-            return
+            return False
             
         edited_rows = st.session_state[editor_key]["edited_rows"]
         incidents_to_update = st.session_state.incidencias
         
+        # El editor devuelve las fechas como str: convertir todo el lote de una vez
+        filas_con_fecha = [idx for idx, row_data in edited_rows.items() if "Fecha" in row_data]
+        fechas_editadas = {}
+        if filas_con_fecha:
+            fechas = normalize_fechas([edited_rows[idx]["Fecha"] for idx in filas_con_fecha])
+            for idx, fecha in zip(filas_con_fecha, fechas):
+                fechas_editadas[idx] = None if pd.isna(fecha) else fecha
+        
         for local_row_idx, row_data in edited_rows.items():
             global_row_idx = start_idx + local_row_idx
             
@@ -602,7 +1448,15 @@ class OptimizedTablaIncidencias:
             
             for field_name, value in row_data.items():
                 if field_name in attr_map and field_name != "Trabajador":
+                    if field_name == "Fecha":
+                        value = fechas_editadas[local_row_idx]
                     setattr(incidencia, attr_map[field_name], value)
+            
+            self._escribir(IncidenciaChangeLog.MODIFICACION, incidencia)
+        
+        if not borrar:
+            st.session_state.derivados.descartar('pagina')
+            return True
         
         # Eliminar filas marcadas para borrar
         new_incidents = []
@@ -611,43 +1465,63 @@ class OptimizedTablaIncidencias:
             if start_idx <= i < start_idx + self.ROWS_PER_PAGE:
                 if not edited_rows.get(local_idx, {}).get("Borrar", False):
                     new_incidents.append(inc)
+                elif not self._escribir(IncidenciaChangeLog.BAJA, inc):
+                    new_incidents.append(inc)  # Otro editor la cambió: se conserva
             else:
                 new_incidents.append(inc)
         
         st.session_state.incidencias = new_incidents
         
         # Limpiar cache para forzar recálculo en próximo render
-        if "table_data_hash" in st.session_state:
-            del st.session_state["table_data_hash"]
-        if "cached_df" in st.session_state:
-            del st.session_state["cached_df"]
-        
-        st.success("✅ ¡Cambios guardados con éxito!")
-        st.rerun()
+        st.session_state.derivados.descartar('pagina')
+        return True
 
 # =============================================================================
 # EXPORT MANAGER OPTIMIZADO
 # =============================================================================
 
 class OptimizedExportManager:
+    EXPORT_DTYPES = EXPORT_DTYPES
+    NUMBER_FORMATS = EXPORT_NUMBER_FORMATS
+    COSTING = DEFAULT_COSTING
+    # Filas por bloque en los exports en segundo plano: granularidad del avance y de la cancelación
+    BLOQUE_AVANCE = 10_000
+    BLOQUE_AVANCE_XLSX = 1_000  # El Excel escribe celda a celda: bloques más cortos
+
+    # Hojas de resumen del Excel: nombre de hoja -> dimensión de agrupación
+    SUMMARY_DIMENSIONS = {
+        'resumen_centro': 'codigo_crown_destino',
+        'resumen_motivo': 'motivo',
+        'resumen_categoria': 'categoria',
+    }
+    # Dimensiones de la sección de análisis: etiqueta -> columna del export
+    ANALYTICS_DIMENSIONS = {
+        'Centro destino': 'codigo_crown_destino',
+        'Motivo': 'motivo',
+        'Categoría': 'categoria',
+        'Servicio': 'servicio',
+        'Día': 'fecha',
+    }
+
+    @staticmethod
+    def build_export_frame(incidencias: List[Incidencia], data_manager: OptimizedDataManager) -> Optional[pd.DataFrame]:
+        """DataFrame enriquecido del export (cuentas y coste total) con dtypes explícitos"""
+        df, _ = OptimizedExportManager._build_export(incidencias, data_manager)
+        return df
+
     @staticmethod
-    def export_to_excel(incidencias: List[Incidencia], data_manager: OptimizedDataManager) -> Optional[bytes]:
+    def _build_export(incidencias: List[Incidencia], data_manager: OptimizedDataManager) -> Tuple[Optional[pd.DataFrame], Dict[str, np.ndarray]]:
+        """Frame enriquecido y resultado completo del motor de costes"""
         incidencias_validas = [inc for inc in incidencias if inc.is_valid()]
         if not incidencias_validas:
-            return None
+            return None, {}
         
-        # Pre-calcular todos los precios de nocturnidad en una sola pasada
-        precios_nocturnidad = {}
-        for inc in incidencias_validas:
-            key = (inc.categoria, inc.cod_reg_convenio)
-            if key not in precios_nocturnidad:
-                precios_nocturnidad[key] = data_manager.get_precio_nocturnidad(inc.categoria, inc.cod_reg_convenio)
+        # Todos los precios de nocturnidad en una sola indexación por código de tarifa
+        precios_nocturnidad = data_manager.precios_incidencias(incidencias_validas).tolist()
         
+        indice = get_indice_duplicados()
         data = []
-        for inc in incidencias_validas:
-            key = (inc.categoria, inc.cod_reg_convenio)
-            precio_nocturnidad = precios_nocturnidad[key]
-            
+        for inc, precio_nocturnidad in zip(incidencias_validas, precios_nocturnidad):
             data.append({
                 'jefe_ope': inc.nombre_jefe_ope,
                 'nombre_empleado': inc.trabajador,
@@ -674,97 +1548,395 @@ class OptimizedExportManager:
         
         df = pd.DataFrame(data)
         
-        # Agregar columnas calculadas adicionales para el Excel
-        OptimizedExportManager._add_calculated_columns(df, data_manager)
-        OptimizedExportManager._add_final_calculations(df)
+        # Cuentas y coste total: una pasada del motor de costes
+        costes = add_cost_columns(df, data_manager.get_cuenta_columnas(), OptimizedExportManager.COSTING)
+        df['duplicada'] = [indice.es_duplicada(inc) for inc in incidencias_validas]
+        apply_export_dtypes(df)
+        return df, costes
 
-        excel_buffer = io.BytesIO()
-        df.to_excel(excel_buffer, index=False, engine='openpyxl')
-        excel_buffer.seek(0)
-        return excel_buffer.getvalue()
-    
     @staticmethod
-    def _add_calculated_columns(df: pd.DataFrame, data_manager: OptimizedDataManager) -> None:
-        """Agrega columnas calculadas basadas en los valores de cuenta_motivos."""
-        # Calcular el total de incidencia por fila
-        df['total_incidencia'] = df['incidencia_precio'] * df['incidencia_horas']
-        
-        # Inicializar las columnas calculadas en 0
-        df['73_plus_sustitucion'] = 0.0
-        df['72_incentivos'] = 0.0 
-        df['70_71_festivos'] = 0.0
-        df['74_plus_nocturnidad'] = 0.0
-        
-        # Obtener el mapeo de motivos a cuentas
-        try:
-            df_motivos = _load_single_sheet('data/maestros.xlsx', 'cuenta_motivos')
-        except:
-            df_motivos = pd.DataFrame()
-        
-        if not df_motivos.empty and 'Motivo' in df_motivos.columns and 'desc_cuenta' in df_motivos.columns:
-            # Crear diccionario de mapeo motivo -> código de cuenta
-            motivo_to_cuenta = {}
-            for _, row in df_motivos.iterrows():
-                motivo = row['Motivo']
-                desc_cuenta = str(row['desc_cuenta'])
-                
-                # Extraer el código numérico de desc_cuenta
-                if '70/71' in desc_cuenta:
-                    codigo_cuenta = '70/71'
-                elif desc_cuenta.startswith('73'):
-                    codigo_cuenta = '73'
-                elif desc_cuenta.startswith('72'):
-                    codigo_cuenta = '72'
-                elif desc_cuenta.startswith('74'):
-                    codigo_cuenta = '74'
-                else:
-                    # Intentar extraer el primer número
-                    import re
-                    match = re.search(r'(\d+)', desc_cuenta)
-                    codigo_cuenta = match.group(1) if match else None
-                
-                if codigo_cuenta:
-                    motivo_to_cuenta[motivo] = codigo_cuenta
-            
-            # Aplicar el mapeo y calcular valores para cada fila
-            for idx, row in df.iterrows():
-                motivo = row['motivo']
-                cuenta = motivo_to_cuenta.get(motivo, None)
-                total_incidencia = row['total_incidencia']
-                
-                # Asignar a la columna correspondiente según la cuenta
-                if cuenta == '73':
-                    df.at[idx, '73_plus_sustitucion'] = total_incidencia
-                elif cuenta == '72':
-                    df.at[idx, '72_incentivos'] = total_incidencia
-                elif cuenta in ['70/71', '70', '71']:
-                    df.at[idx, '70_71_festivos'] = total_incidencia
-                elif cuenta == '74':
-                    df.at[idx, '74_plus_nocturnidad'] = 0.0  # Se calcula después
-        
-        # Eliminar la columna auxiliar total_incidencia
-        df.drop('total_incidencia', axis=1, inplace=True)
-    
+    def build_summaries(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """Totales por cuenta y coste total por centro destino, motivo y categoría"""
+        agregados = {
+            'incidencias': ('motivo', 'size'),
+            **{col: (col, 'sum') for col in CUENTA_EXPORT_COLUMNS},
+            'Coste_total': ('Coste_total', 'sum'),
+        }
+        return {
+            hoja: df.groupby(dimension, dropna=False, sort=True).agg(**agregados).reset_index()
+            for hoja, dimension in OptimizedExportManager.SUMMARY_DIMENSIONS.items()
+        }
+
     @staticmethod
-    def _add_final_calculations(df: pd.DataFrame) -> None:
-        """Agrega los cálculos finales"""
-        # 1. Calcular 74_plus_nocturnidad
-        if 'precio_nocturnidad' in df.columns and 'nocturnidad_horas' in df.columns:
-            df['74_plus_nocturnidad'] = df['precio_nocturnidad'] * df['nocturnidad_horas']
-        else:
-            df['74_plus_nocturnidad'] = 0.0
-        
-        # 2. Calcular Coste_total
-        required_cols_coste = ['incidencia_horas', 'incidencia_precio', 'nocturnidad_horas', 'precio_nocturnidad', 'traslados_total']
-        missing_cols = [col for col in required_cols_coste if col not in df.columns]
-        
-        if not missing_cols:
-            coste_incidencias = df['incidencia_horas'] * df['incidencia_precio']
-            coste_nocturnidad = df['nocturnidad_horas'] * df['precio_nocturnidad']
-            coste_con_ss = (coste_incidencias + coste_nocturnidad) * 1.3195
-            df['Coste_total'] = coste_con_ss + df['traslados_total']
+    def build_analytics(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """Coste, horas e incidencias por cada dimensión de análisis, ordenados por coste (día: cronológico)"""
+        agregados = {
+            'incidencias': ('motivo', 'size'),
+            'incidencia_horas': ('incidencia_horas', 'sum'),
+            'nocturnidad_horas': ('nocturnidad_horas', 'sum'),
+            'Coste_total': ('Coste_total', 'sum'),
+        }
+        total = df['Coste_total'].sum()
+        analitica = {}
+        for etiqueta, dimension in OptimizedExportManager.ANALYTICS_DIMENSIONS.items():
+            tabla = df.groupby(dimension, dropna=False, sort=dimension == 'fecha').agg(**agregados)
+            tabla['porcentaje'] = tabla['Coste_total'] / total * 100 if total else 0.0
+            if dimension != 'fecha':
+                tabla = tabla.sort_values('Coste_total', ascending=False)
+            analitica[etiqueta] = tabla.reset_index()
+        return analitica
+
+    @staticmethod
+    def get_analytics(cache: Dict) -> Dict[str, pd.DataFrame]:
+        """Análisis de la versión cacheada; se calcula la primera vez que se pide"""
+        return st.session_state.derivados.obtener(
+            'analitica', cache['version'],
+            lambda: OptimizedExportManager.build_analytics(cache['df']) if cache['df'] is not None else {}
+        )
+
+    @staticmethod
+    def get_export_data(incidencias: List[Incidencia], data_manager: OptimizedDataManager, version: str) -> Dict:
+        """Frame enriquecido, resúmenes y métricas, cacheados en la sesión por versión de datos.
+
+        Las métricas de cabecera y el export salen del mismo resultado del motor de costes.
+        Si el presupuesto de memoria lo expulsa, se recalcula en el siguiente acceso.
+        """
+        def construir() -> Dict:
+            df, costes = OptimizedExportManager._build_export(incidencias, data_manager)
+            return {
+                'version': version,
+                'df': df,
+                'resumenes': OptimizedExportManager.build_summaries(df) if df is not None else {},
+                'metricas': cost_totals(costes) if df is not None else {},
+            }
+        return st.session_state.derivados.obtener('export', version, construir)
+
+    @staticmethod
+    @trazas.cronometrado()
+    @perfil.medido()
+    def export_to_excel(incidencias: List[Incidencia], data_manager: OptimizedDataManager,
+                        writer: str = DEFAULT_EXCEL_WRITER) -> Optional[bytes]:
+        df = OptimizedExportManager.build_export_frame(incidencias, data_manager)
+        if df is None:
+            return None
+        excel_writer = get_excel_writer(writer, OptimizedExportManager.NUMBER_FORMATS)
+        return excel_writer.sheets_to_bytes({
+            'incidencias': df,
+            **OptimizedExportManager.build_summaries(df),
+        })
+
+    @staticmethod
+    def iter_export(incidencias: List[Incidencia], data_manager: OptimizedDataManager, formato: str) -> Optional[Iterator[bytes]]:
+        """Export en streaming (csv, parquet, jsonl) con las mismas columnas que el Excel"""
+        df = OptimizedExportManager.build_export_frame(incidencias, data_manager)
+        if df is None:
+            return None
+        return iter_stream_format(df, formato)
+
+    @staticmethod
+    def export_to_format(incidencias: List[Incidencia], data_manager: OptimizedDataManager, formato: str) -> Optional[FicheroExport]:
+        """Export en el formato pedido: 'xlsx' o cualquiera de STREAM_FORMATS"""
+        df = OptimizedExportManager.build_export_frame(incidencias, data_manager)
+        if df is None:
+            return None
+        resumenes = OptimizedExportManager.build_summaries(df) if formato == 'xlsx' else None
+        return OptimizedExportManager.generar_export(df, formato, resumenes=resumenes)
+
+    @staticmethod
+    def iter_export_partitioned(incidencias: List[Incidencia], data_manager: OptimizedDataManager,
+                                key: str, formato: str = 'xlsx') -> Optional[Iterator[bytes]]:
+        """Zip con un fichero por valor de key (codigo_crown_destino o empresa_destino)"""
+        df = OptimizedExportManager.build_export_frame(incidencias, data_manager)
+        if df is None:
+            return None
+        return iter_partitioned_zip(df, key, formato, OptimizedExportManager.NUMBER_FORMATS)
+
+    @staticmethod
+    def build_delta_frame(cambios: List[Tuple[str, Incidencia]], data_manager: OptimizedDataManager) -> Optional[pd.DataFrame]:
+        """Export de los cambios netos (AlmacenIncidencias.cambios_export), con columnas operacion e id_incidencia.
+
+        'alta' y 'modificacion' llevan la fila completa (upsert por id_incidencia);
+        'baja' solo el id. Una modificación que deja la incidencia incompleta se
+        emite como baja porque deja de ser exportable.
+        """
+        upserts, bajas = [], []
+        for operacion, inc in cambios:
+            if operacion != IncidenciaChangeLog.BAJA and inc.is_valid():
+                upserts.append((operacion, inc))
+            elif operacion != IncidenciaChangeLog.ALTA:
+                bajas.append(inc.id_incidencia)
+        if not upserts and not bajas:
+            return None
+
+        frames = []
+        if upserts:
+            df = OptimizedExportManager.build_export_frame([inc for _, inc in upserts], data_manager)
+            df.insert(0, 'id_incidencia', [inc.id_incidencia for _, inc in upserts])
+            df.insert(0, 'operacion', [operacion for operacion, _ in upserts])
+            frames.append(df)
+        if bajas:
+            frames.append(pd.DataFrame({'operacion': IncidenciaChangeLog.BAJA, 'id_incidencia': bajas}))
+
+        df = pd.concat(frames, ignore_index=True)
+        apply_export_dtypes(df)
+        df['operacion'] = df['operacion'].astype('string')
+        df['id_incidencia'] = df['id_incidencia'].astype('string')
+        return df
+
+    @staticmethod
+    def export_delta(cambios: List[Tuple[str, Incidencia]], data_manager: OptimizedDataManager, formato: str) -> Optional[FicheroExport]:
+        df = OptimizedExportManager.build_delta_frame(cambios, data_manager)
+        if df is None:
+            return None
+        return OptimizedExportManager.generar_export(df, formato)
+
+    @staticmethod
+    def unidades_export(df: pd.DataFrame, formato: str, particion: Optional[str] = None,
+                        resumenes: Optional[Dict[str, pd.DataFrame]] = None) -> int:
+        """Unidades de avance de generar_export: filas escritas, o ficheros del zip"""
+        if particion:
+            return int(df[particion].nunique(dropna=False))
+        if formato == 'xlsx':
+            return len(df) + sum(len(r) for r in (resumenes or {}).values())
+        return len(df)
+
+    @staticmethod
+    @trazas.cronometrado()
+    @perfil.medido()
+    def generar_export(df: pd.DataFrame, formato: str, particion: Optional[str] = None,
+                       resumenes: Optional[Dict[str, pd.DataFrame]] = None,
+                       avance: Optional[Callable[[int], None]] = None) -> FicheroExport:
+        """Fichero completo del export, escrito por bloques en un temporal; avance(n) recibe las unidades hechas tras cada bloque"""
+        avance = avance or (lambda n: None)
+        formatos = OptimizedExportManager.NUMBER_FORMATS
+        if particion:
+            # Una unidad por partición terminada (unidades_export), no por bloque del zip
+            return FicheroExport().escribir_partes(iter_partitioned_zip(df, particion, formato, formatos, progress=avance))
+        bloque = OptimizedExportManager.BLOQUE_AVANCE_XLSX if formato == 'xlsx' else OptimizedExportManager.BLOQUE_AVANCE
+        return frame_to_fichero(df, formato, formatos, resumenes, avance, bloque)
+
+# =============================================================================
+# TRABAJOS DE EXPORT EN SEGUNDO PLANO
+# =============================================================================
+
+# Segundos entre repintados del avance de un export en curso
+INTERVALO_SONDEO_EXPORT = 1.0
+
+
+class ExportCancelado(Exception):
+    """El trabajo se canceló mientras generaba el fichero"""
+
+
+@dataclass
+class TrabajoExport:
+    id_trabajo: str
+    clave: Tuple
+    total: int
+    sesion: str = ''
+    hechas: int = 0
+    estado: str = 'pendiente'
+    resultado: Optional[FicheroExport] = None
+    error: str = ''
+    cancelacion: threading.Event = field(default_factory=threading.Event)
+    futuro: Optional[Future] = None
+
+    @property
+    def progreso(self) -> float:
+        return 1.0 if self.estado == GestorTrabajosExport.LISTO else min(self.hechas / max(self.total, 1), 1.0)
+
+    @property
+    def activo(self) -> bool:
+        return self.estado in (GestorTrabajosExport.PENDIENTE, GestorTrabajosExport.EN_CURSO)
+
+    def avanzar(self, n: int) -> None:
+        """Llamado desde el generador tras cada bloque; también es el punto de cancelación"""
+        if self.cancelacion.is_set():
+            raise ExportCancelado(self.id_trabajo)
+        self.hechas += n
+
+
+class GestorTrabajosExport:
+    """Exports generados en un pool de hilos compartido por todas las sesiones.
+
+    Cada trabajo se identifica por id y por su clave (versión de datos,
+    formato y modo): volver a pedir la misma clave devuelve el trabajo ya
+    hecho o en curso en lugar de generar otra vez. Los resultados terminados
+    (FicheroExport: pasan a disco por encima de unos MB) se guardan en una
+    caché LRU de MAX_RESULTADOS entradas; lo que ocupan en memoria cuenta en
+    el presupuesto de la sesión que los pidió, que puede expulsarlos.
+    """
+    PENDIENTE = 'pendiente'
+    EN_CURSO = 'en_curso'
+    LISTO = 'listo'
+    CANCELADO = 'cancelado'
+    ERROR = 'error'
+
+    MAX_HILOS = 2
+    MAX_RESULTADOS = 16
+
+    def __init__(self, presupuesto: Optional[PresupuestoMemoria] = None):
+        self.presupuesto = presupuesto
+        self._pool = ThreadPoolExecutor(max_workers=self.MAX_HILOS, thread_name_prefix='export')
+        self._lock = threading.Lock()
+        self._trabajos: Dict[str, TrabajoExport] = {}
+        self._por_clave: 'OrderedDict[Tuple, str]' = OrderedDict()
+
+    def buscar(self, clave: Tuple) -> Optional[TrabajoExport]:
+        with self._lock:
+            id_trabajo = self._por_clave.get(clave)
+            if id_trabajo is None:
+                return None
+            self._por_clave.move_to_end(clave)
+            return self._trabajos[id_trabajo]
+
+    def obtener(self, id_trabajo: str) -> Optional[TrabajoExport]:
+        return self._trabajos.get(id_trabajo)
+
+    def enviar(self, clave: Tuple, generar: Callable[[Callable[[int], None]], FicheroExport], total: int,
+               sesion: str = '') -> TrabajoExport:
+        """Encola generar(avance) salvo que la clave ya esté hecha o en curso"""
+        with self._lock:
+            id_existente = self._por_clave.get(clave)
+            if id_existente is not None:
+                existente = self._trabajos[id_existente]
+                if existente.activo or existente.estado == self.LISTO:
+                    return existente
+                del self._trabajos[id_existente]
+            trabajo = TrabajoExport(uuid.uuid4().hex, clave, total, sesion)
+            self._trabajos[trabajo.id_trabajo] = trabajo
+            self._por_clave[clave] = trabajo.id_trabajo
+            self._por_clave.move_to_end(clave)
+            trabajo.futuro = self._pool.submit(self._ejecutar, trabajo, generar)
+            return trabajo
+
+    def cancelar(self, id_trabajo: str) -> None:
+        trabajo = self._trabajos.get(id_trabajo)
+        if trabajo is None or not trabajo.activo:
+            return
+        trabajo.cancelacion.set()
+        if trabajo.futuro is not None and trabajo.futuro.cancel():
+            trabajo.estado = self.CANCELADO  # No había empezado
+
+    def _ejecutar(self, trabajo: TrabajoExport, generar) -> None:
+        if trabajo.cancelacion.is_set():
+            trabajo.estado = self.CANCELADO
+            return
+        trabajo.estado = self.EN_CURSO
+        try:
+            trabajo.resultado = generar(trabajo.avanzar)
+            trabajo.estado = self.LISTO
+        except ExportCancelado:
+            trabajo.estado = self.CANCELADO
+        except Exception as e:
+            trabajo.error = str(e)
+            trabajo.estado = self.ERROR
+        if trabajo.estado == self.LISTO and self.presupuesto is not None:
+            self.presupuesto.registrar(self, trabajo.sesion, trabajo.id_trabajo, trabajo.resultado.en_memoria)
+        self._recortar()
+
+    def _recortar(self) -> None:
+        """Descarta los resultados terminados menos usados por encima de MAX_RESULTADOS"""
+        with self._lock:
+            terminados = [c for c, i in self._por_clave.items() if not self._trabajos[i].activo]
+            descartados = [
+                self._trabajos.pop(self._por_clave.pop(clave)).id_trabajo
+                for clave in terminados[:max(len(terminados) - self.MAX_RESULTADOS, 0)]
+            ]
+        # Fuera del cerrojo propio: el presupuesto llama a _expulsar() con el suyo tomado
+        if self.presupuesto is not None:
+            for id_trabajo in descartados:
+                self.presupuesto.quitar(self, id_trabajo)
+
+    def _expulsar(self, id_trabajo: str) -> None:
+        """El presupuesto de memoria descarta este resultado; se regenera si se vuelve a pedir"""
+        with self._lock:
+            trabajo = self._trabajos.pop(id_trabajo, None)
+            if trabajo is not None and self._por_clave.get(trabajo.clave) == id_trabajo:
+                del self._por_clave[trabajo.clave]
+
+
+@st.cache_resource
+def get_trabajos_export() -> GestorTrabajosExport:
+    """Gestor de trabajos de export único en el proceso"""
+    return GestorTrabajosExport(get_presupuesto_memoria())
+
+# =============================================================================
+# PROCESAMIENTO POR LOTES (SIN INTERFAZ)
+# =============================================================================
+
+# Campos que aporta quien registra la incidencia; el resto sale del maestro de trabajadores
+CAMPOS_ENTRADA = [
+    'trabajador', 'imputacion_nomina', 'facturable', 'motivo', 'codigo_crown_destino', 'empresa_destino',
+    'incidencia_horas', 'incidencia_precio', 'nocturnidad_horas', 'traslados_total', 'fecha', 'observaciones'
+]
+_CAMPOS_NUMERICOS = ['incidencia_horas', 'incidencia_precio', 'nocturnidad_horas', 'traslados_total']
+
+
+def enriquecer_incidencia(incidencia: Incidencia, nombre_trabajador: str, data_manager: OptimizedDataManager) -> bool:
+    """Completa los datos del trabajador desde el maestro; False si no existe"""
+    if not nombre_trabajador:
+        return False
+    # El maestro conserva los espacios finales de algunos nombres: primero tal cual, luego recortado
+    empleado_info = data_manager.get_empleado_info(nombre_trabajador) or data_manager.get_empleado_info(nombre_trabajador.strip())
+    if not empleado_info:
+        return False
+    incidencia.trabajador = empleado_info.get('nombre_empleado', '')
+    incidencia.categoria = empleado_info.get('cat_empleado', '')
+    incidencia.servicio = empleado_info.get('servicio', '')
+    incidencia.centro_preferente = empleado_info.get('centro_preferente')
+    incidencia.codigo_crown_origen = empleado_info.get('cod_crown')
+    incidencia.cod_reg_convenio = empleado_info.get('cod_reg_convenio', '')
+    incidencia.cod_tarifa = data_manager.codigo_tarifa(incidencia.categoria, incidencia.cod_reg_convenio)
+    incidencia.coste_hora = empleado_info.get('coste_hora', 0.0)
+    empleado_jefe = empleado_info.get('nombre_jefe_ope', '')
+    incidencia.nombre_jefe_ope = empleado_jefe if empleado_jefe else "N/A"
+    return True
+
+
+def incidencias_desde_registros(registros: List[Dict], data_manager: OptimizedDataManager) -> Tuple[List[Incidencia], List[Dict]]:
+    """Convierte registros (dicts con CAMPOS_ENTRADA) en incidencias enriquecidas.
+
+    Devuelve las incidencias válidas y una lista de errores {'fila', 'error'}
+    con la posición de cada registro descartado.
+    """
+    # Fechas y números se convierten por columna, una vez por lote
+    valores_fecha = [registro.get('fecha') for registro in registros]
+    fechas = normalize_fechas(valores_fecha)
+    invalidas = fechas_invalidas(valores_fecha, fechas)
+    numericos = {
+        campo: pd.to_numeric(pd.Series([registro.get(campo) for registro in registros], dtype=object),
+                             errors='coerce').fillna(0.0).tolist()
+        for campo in _CAMPOS_NUMERICOS
+    }
+    incidencias, errores = [], []
+    for fila, (registro, fecha) in enumerate(zip(registros, fechas)):
+        if invalidas[fila]:
+            errores.append({'fila': fila, 'error': f"fecha no válida (se espera ISO 8601, AAAA-MM-DD): {registro.get('fecha')!r}"})
+            continue
+        incidencia = Incidencia(
+            **{campo: registro[campo] for campo in CAMPOS_ENTRADA if campo in registro and campo != 'fecha'}
+        )
+        incidencia.fecha = None if pd.isna(fecha) else fecha
+        for campo in _CAMPOS_NUMERICOS:
+            setattr(incidencia, campo, numericos[campo][fila])
+        nombre = str(registro.get('trabajador') or '').upper()
+        if not enriquecer_incidencia(incidencia, nombre, data_manager):
+            errores.append({'fila': fila, 'error': f"trabajador desconocido: {registro.get('trabajador')!r}"})
+        elif not incidencia.is_valid():
+            errores.append({'fila': fila, 'error': "faltan campos obligatorios"})
         else:
-            df['Coste_total'] = 0.0
+            incidencias.append(incidencia)
+    return incidencias, errores
+
+
+def procesar_lote(registros: List[Dict], data_manager: OptimizedDataManager) -> Tuple[Optional[pd.DataFrame], Dict[str, np.ndarray], List[Dict]]:
+    """Enriquecer, validar y costear un lote con el mismo motor que el export de la aplicación.
+
+    Devuelve el frame del export, el resultado del motor de costes y los errores por fila.
+    """
+    incidencias, errores = incidencias_desde_registros(registros, data_manager)
+    df, costes = OptimizedExportManager._build_export(incidencias, data_manager)
+    return df, costes, errores
 
 # =============================================================================
 # APLICACIÓN PRINCIPAL OPTIMIZADA
@@ -776,7 +1948,23 @@ class OptimizedIncidenciasApp:
             st.session_state.app_initialized_optimized = True
             st.session_state.selected_jefe = ""
             st.session_state.selected_imputacion = ""
-            st.session_state.incidencias = []
+            st.session_state.sesion_id = uuid.uuid4().hex[:8]
+            # Frames de página, export y análisis: cuentan en el presupuesto de memoria y pueden expulsarse
+            st.session_state.derivados = CacheDerivada(get_presupuesto_memoria(), st.session_state.sesion_id)
+            st.session_state.exports_pedidos = set()
+            st.session_state.aviso_cambio = ""
+            self._reset_incidencias()
+    
+    @staticmethod
+    def _reset_incidencias():
+        """Vacía la vista local de la sesión (nuevo jefe o imputación); la siguiente sincronización carga el almacén"""
+        st.session_state.incidencias = []
+        _nueva_version_vista()
+        st.session_state.metricas = MetricasIncrementales(OptimizedExportManager.COSTING)
+        st.session_state.reglas = MotorReglas(REGLAS_JORNADA)
+        st.session_state.versiones = {}
+        st.session_state.almacen_seq = 0
+        st.session_state.conflictos = []
     
     def run(self):
         # Mostrar indicador de carga solo la primera vez
@@ -790,6 +1978,15 @@ class OptimizedIncidenciasApp:
         else:
             data_manager = st.session_state.data_manager
 
+        self._informar_memoria()
+        if ADMIN:
+            self._render_memoria()
+            if TRAZAS:
+                self._render_trazas()
+                self._render_disparos()
+            if PERFIL_MEMORIA:
+                self._render_perfil_memoria()
+
         if data_manager.df_centros.empty and data_manager.df_trabajadores.empty:
             st.error("⚠️ No se pudieron cargar los datos. Verifica que el archivo 'data/maestros.xlsx' exista y tenga las hojas necesarias.")
             return
@@ -801,10 +1998,14 @@ class OptimizedIncidenciasApp:
             return
             
         tabla_optimizada = OptimizedTablaIncidencias(data_manager)
+        # Cambios de otros editores del mismo supervisor y mes, antes de pintar nada
+        tabla_optimizada.sincronizar()
         tabla_optimizada.render(st.session_state.selected_jefe)
         
         self._render_export_section(data_manager)
+        self._render_analitica(data_manager)
     
+    @trazas.cronometrado()
     def _render_header(self, data_manager: OptimizedDataManager):
         st.title("Plantilla de Registro de Incidencias")
         
@@ -828,31 +2029,51 @@ class OptimizedIncidenciasApp:
                 key="jefe_main"
             )
         
+        if st.session_state.aviso_cambio:
+            st.info(st.session_state.aviso_cambio)
+            st.session_state.aviso_cambio = ""
+        
         # Verificar cambios y actualizar estado
         if new_imputacion != st.session_state.selected_imputacion:
+            self._guardar_antes_de_cambiar(data_manager)
             st.session_state.selected_imputacion = new_imputacion
-            st.session_state.incidencias = []
+            self._reset_incidencias()
             st.rerun()
             
         if new_jefe != st.session_state.selected_jefe:
+            self._guardar_antes_de_cambiar(data_manager)
             st.session_state.selected_jefe = new_jefe
-            st.session_state.incidencias = []
+            self._reset_incidencias()
             st.rerun()
 
+    @staticmethod
+    def _guardar_antes_de_cambiar(data_manager: OptimizedDataManager):
+        """Las ediciones de la tabla sin guardar se perderían al vaciar la vista: van antes al almacén que se deja"""
+        jefe, imputacion = st.session_state.selected_jefe, st.session_state.selected_imputacion
+        if not jefe or not imputacion:
+            return
+        editadas = OptimizedTablaIncidencias(data_manager).guardar_pendientes()
+        if editadas:
+            st.session_state.aviso_cambio = (f"💾 Se han guardado {editadas} filas editadas sin guardar de {jefe} · {imputacion}; "
+                                             "siguen disponibles al volver a seleccionarlos")
+
+    @trazas.cronometrado()
     def _render_export_section(self, data_manager: OptimizedDataManager):
         st.markdown("---")
         st.header("📊 Exportar Datos")
         
-        incidencias_validas = [inc for inc in st.session_state.incidencias if inc.is_valid()]
+        metricas_incrementales = st.session_state.metricas
+        n_validas = metricas_incrementales.n_validas
         
-        if not incidencias_validas:
+        if not n_validas:
             st.warning("⚠️ No hay incidencias válidas para exportar.")
             st.info("💡 Complete todos los campos obligatorios: Trabajador, Imputación Nómina, Facturable, Motivo, Código Crown Destino, Fecha y Observaciones.")
             return
         
-        # Pre-calcular métricas optimizadas
-        with st.spinner("Calculando métricas..."):
-            metricas = self._calculate_metrics_optimized(incidencias_validas, data_manager)
+        # Agregados en curso: leer las métricas no recorre las incidencias
+        metricas = metricas_incrementales.totales()
+        if DEBUG_METRICAS:
+            self._verificar_metricas(data_manager)
 
         col1, col2, col3, col4, col5 = st.columns(5)
         with col1:
@@ -866,61 +2087,326 @@ class OptimizedIncidenciasApp:
         with col5:
             st.metric("📊 Total coste", f"€{metricas['total_con_ss']:,.2f}")
 
-        # Botón de descarga optimizado
-        with st.spinner("Generando Excel..."):
-            excel_data = OptimizedExportManager.export_to_excel(incidencias_validas, data_manager)
-        
-        if excel_data:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"incidencias_{st.session_state.selected_jefe.replace(' ', '_')}_{timestamp}.xlsx"
-            
-            st.download_button(
-                label="💾 Descargar Excel de Incidencias",
-                data=excel_data,
-                file_name=filename,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                help="Descarga todas las incidencias válidas en formato Excel (.xlsx)"
+        col_formato, col_modo = st.columns(2)
+        with col_formato:
+            formato = st.radio(
+                "Formato de descarga:",
+                ['xlsx'] + list(STREAM_FORMATS),
+                horizontal=True,
+                key="export_formato",
+                help="CSV, Parquet y JSON Lines conservan los tipos de columna para la importación de nómina"
+            )
+        with col_modo:
+            modo = st.radio(
+                "Contenido:",
+                ["Completo", "Solo cambios", "Por centro (zip)", "Por empresa (zip)"],
+                horizontal=True,
+                key="export_modo",
+                help="'Solo cambios' emite las altas, modificaciones y bajas desde la última descarga de cambios. "
+                     "Los modos zip generan un fichero por centro destino o por empresa destino."
             )
-            
-            st.success(f"✅ Listo para descargar: {len(incidencias_validas)} incidencias válidas")
 
-    def _calculate_metrics_optimized(self, incidencias_validas: List[Incidencia], data_manager: OptimizedDataManager) -> Dict[str, float]:
-        """Calcula métricas de forma optimizada con cache de precios"""
-        # Pre-calcular precios únicos para evitar lookups repetidos
-        precio_cache = {}
-        
-        monto_total_incidencias = 0.0
-        monto_total_nocturnidad = 0.0
-        monto_total_traslados = 0.0
+        solo_cambios = modo == "Solo cambios"
+
+        # Recuento que lleva el índice compartido: no hace falta el frame del export
+        n_duplicadas = get_indice_duplicados().n_duplicadas((st.session_state.selected_imputacion, st.session_state.selected_jefe))
+        if n_duplicadas:
+            st.warning(f"⚠️ {n_duplicadas} incidencias coinciden en trabajador, fecha, motivo y centro destino "
+                       "con otras registradas; van marcadas en la columna 'duplicada' del export.")
+
+        # Frame del export y resúmenes: se construyen (una vez por versión de datos) solo al abrir los
+        # resúmenes, archivar o generar un fichero, no en cada rerun
+        version = self._version_export()
+
+        def export_data() -> Dict:
+            return OptimizedExportManager.get_export_data(st.session_state.incidencias, data_manager, version)
+
+        self._render_resumenes(export_data)
+        self._render_archivo(export_data)
+        particion = {"Por centro (zip)": 'codigo_crown_destino', "Por empresa (zip)": 'empresa_destino'}.get(modo)
+
+        # Cambios pendientes del almacén: compartidos con los demás editores del mes
+        almacen = get_almacen(st.session_state.selected_imputacion, st.session_state.selected_jefe)
+        if solo_cambios:
+            watermark, cambios = almacen.cambios_export()
+            if not cambios:
+                st.info("No hay cambios desde la última descarga de cambios")
+                return
+
+        # El fichero se genera en segundo plano; la clave identifica el resultado en la caché de trabajos
+        clave = (version, formato, modo, (almacen.watermark_export, watermark) if solo_cambios else None)
+        trabajos = get_trabajos_export()
+        trabajo = trabajos.buscar(clave)
+        if trabajo is None or trabajo.estado in (GestorTrabajosExport.CANCELADO, GestorTrabajosExport.ERROR):
+            if trabajo is not None and trabajo.estado == GestorTrabajosExport.ERROR:
+                st.error(f"❌ Error al generar el export: {trabajo.error}")
+            elif trabajo is not None:
+                st.info("Export cancelado")
+            # Un export ya entregado cuyo resultado expulsó el presupuesto de memoria se regenera sin pedirlo
+            # otra vez (una sola vez: si se vuelve a expulsar antes de entregarse, hay que pedirlo)
+            regenerar = trabajo is None and clave in st.session_state.exports_pedidos
+            st.session_state.exports_pedidos.discard(clave)
+            if not st.button(f"⚙️ Generar {formato.upper()}", key="export_generar") and not regenerar:
+                return
+            if solo_cambios:
+                df_export = OptimizedExportManager.build_delta_frame(cambios, data_manager)
+                if df_export is None:
+                    st.info("No hay cambios desde la última descarga de cambios")
+                    return
+                resumenes = None
+            else:
+                export_cache = export_data()
+                df_export = export_cache['df']
+                # Las hojas de resumen solo van en el Excel
+                resumenes = export_cache['resumenes'] if formato == 'xlsx' else None
+            trabajo = trabajos.enviar(
+                clave,
+                lambda avance, df=df_export, r=resumenes: OptimizedExportManager.generar_export(df, formato, particion, r, avance),
+                OptimizedExportManager.unidades_export(df_export, formato, particion, resumenes),
+                st.session_state.sesion_id,
+            )
+
+        if trabajo.activo:
+            self._render_trabajo_en_curso(trabajo.id_trabajo, formato)
+            return
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if particion:
+            extension, mime = '.zip', "application/zip"
+        elif formato == 'xlsx':
+            extension, mime = '.xlsx', "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        else:
+            _, extension, mime = STREAM_FORMATS[formato]
+        prefijo = "cambios" if solo_cambios else (f"incidencias_por_{particion}" if particion else "incidencias")
+        filename = f"{prefijo}_{supervisor_en_fichero(st.session_state.selected_jefe)}_{timestamp}{extension}"
+
+        st.session_state.exports_pedidos.add(clave)
+        st.download_button(
+            key="export_descargar",
+            label=f"💾 Descargar {formato.upper()} de {'Cambios' if solo_cambios else 'Incidencias'}",
+            # El fichero está en un temporal: se lee entero solo al pulsar (Streamlit no descarga por bloques)
+            data=trabajo.resultado.leer,
+            file_name=filename,
+            mime=mime,
+            help=f"Descarga {'los cambios' if solo_cambios else 'todas las incidencias válidas'} en formato {formato.upper()}",
+            # Al descargar los cambios, el siguiente delta parte de aquí
+            on_click=almacen.avanzar_watermark_export if solo_cambios else None,
+            args=(watermark,) if solo_cambios else None,
+        )
+
+        if solo_cambios:
+            st.success("✅ Listo para descargar: cambios desde la última descarga")
+        else:
+            st.success(f"✅ Listo para descargar: {n_validas} incidencias válidas")
+
+    @staticmethod
+    def _verificar_metricas(data_manager: OptimizedDataManager):
+        """Modo depuración: contrasta los agregados con un recálculo completo, fuera de la caché del export"""
+        ahora = time.monotonic()
+        if ahora - st.session_state.get('metricas_verificadas', 0.0) < INTERVALO_VERIFICACION_METRICAS:
+            return
+        st.session_state.metricas_verificadas = ahora
+        _, costes = OptimizedExportManager._build_export(st.session_state.incidencias, data_manager)
+        metricas = st.session_state.metricas
+        metricas.verificar(cost_totals(costes) if costes else metric_totals(0.0, 0.0, 0.0, config=metricas.config))
+
+    @staticmethod
+    @st.fragment(run_every=INTERVALO_SONDEO_EXPORT)
+    def _render_trabajo_en_curso(id_trabajo: str, formato: str):
+        """Avance del trabajo; se repinta solo este fragmento hasta que termina y entonces la página entera"""
+        trabajo = get_trabajos_export().obtener(id_trabajo)
+        if trabajo is None or not trabajo.activo:
+            st.rerun()
+        st.progress(trabajo.progreso, text=f"Generando {formato.upper()}... {trabajo.progreso:.0%}")
+        st.button("✖️ Cancelar", key="export_cancelar", on_click=get_trabajos_export().cancelar, args=(id_trabajo,))
+
+    @staticmethod
+    def _render_resumenes(export_data: Callable[[], Dict]):
+        """Mismas tablas que las hojas de resumen del Excel; se calculan solo con el desplegable abierto"""
+        expander = st.expander("📈 Resúmenes por cuenta", key="export_resumenes", on_change="rerun")
+        if not expander.open:
+            return
+        resumenes = export_data()['resumenes']
+        with expander:
+            tabs = st.tabs(["Por centro destino", "Por motivo", "Por categoría"])
+            for tab, hoja in zip(tabs, OptimizedExportManager.SUMMARY_DIMENSIONS):
+                with tab:
+                    st.dataframe(resumenes[hoja], hide_index=True, width='stretch')
+
+    @trazas.cronometrado()
+    def _render_analitica(self, data_manager: OptimizedDataManager):
+        """Dónde se va el dinero del mes: coste por dimensión, desde la caché de la versión actual"""
+        if not st.session_state.metricas.n_validas:
+            return
         
-        for inc in incidencias_validas:
-            # Incidencias
-            monto_total_incidencias += inc.incidencia_precio * inc.incidencia_horas
-            
-            # Nocturnidad con cache
-            key = (inc.categoria, inc.cod_reg_convenio)
-            if key not in precio_cache:
-                precio_cache[key] = data_manager.get_precio_nocturnidad(inc.categoria, inc.cod_reg_convenio)
-            
-            precio_noct = precio_cache[key]
-            monto_total_nocturnidad += precio_noct * inc.nocturnidad_horas
-            
-            # Traslados
-            monto_total_traslados += inc.traslados_total * inc.coste_hora
+        st.markdown("---")
+        # Con el desplegable cerrado no se construye el frame del export ni se agrupa
+        seccion = st.expander("📈 Análisis de costes", key="analitica_abierta", on_change="rerun")
+        if not seccion.open:
+            return
+        with seccion:
+            self._render_analitica_abierta(data_manager)
+
+    def _render_analitica_abierta(self, data_manager: OptimizedDataManager):
+        cache = OptimizedExportManager.get_export_data(
+            st.session_state.incidencias, data_manager, self._version_export()
+        )
+        analitica = OptimizedExportManager.get_analytics(cache)
         
-        total_simple = monto_total_incidencias + monto_total_nocturnidad + monto_total_traslados
-        total_con_ss = (monto_total_incidencias + monto_total_nocturnidad) * 1.3195 + monto_total_traslados
+        etiqueta = st.radio(
+            "Coste por:",
+            list(OptimizedExportManager.ANALYTICS_DIMENSIONS),
+            horizontal=True,
+            key="analitica_dimension"
+        )
+        tabla = analitica[etiqueta]
+        dimension = OptimizedExportManager.ANALYTICS_DIMENSIONS[etiqueta]
         
+        # Las etiquetas categóricas se muestran como texto; los días conservan el eje temporal
+        grafico = tabla.set_index(tabla[dimension] if dimension == 'fecha' else tabla[dimension].astype(str))
+        st.bar_chart(grafico['Coste_total'], y_label="Coste total (€)", x_label=etiqueta)
+        st.dataframe(
+            tabla,
+            hide_index=True,
+            width='stretch',
+            column_config={
+                'fecha': st.column_config.DateColumn("Día", format="DD/MM/YYYY"),
+                'incidencia_horas': st.column_config.NumberColumn("Horas", format="%.2f"),
+                'nocturnidad_horas': st.column_config.NumberColumn("Horas nocturnidad", format="%.2f"),
+                'Coste_total': st.column_config.NumberColumn("Coste total", format="€%.2f"),
+                'porcentaje': st.column_config.NumberColumn("% del coste", format="%.1f%%"),
+            }
+        )
+
+    @staticmethod
+    def _version_export() -> str:
+        """Versión del frame del export: cambios de la vista de la sesión y de la marca de duplicada de sus filas"""
+        grupo = (st.session_state.selected_imputacion, st.session_state.selected_jefe)
+        return f"{st.session_state.version_vista}|{get_indice_duplicados().version(grupo)}"
+
+    @staticmethod
+    def _render_archivo(export_data: Callable[[], Dict]):
+        """Guarda el mes cerrado en el archivo histórico (una partición por año, imputación y supervisor)"""
+        with st.expander("🗄️ Archivar mes cerrado"):
+            anio = st.number_input(
+                "Año de la imputación:", min_value=2000, max_value=2100,
+                value=datetime.now().year, step=1, key="archivo_anio"
+            )
+            if st.button("Archivar en el histórico", key="archivar_mes",
+                         help="Volver a archivar este mes sustituye lo que este supervisor archivó del mismo mes y año; "
+                              "lo archivado por otros supervisores no cambia"):
+                filas = archivar_mes(export_data()['df'], int(anio), st.session_state.selected_jefe)
+                st.success(f"✅ {filas} incidencias archivadas en {st.session_state.selected_imputacion} {int(anio)}")
+
+    @staticmethod
+    def _informar_memoria():
+        """Bytes del estado base de la sesión para el presupuesto (estimados por muestreo, como mucho cada pocos segundos)"""
+        ahora = time.monotonic()
+        if ahora - st.session_state.get('memoria_medida', 0.0) < INTERVALO_MEDIDA_MEMORIA:
+            return
+        st.session_state.memoria_medida = ahora
+        derivados = st.session_state.derivados
+        estado = {clave: valor for clave, valor in st.session_state.items() if clave != 'derivados'}
+        derivados.presupuesto.informar_estado(derivados, derivados.sesion, tamano_bytes(estado, muestra=200))
+
+    @staticmethod
+    def _render_memoria():
+        presupuesto = get_presupuesto_memoria()
+        with st.sidebar.expander("🧠 Memoria por sesión"):
+            st.caption(
+                f"Derivados: {presupuesto.total_derivados / 2**20:,.1f} de {presupuesto.limite_bytes / 2**20:,.0f} MB · "
+                f"{presupuesto.expulsiones} expulsiones"
+            )
+            informe = presupuesto.informe()
+            for col in ['estado', 'derivados', 'total']:
+                informe[col] = informe[col] / 2**20
+            st.dataframe(
+                informe, hide_index=True, width='stretch',
+                column_config={
+                    'sesion': "Sesión",
+                    'estado': st.column_config.NumberColumn("Estado (MB)", format="%.2f"),
+                    'derivados': st.column_config.NumberColumn("Derivados (MB)", format="%.2f"),
+                    'entradas': "Entradas",
+                    'total': st.column_config.NumberColumn("Total (MB)", format="%.2f"),
+                }
+            )
+
+    @staticmethod
+    def _render_trazas():
+        """Desglose de los últimos reruns (de todas las sesiones) y percentiles por etapa"""
+        registro = get_registro_trazas()
+        with st.sidebar.expander("⏱️ Tiempos por rerun"):
+            st.caption(f"Traza de este rerun: {registro.actual().id_traza} · tiempos inclusivos en ms")
+            percentiles = registro.percentiles()
+            if percentiles.empty:
+                st.info("Aún no hay reruns completos")
+                return
+            st.dataframe(percentiles, hide_index=True, width='stretch',
+                         column_config={c: st.column_config.NumberColumn(format="%.1f") for c in percentiles.columns[2:]})
+            st.dataframe(registro.tabla(20), hide_index=True, width='stretch')
+
+    @staticmethod
+    def _render_disparos():
+        """Acciones de usuario que más reruns encadenan con st.rerun() y cuánto cuestan los que sobran"""
+        with st.sidebar.expander("🔁 Reruns por acción"):
+            disparos = get_registro_trazas().disparos()
+            if disparos.empty:
+                st.info("Aún no hay acciones completas")
+                return
+            st.caption("Cada acción empieza con un cambio de widget; las ejecuciones que encadena st.rerun() son redundantes")
+            st.dataframe(disparos, hide_index=True, width='stretch',
+                         column_config={c: st.column_config.NumberColumn(format="%.1f")
+                                        for c in ['por_accion', 'ms_redundantes', 'ms_total']})
+
+    @staticmethod
+    def _valores_widgets() -> Dict[str, str]:
+        """repr de los valores simples de la sesión (los widgets con key) y del estado de los editores de datos"""
         return {
-            'total_incidencias': monto_total_incidencias,
-            'total_nocturnidad': monto_total_nocturnidad,
-            'total_traslados': monto_total_traslados,
-            'total_simple': total_simple,
-            'total_con_ss': total_con_ss
+            clave: repr(valor) for clave, valor in st.session_state.items()
+            if isinstance(valor, (str, int, float, date)) or isinstance(valor, dict) and 'edited_rows' in valor
         }
 
+    @staticmethod
+    def widgets_cambiados() -> List[str]:
+        """Widgets que cambiaron desde el final de la ejecución anterior: lo que disparó esta"""
+        anteriores = st.session_state.get('valores_widgets')
+        if anteriores is None:
+            return []
+        return [
+            clave for clave, valor in OptimizedIncidenciasApp._valores_widgets().items()
+            # Un botón vuelve solo a False en la ejecución siguiente a su clic: eso no es un disparo
+            if anteriores.get(clave) != valor and not (valor == 'False' and anteriores.get(clave) == 'True')
+        ]
+
+    @staticmethod
+    def anotar_widgets():
+        st.session_state.valores_widgets = OptimizedIncidenciasApp._valores_widgets()
+
+    @staticmethod
+    def _render_perfil_memoria():
+        """Últimas medidas de memoria por etapa y sitios que más retienen en la de mayor pico de cada una"""
+        with st.sidebar.expander("🧬 Memoria por etapa"):
+            tabla = get_perfil_memoria().tabla(20)
+            if tabla.empty:
+                st.info("Aún no se ha medido ninguna etapa")
+                return
+            st.dataframe(tabla, hide_index=True, width='stretch',
+                         column_config={'neto_mb': st.column_config.NumberColumn("Neto (MB)", format="%.2f"),
+                                        'pico_mb': st.column_config.NumberColumn("Pico (MB)", format="%.2f")})
+            informe = get_perfil_memoria().informe()
+            etapa = st.selectbox("Sitios que más memoria retienen en:", list(informe), key="perfil_memoria_etapa")
+            st.dataframe(pd.DataFrame(informe[etapa]['sitios'], columns=['sitio', 'kb', 'bloques']),
+                         hide_index=True, width='stretch')
+
 if __name__ == "__main__":
     # Configuración adicional para mejor rendimiento
     
     app = OptimizedIncidenciasApp()
-    app.run()
\ No newline at end of file
+    # Una traza por rerun: su id identifica esta ejecución en el panel y en el fichero JSON Lines,
+    # y los widgets cambiados desde la anterior dicen qué la disparó
+    with trazas.traza(st.session_state.sesion_id, widgets=app.widgets_cambiados() if TRAZAS else ()):
+        try:
+            app.run()
+        finally:
+            if TRAZAS:
+                app.anotar_widgets()
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""Archivo histórico de meses cerrados en Parquet particionado.
+
+Cada mes exportado se guarda bajo
+
+    data/archivo/anio=<año>/imputacion_nomina=<mes>/supervisor=<supervisor>/
+
+con el esquema del export (EXPORT_DTYPES). El supervisor es quien archiva
+el mes, no jefe_ope (el jefe de cada trabajador en el maestro, que puede ser
+otro si el supervisor registró a personal prestado). Volver a archivar el
+mismo (año, imputación, supervisor) sustituye solo su partición. Las
+consultas solo leen las particiones que pasan el filtro y las columnas
+pedidas:
+
+    from archivo import consultar, coste_interanual
+    consultar(columnas=['nombre_empleado', 'Coste_total'], imputaciones=['03 Marzo'], supervisores=['JEFE A'])
+    coste_interanual('03 Marzo', dimension='motivo')
+
+Desde la línea de comandos:
+
+    python archivo.py "03 Marzo" --dimension motivo
+"""
+import argparse
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from export_writers import EXPORT_DTYPES, apply_export_dtypes
+
+ARCHIVO_DIR = Path('data/archivo')
+PARTITION_COLUMNS = ['anio', 'imputacion_nomina', 'supervisor']
+
+_PARTITIONING = ds.partitioning(
+    pa.schema([('anio', pa.int16()), ('imputacion_nomina', pa.string()), ('supervisor', pa.string())]),
+    flavor='hive'
+)
+
+
+def _schema() -> pa.Schema:
+    """Esquema Arrow del archivo: columnas del export más el año de la imputación y el supervisor"""
+    vacio = pd.DataFrame({col: pd.Series(dtype=object) for col in EXPORT_DTYPES})
+    apply_export_dtypes(vacio)
+    vacio['anio'] = pd.Series(dtype='int16')
+    vacio['supervisor'] = pd.Series(dtype='string')
+    return pa.Schema.from_pandas(vacio, preserve_index=False)
+
+
+def archivar_mes(df: pd.DataFrame, anio: int, supervisor: str, raiz: Path = ARCHIVO_DIR) -> int:
+    """Archiva el export del mes cerrado de un supervisor; sustituye lo que ese supervisor hubiera archivado.
+
+    Devuelve el número de filas archivadas.
+    """
+    if df is None or df.empty:
+        return 0
+    df = df[list(EXPORT_DTYPES)].copy()
+    apply_export_dtypes(df)
+    df['anio'] = pd.Series(anio, index=df.index, dtype='int16')
+    df['supervisor'] = pd.Series(supervisor, index=df.index, dtype='string')
+    tabla = pa.Table.from_pandas(df, schema=_schema(), preserve_index=False)
+    ds.write_dataset(
+        tabla,
+        raiz,
+        format='parquet',
+        partitioning=_PARTITIONING,
+        existing_data_behavior='delete_matching',
+        basename_template='part-{i}.parquet',
+    )
+    return len(df)
+
+
+def _dataset(raiz: Path) -> Optional[ds.Dataset]:
+    if not Path(raiz).exists():
+        return None
+    return ds.dataset(raiz, format='parquet', partitioning=_PARTITIONING, schema=_schema())
+
+
+def _filtro(anios, imputaciones, supervisores, jefes, trabajadores) -> Optional[ds.Expression]:
+    condiciones = [
+        ds.field(col).isin(list(valores))
+        for col, valores in (
+            ('anio', anios), ('imputacion_nomina', imputaciones), ('supervisor', supervisores),
+            ('jefe_ope', jefes), ('nombre_empleado', trabajadores),
+        )
+        if valores
+    ]
+    if not condiciones:
+        return None
+    filtro = condiciones[0]
+    for condicion in condiciones[1:]:
+        filtro = filtro & condicion
+    return filtro
+
+
+def consultar_tabla(columnas: Optional[Sequence[str]] = None, anios: Optional[Sequence[int]] = None,
+                    imputaciones: Optional[Sequence[str]] = None, supervisores: Optional[Sequence[str]] = None,
+                    jefes: Optional[Sequence[str]] = None, trabajadores: Optional[Sequence[str]] = None,
+                    raiz: Path = ARCHIVO_DIR) -> pa.Table:
+    """Consulta Arrow sobre el archivo.
+
+    Los filtros por año, imputación y supervisor descartan particiones enteras
+    sin abrir sus ficheros; jefes (jefe_ope del trabajador) y trabajadores
+    filtran filas. Solo se leen las columnas pedidas.
+    """
+    dataset = _dataset(raiz)
+    if dataset is None:
+        return _schema().empty_table() if columnas is None else _schema().empty_table().select(list(columnas))
+    return dataset.to_table(
+        columns=list(columnas) if columnas is not None else None,
+        filter=_filtro(anios, imputaciones, supervisores, jefes, trabajadores),
+    )
+
+
+def consultar(columnas: Optional[Sequence[str]] = None, anios: Optional[Sequence[int]] = None,
+              imputaciones: Optional[Sequence[str]] = None, supervisores: Optional[Sequence[str]] = None,
+              jefes: Optional[Sequence[str]] = None, trabajadores: Optional[Sequence[str]] = None,
+              raiz: Path = ARCHIVO_DIR) -> pd.DataFrame:
+    """Igual que consultar_tabla(), como DataFrame"""
+    return consultar_tabla(columnas, anios, imputaciones, supervisores, jefes, trabajadores, raiz).to_pandas()
+
+
+def coste_interanual(imputacion: str, dimension: str = 'supervisor', anios: Optional[Sequence[int]] = None,
+                     raiz: Path = ARCHIVO_DIR) -> pd.DataFrame:
+    """Coste total de una imputación por dimensión (filas) y año (columnas)"""
+    tabla = consultar_tabla([dimension, 'anio', 'Coste_total'], anios=anios, imputaciones=[imputacion], raiz=raiz)
+    agregado = tabla.group_by([dimension, 'anio']).aggregate([('Coste_total', 'sum')]).to_pandas()
+    return agregado.pivot_table(
+        index=dimension, columns='anio', values='Coste_total_sum', aggfunc='sum', fill_value=0.0
+    )
+
+
+def historial_trabajador(trabajador: str, motivos: Optional[Sequence[str]] = None,
+                         anios: Optional[Sequence[int]] = None, raiz: Path = ARCHIVO_DIR) -> pd.DataFrame:
+    """Horas y coste de un trabajador por año e imputación (p. ej. absentismo de un año)"""
+    tabla = consultar_tabla(
+        ['anio', 'imputacion_nomina', 'motivo', 'incidencia_horas', 'Coste_total'],
+        anios=anios, trabajadores=[trabajador], raiz=raiz
+    )
+    if motivos:
+        tabla = tabla.filter(pc.is_in(tabla['motivo'], value_set=pa.array(list(motivos))))
+    agregado = tabla.group_by(['anio', 'imputacion_nomina', 'motivo']).aggregate([
+        ('incidencia_horas', 'sum'), ('Coste_total', 'sum'), ('motivo', 'count'),
+    ])
+    return (
+        agregado.to_pandas()
+        .rename(columns={'incidencia_horas_sum': 'incidencia_horas', 'Coste_total_sum': 'Coste_total',
+                         'motivo_count': 'incidencias'})
+        .sort_values(['anio', 'imputacion_nomina', 'motivo'], ignore_index=True)
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Coste interanual de una imputación desde el archivo histórico")
+    parser.add_argument('imputacion', help="Imputación de nómina, p. ej. '03 Marzo'")
+    parser.add_argument('--dimension', default='supervisor', help="Columna por la que agrupar (por defecto supervisor)")
+    parser.add_argument('--anios', type=int, nargs='+', help="Años a comparar (por defecto todos)")
+    parser.add_argument('--raiz', type=Path, default=ARCHIVO_DIR)
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+    resultado = coste_interanual(args.imputacion, args.dimension, args.anios, args.raiz)
+    print(resultado.to_string(float_format=lambda v: f"{v:,.2f}"))
+    print(f"\n{time.perf_counter() - inicio:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,234 @@
+"""Autoguardado en disco de las incidencias de cada (imputación, jefe).
+
+Cada conjunto tiene su directorio bajo
+
+    data/autoguardado/<imputación>/<jefe>/
+
+con una instantánea completa en Arrow IPC comprimido (base-<n>.arrow) y,
+detrás, segmentos delta con solo las filas cambiadas desde el guardado
+anterior (delta-<n>.arrow). Un autoguardado escribe un delta de unas pocas
+filas; al acumularse SEGMENTOS_MAX se compacta todo en una instantánea nueva
+y se borran los ficheros anteriores. Restaurar lee la última instantánea y
+aplica sus deltas en orden.
+
+Junto a las filas, metadatos.json guarda el estado que el conjunto quiera
+conservar entre reinicios (p. ej. los cambios aún no exportados).
+
+Cada fichero se escribe a un temporal y se renombra: un corte a mitad de
+escritura deja intacto el guardado anterior.
+"""
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+AUTOGUARDADO_DIR = Path('data/autoguardado')
+
+logger = logging.getLogger(__name__)
+
+# Columnas de control de cada fila guardada
+COL_ID = '_id'
+COL_VERSION = '_version'
+COL_BORRADA = '_borrada'
+
+_FICHERO = re.compile(r'^(base|delta)-(\d{8})\.arrow$')
+METADATOS = 'metadatos.json'
+
+# (id, versión, valores por columna o None si la fila se borró)
+FilaGuardada = Tuple[str, int, Optional[Dict]]
+
+
+def directorio_guardado(*partes: str, raiz: Path = AUTOGUARDADO_DIR) -> Path:
+    """Directorio de un conjunto; los nombres se escapan para que '/' no cree subdirectorios"""
+    return Path(raiz).joinpath(*(quote(parte, safe=' ') for parte in partes))
+
+def conjuntos_guardados(*partes: str, raiz: Path = AUTOGUARDADO_DIR) -> List[str]:
+    """Nombres (sin escapar) de los subdirectorios de un directorio de guardado, p. ej. los jefes de una imputación"""
+    directorio = directorio_guardado(*partes, raiz=raiz)
+    if not directorio.is_dir():
+        return []
+    return sorted(unquote(path.name) for path in directorio.iterdir() if path.is_dir())
+
+def _lista(columna: pa.ChunkedArray) -> list:
+    """Valores Python de una columna; las fechas como pd.Timestamp (nulos a None), como las usa la aplicación"""
+    if pa.types.is_timestamp(columna.type):
+        serie = columna.to_pandas()
+        return serie.astype(object).where(serie.notna(), None).tolist()
+    return columna.to_pylist()
+
+# =============================================================================
+# INSTANTÁNEA + SEGMENTOS DELTA
+# =============================================================================
+
+class PuntoGuardado:
+    """Copia en disco de un conjunto de filas versionadas por id"""
+    SEGMENTOS_MAX = 64
+    COMPRESION = 'zstd'
+
+    def __init__(self, directorio: Path, esquema: pa.Schema):
+        self.directorio = Path(directorio)
+        self.esquema = pa.schema([
+            pa.field(COL_ID, pa.string(), nullable=False),
+            pa.field(COL_VERSION, pa.int64()),
+            pa.field(COL_BORRADA, pa.bool_()),
+            *esquema,
+        ])
+        self._opciones = ipc.IpcWriteOptions(compression=self.COMPRESION)
+        ficheros = self._ficheros()
+        self._numero = ficheros[-1][0] if ficheros else 0
+        self._segmentos = sum(1 for _, tipo, _ in ficheros if tipo == 'delta')
+
+    def _ficheros(self) -> List[Tuple[int, str, Path]]:
+        """(número, tipo, ruta) de los ficheros del conjunto, en orden de escritura"""
+        if not self.directorio.is_dir():
+            return []
+        ficheros = []
+        for path in self.directorio.iterdir():
+            encaje = _FICHERO.match(path.name)
+            if encaje:
+                ficheros.append((int(encaje.group(2)), encaje.group(1), path))
+        return sorted(ficheros)
+
+    @property
+    def compactar(self) -> bool:
+        """El siguiente guardado debe ser una instantánea completa"""
+        return self._segmentos >= self.SEGMENTOS_MAX
+
+    def restaurar(self) -> Dict[str, Tuple[int, Dict]]:
+        """id -> (versión, valores) de la última instantánea con sus deltas aplicados"""
+        ficheros = self._ficheros()
+        bases = [i for i, (_, tipo, _) in enumerate(ficheros) if tipo == 'base']
+        filas: Dict[str, Tuple[int, Dict]] = {}
+        for _, _, path in ficheros[bases[-1] if bases else 0:]:
+            with pa.memory_map(str(path)) as fuente:
+                tabla = ipc.open_file(fuente).read_all()
+            nombres = tabla.column_names[3:]
+            # Conversión por columnas: mucho más rápida que fila a fila (to_pylist)
+            valores = [_lista(tabla.column(nombre)) for nombre in nombres]
+            ids, versiones, borradas = (tabla.column(i).to_pylist() for i in range(3))
+            for id_fila, version, borrada, fila in zip(ids, versiones, borradas, zip(*valores)):
+                if borrada:
+                    filas.pop(id_fila, None)
+                else:
+                    filas[id_fila] = (version, dict(zip(nombres, fila)))
+        return filas
+
+    def guardar_delta(self, cambios: List[FilaGuardada]) -> None:
+        if cambios:
+            self._escribir('delta', cambios)
+            self._segmentos += 1
+
+    def metadatos(self) -> Optional[Dict]:
+        """Últimos metadatos guardados; None si el conjunto no tiene"""
+        path = self.directorio / METADATOS
+        if not path.is_file():
+            return None
+        with open(path, encoding='utf-8') as origen:
+            return json.load(origen)
+
+    def guardar_metadatos(self, metadatos: Dict) -> None:
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        path = self.directorio / METADATOS
+        temporal = path.with_suffix('.tmp')
+        with open(temporal, 'w', encoding='utf-8') as destino:
+            json.dump(metadatos, destino, ensure_ascii=False)
+        os.replace(temporal, path)
+
+    def guardar_completa(self, filas: List[FilaGuardada]) -> None:
+        """Instantánea de todas las filas vigentes; sustituye a los ficheros anteriores"""
+        path = self._escribir('base', filas)
+        for _, _, anterior in self._ficheros():
+            if anterior != path:
+                anterior.unlink(missing_ok=True)
+        self._segmentos = 0
+
+    def _escribir(self, tipo: str, filas: List[FilaGuardada]) -> Path:
+        tabla = pa.Table.from_pylist(
+            [{COL_ID: id_fila, COL_VERSION: version, COL_BORRADA: valores is None, **(valores or {})}
+             for id_fila, version, valores in filas],
+            schema=self.esquema
+        )
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self._numero += 1
+        path = self.directorio / f"{tipo}-{self._numero:08d}.arrow"
+        temporal = path.with_suffix('.tmp')
+        with pa.OSFile(str(temporal), 'wb') as destino:
+            with ipc.new_file(destino, self.esquema, options=self._opciones) as escritor:
+                escritor.write_table(tabla)
+        os.replace(temporal, path)
+        return path
+
+# =============================================================================
+# GUARDADO DIFERIDO (DEBOUNCE)
+# =============================================================================
+
+class GuardadoDiferido:
+    """Guarda los objetos con cambios cuando dejan de cambiar.
+
+    avisar(objeto) anota que tiene cambios; un hilo llama a objeto.guardar()
+    cuando pasan espera segundos sin avisos nuevos, o espera_max desde el
+    primer aviso pendiente aunque siga cambiando. Los avisos son O(1): el
+    coste del guardado no lo paga la escritura que lo provoca. Al salir del
+    proceso se guarda todo lo pendiente.
+
+    Si un guardar() lanza, se registra el error y el objeto vuelve a la cola
+    como si acabara de avisar: el hilo sigue guardando los demás.
+    """
+
+    def __init__(self, espera: float = 2.0, espera_max: float = 10.0):
+        self.espera = espera
+        self.espera_max = espera_max
+        self._cond = threading.Condition()
+        self._pendientes: Dict[int, List] = {}  # id(objeto) -> [objeto, primer aviso, último aviso]
+        threading.Thread(target=self._bucle, name='autoguardado', daemon=True).start()
+        atexit.register(self.vaciar)
+
+    def avisar(self, objeto) -> None:
+        ahora = time.monotonic()
+        with self._cond:
+            pendiente = self._pendientes.get(id(objeto))
+            if pendiente is None:
+                self._pendientes[id(objeto)] = [objeto, ahora, ahora]
+                self._cond.notify()
+            else:
+                pendiente[2] = ahora
+
+    def _vence(self, pendiente: List) -> float:
+        return min(pendiente[2] + self.espera, pendiente[1] + self.espera_max)
+
+    def _bucle(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    ahora = time.monotonic()
+                    vencidos = [clave for clave, p in self._pendientes.items() if self._vence(p) <= ahora]
+                    if vencidos:
+                        objetos = [self._pendientes.pop(clave)[0] for clave in vencidos]
+                        break
+                    proximo = min((self._vence(p) for p in self._pendientes.values()), default=None)
+                    self._cond.wait(None if proximo is None else proximo - ahora)
+            self._guardar(objetos)
+
+    def _guardar(self, objetos: List) -> None:
+        for objeto in objetos:
+            try:
+                objeto.guardar()
+            except Exception:
+                logger.exception("Autoguardado fallido de %r; se reintenta", objeto)
+                self.avisar(objeto)
+
+    def vaciar(self) -> None:
+        """Guarda ya todo lo pendiente"""
+        with self._cond:
+            objetos = [p[0] for p in self._pendientes.values()]
+            self._pendientes.clear()
+        self._guardar(objetos)
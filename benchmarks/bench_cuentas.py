@@ -0,0 +1,50 @@
+"""Benchmark del motor de costes del export.
+
+Mide el coste por fila de costes.compute_costs (imputación motivo -> cuenta
+y Coste_total) desde 1.000 hasta 1.000.000 de filas. Ejecutar desde la raíz
+del repo:
+
+    python -m benchmarks.bench_cuentas
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from costes import compute_costs, preprocess_cuenta_motivos
+
+TAMANOS = [1_000, 10_000, 100_000, 1_000_000]
+REPETICIONES = 3
+
+
+def _frame_sintetico(n: int, motivos: list, rng: np.random.Generator) -> pd.DataFrame:
+    return pd.DataFrame({
+        'motivo': rng.choice(motivos, size=n),
+        'incidencia_horas': rng.uniform(0, 8, size=n),
+        'incidencia_precio': rng.uniform(8, 20, size=n),
+        'nocturnidad_horas': rng.uniform(0, 4, size=n),
+        'precio_nocturnidad': rng.uniform(1, 3, size=n),
+        'traslados_total': rng.uniform(0, 2, size=n),
+        'coste_hora': rng.uniform(10, 25, size=n),
+    })
+
+
+def main() -> None:
+    cuenta_columnas = preprocess_cuenta_motivos(pd.read_excel('data/maestros.xlsx', sheet_name='cuenta_motivos'))
+    motivos = list(cuenta_columnas) + ['Motivo sin cuenta']
+    rng = np.random.default_rng(0)
+
+    print(f"{'filas':>10} {'mejor (ms)':>12} {'ns/fila':>10}")
+    for n in TAMANOS:
+        df = _frame_sintetico(n, motivos, rng)
+        tiempos = []
+        for _ in range(REPETICIONES):
+            inicio = time.perf_counter()
+            compute_costs(df, cuenta_columnas)
+            tiempos.append(time.perf_counter() - inicio)
+        mejor = min(tiempos)
+        print(f"{n:>10,} {mejor * 1e3:>12.2f} {mejor * 1e9 / n:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
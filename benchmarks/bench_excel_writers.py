@@ -0,0 +1,80 @@
+"""Benchmark de los escritores de Excel del export.
+
+Compara tiempo y pico de RSS de cada backend de export_writers a 10k, 100k
+y 500k filas. Cada medida corre en un proceso nuevo para que el pico de
+memoria de una no contamine la siguiente. Ejecutar desde la raíz del repo:
+
+    python -m benchmarks.bench_excel_writers [--filas 10000 100000 500000]
+"""
+import argparse
+import multiprocessing as mp
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+
+from export_writers import EXCEL_WRITERS, get_excel_writer
+
+TAMANOS = [10_000, 100_000, 500_000]
+NUMBER_FORMATS = {
+    'fecha': 'dd/mm/yyyy',
+    'incidencia_precio': '#,##0.00',
+    'Coste_total': '#,##0.00',
+}
+
+
+def frame_export_sintetico(n: int, seed: int = 0) -> pd.DataFrame:
+    """DataFrame con la forma del export enriquecido"""
+    rng = np.random.default_rng(seed)
+    motivos = np.array(['Absentismo', 'Refuerzo', 'Eventos', 'Festivos y Fines de Semana', 'Nocturnidad'])
+    return pd.DataFrame({
+        'jefe_ope': rng.choice(['JEFE A', 'JEFE B', 'JEFE C'], size=n),
+        'nombre_empleado': np.char.add('EMPLEADO ', rng.integers(0, 5_000, size=n).astype(str)),
+        'imputacion_nomina': '03 Marzo',
+        'facturable': rng.choice(['Sí', 'No'], size=n),
+        'motivo': rng.choice(motivos, size=n),
+        'codigo_crown_destino': rng.integers(100_000, 100_500, size=n),
+        'incidencia_horas': rng.uniform(0, 8, size=n).round(2),
+        'incidencia_precio': rng.uniform(8, 20, size=n).round(2),
+        'nocturnidad_horas': rng.uniform(0, 4, size=n).round(2),
+        'fecha': pd.Timestamp('2025-03-01') + pd.to_timedelta(rng.integers(0, 31, size=n), unit='D'),
+        'observaciones': 'Sustitución',
+        'Coste_total': rng.uniform(0, 300, size=n).round(2),
+    })
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _medir(backend: str, n: int, cola: mp.Queue) -> None:
+    df = frame_export_sintetico(n)
+    rss_base = _peak_rss_mb()
+    writer = get_excel_writer(backend, NUMBER_FORMATS)
+    inicio = time.perf_counter()
+    data = writer.to_bytes(df)
+    cola.put((time.perf_counter() - inicio, _peak_rss_mb() - rss_base, len(data)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--filas', type=int, nargs='+', default=TAMANOS)
+    parser.add_argument('--backends', nargs='+', default=list(EXCEL_WRITERS))
+    args = parser.parse_args()
+
+    ctx = mp.get_context('spawn')
+    print(f"{'backend':>10} {'filas':>9} {'tiempo (s)':>11} {'filas/s':>9} {'pico RSS extra (MB)':>20} {'tamaño (MB)':>12}")
+    for n in args.filas:
+        for backend in args.backends:
+            cola = ctx.Queue()
+            proceso = ctx.Process(target=_medir, args=(backend, n, cola))
+            proceso.start()
+            segundos, rss_mb, tamano = cola.get()
+            proceso.join()
+            print(f"{backend:>10} {n:>9,} {segundos:>11.2f} {n / segundos:>9,.0f} {rss_mb:>20.1f} {tamano / 2**20:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+"""Benchmark de todo el flujo con datos sintéticos: app.py frente a app_optimized.py.
+
+Genera un maestros.xlsx sintético con la misma estructura de hojas que el
+real (de 1.000 a 200.000 trabajadores) y un conjunto de incidencias (de 100
+a 1.000.000) y cronometra, sin navegador, cada etapa de las dos
+implementaciones: carga del Excel, preprocesado, construcción de lookups,
+alta de incidencias, frame de la página del editor, guardado de una página
+editada, métricas de cabecera y export. Cada (escenario, implementación)
+corre en un proceso nuevo con el maestro sintético como data/maestros.xlsx.
+
+Las etapas de app.py que recorren el maestro por cada fila son O(filas ×
+trabajadores): se miden sobre una muestra de --muestra-original incidencias
+y se extrapolan linealmente (marcadas con "extrapolado" en el informe). Lo
+mismo el Excel del export por encima de --max-xlsx filas.
+
+Con --memoria, app_optimized.py se ejecuta además con el perfil de memoria
+por etapa (perfil_memoria.py, tracemalloc): el informe lleva el pico, el
+neto y los sitios que más memoria retienen en cada etapa perfilada, y
+--comparar compara también los picos. tracemalloc encarece las
+asignaciones: los tiempos de esa ejecución no son comparables con los de
+una sin --memoria.
+
+El resultado se escribe en JSON (una fila por implementación, escenario y
+etapa, con el pico de RSS) para comparar ejecuciones. Ejecutar desde la raíz
+del repo:
+
+    python -m benchmarks.bench_pipeline [--escenarios 1000x100 10000x10000 200000x1000000]
+    python -m benchmarks.bench_pipeline --comparar benchmarks/resultados/pipeline_<anterior>.json
+    python -m benchmarks.bench_pipeline --implementaciones app_optimized.py --memoria
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+RAIZ = Path(__file__).resolve().parent.parent
+DATOS_DIR = RAIZ / 'benchmarks' / 'datos'
+RESULTADOS_DIR = RAIZ / 'benchmarks' / 'resultados'
+
+ESCENARIOS = ['1000x100', '10000x10000', '50000x100000']
+IMPLEMENTACIONES = ['app.py', 'app_optimized.py']
+MUESTRA_ORIGINAL = 2_000
+MAX_XLSX = 100_000
+FILAS_PAGINA = 50
+IMPUTACION = '03 Marzo'
+
+# =============================================================================
+# MAESTROS E INCIDENCIAS SINTÉTICOS
+# =============================================================================
+
+COLUMNAS_TRABAJADORES = [
+    'Empresa', 'Empleado -  Código', 'Nombre empleado', 'Columna1', 'Nombre de la empresa', 'Fecha alta',
+    'Fecha baja', 'Dni', 'Número seguridad social', 'Teléfono', 'Movil', 'Domicilio', 'Dirección E-Mail',
+    'Código postal', 'Provincia', 'Código contrato ', 'Contrato', 'Porcentaje de jornada',
+    'Fecha antigüedad reconoci', 'Sección', 'Categoría', 'Fecha nacimiento', 'Código sección', 'Sexo',
+    'Nivel estudios', 'Número de hijos', 'Tarifa', 'Ocupación', 'Convenio ', 'Código reg. convenio',
+    'Departamento', 'Puesto de trabajo', 'Extranjero', 'Total devengado', 'Prorrata', 'Seg Social',
+    'pagas prorrateadas', 'Coste Total Empresa', 'Coste dia empresa', 'Coste hora empresa', 'empresa/seccion',
+    'codigo Cwon', 'Nombre Código Crown', 'empresa2', 'centro preferente', 'Columna3',
+]
+COLUMNAS_CENTROS = [
+    'Código', 'Descripción ', 'Jefe de operaciones\n(Códigos)', 'Jefe de operaciones (Descripción)',
+    'Fecha de alta', 'Fecha de baja', 'Centro preferente (Códigos)', 'Centro preferente (Descripción)', 'Almacen',
+]
+COLUMNAS_MAESTRO_CENTROS = [
+    'ccentro', 'dcentro', 'coccen', 'faccol', 'linfria', 'almacen', 'ruta', 'dircentro', 'pobcentro', 'cpcentro',
+    'provcentro', 'reparto', 'cieprod', 'centropref', 'ruta2', 'reparto2', 'almcentral', 'jefeoper', 'pcc',
+    'matprima', 'ctipocal', 'codcocina', 'atenclicen', 'febaja', 'formatmen', 'dformatmen', 'zidioma', 'cenediwin',
+    'codigofam', 'comercen', 'jefeoperli', 'coordinado', 'gestor', 'ibancen', 'biccen', 'transfeval',
+    'refmandatc', 'direfac', 'transfefac',
+]
+CUENTA_MOTIVOS = [
+    ('Absentismo', '73 - Plus sustitución Total'),
+    ('Refuerzo', '72 - IncentivosTotal'),
+    ('Eventos', '72 - IncentivosTotal'),
+    ('Festivos y Fines de Semana', '70/71 - Festivos Total'),
+    ('Permiso retribuido', '72 - IncentivosTotal'),
+    ('Puesto pendiente de cubrir', '72 - IncentivosTotal'),
+    ('Formación', '72 - IncentivosTotal'),
+    ('Otros', '72 - IncentivosTotal'),
+    ('Nocturnidad', '74 - Plus nocturnidad Total'),
+]
+CATEGORIAS = [
+    'ASL', 'Cociner@', 'Limpiador@', 'h Cociner@', 'h ASL', 'COCINERO', 'AUX. COLEC', 'h J Cocina', 'Camarer@',
+    'Gobernant@', 'Aux Ad 1', 'J Cocina', 'Monitor@', 'Conductor', 'Peón', 'Encargad@', 'Ayte Cocina', 'Fregador@',
+]
+CONVENIOS = ['99100165012016', '28002585011981', '99009355011995', '99010825011997', '28009435011996']
+EMPRESAS = [19228, 19045, 20110, 50120]
+
+
+def nombre_trabajador(i: int) -> str:
+    return f"EMPLEADO {i:06d}, SINTETICO"
+
+
+def _n_centros(empleados: int) -> int:
+    return max(50, empleados // 20)
+
+
+def generar_maestros(path: Path, empleados: int, seed: int = 0) -> None:
+    """maestros.xlsx sintético con las hojas y cabeceras del real"""
+    rng = np.random.default_rng(seed)
+    n_centros = _n_centros(empleados)
+    n_preferentes = max(10, n_centros // 2)
+    n_jefes = max(5, n_centros // 25)
+    codigos = 100_000 + np.arange(n_centros)
+    preferentes = 110_000 + np.arange(n_preferentes)
+    activos = rng.random(n_centros) < 0.7
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('tarifas_incidencias')
+    ws.append(['Precios nocturnidad'])
+    ws.append(CONVENIOS[:3])
+    ws.append([])
+    ws.append(['Descripción', 'tarifa_noct', 'cod_convenio'])
+    for convenio in CONVENIOS:
+        for categoria in CATEGORIAS:
+            ws.append([categoria, round(float(rng.uniform(1.2, 3.0)), 4), int(convenio)])
+
+    ws = wb.create_sheet('trabajadores')
+    ws.append(COLUMNAS_TRABAJADORES)
+    empresa = rng.choice(EMPRESAS, empleados)
+    categoria = rng.choice(CATEGORIAS, empleados)
+    convenio = rng.choice(CONVENIOS, empleados)
+    jornada = rng.choice([25.0, 40.0, 50.0, 62.5, 75.0, 100.0], empleados)
+    coste = rng.uniform(5, 15, empleados).round(4)
+    crown = rng.choice(codigos, empleados)
+    preferente = rng.choice(preferentes, empleados)
+    alta = datetime(2024, 1, 1)
+    for i in range(empleados):
+        fila = dict.fromkeys(COLUMNAS_TRABAJADORES, '')
+        fila.update({
+            'Empresa': int(empresa[i]), 'Empleado -  Código': i, 'Nombre empleado': nombre_trabajador(i), 'Columna1': i,
+            'Nombre de la empresa': 'EMPRESA SINTETICA', 'Fecha alta': alta, 'Fecha baja': None,
+            'Código contrato ': 200, 'Contrato': 'INDEFINIDO', 'Porcentaje de jornada': float(jornada[i]),
+            'Sección': 'SECCION', 'Categoría': categoria[i], 'Código sección': 1000 + i % 500,
+            'Código reg. convenio': convenio[i], 'Departamento': 'COMEDOR', 'Puesto de trabajo': categoria[i].lower(),
+            'Total devengado': 900.0, 'Coste Total Empresa': 1200.0, 'Coste hora empresa': float(coste[i]),
+            'empresa/seccion': f"{empresa[i]}{i % 500}", 'codigo Cwon': int(crown[i]), 'Nombre Código Crown': 'CENTRO',
+            'empresa2': 'EMPRESA', 'centro preferente': int(preferente[i]), 'Columna3': int(empresa[i]),
+        })
+        ws.append(list(fila.values()))
+
+    ws = wb.create_sheet('cuenta_motivos')
+    ws.append(['Motivo', 'desc_cuenta'])
+    for fila in CUENTA_MOTIVOS:
+        ws.append(list(fila))
+
+    ws = wb.create_sheet('centros')
+    ws.append(COLUMNAS_CENTROS)
+    # Como en el real: códigos alfanuméricos de baja y sin jefe, que dejan la columna como texto
+    for codigo in ['AAAAAA', 'E0001', 'E0010']:
+        ws.append([codigo, f"CENTRO {codigo}", '', '', None, datetime(2024, 1, 1), '', '', ''])
+    for i, codigo in enumerate(codigos):
+        jefe = i % n_jefes
+        ws.append([
+            f"{codigo:06d}", f"CENTRO {codigo}", 900 + jefe, f"JEFE {jefe:03d}", None,
+            None if activos[i] else datetime(2024, 8, 31), str(preferentes[i % n_preferentes]),
+            f"PREFERENTE {i % n_preferentes}", 300_000_000 + i,
+        ])
+
+    ws = wb.create_sheet('maestro_centros')
+    ws.append(COLUMNAS_MAESTRO_CENTROS)
+    for codigo in preferentes:
+        fila = dict.fromkeys(COLUMNAS_MAESTRO_CENTROS, '')
+        fila.update({'ccentro': int(codigo), 'dcentro': f"PREFERENTE {codigo}", 'centropref': int(codigo)})
+        ws.append(list(fila.values()))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporal = path.with_suffix('.tmp')
+    wb.save(temporal)
+    os.replace(temporal, path)
+
+
+def generar_incidencias(n: int, empleados: int, seed: int = 0) -> List[Dict]:
+    """Registros con CAMPOS_ENTRADA, como llegan del formulario o de un envío"""
+    rng = np.random.default_rng(seed)
+    motivos = [motivo for motivo, _ in CUENTA_MOTIVOS]
+    codigos = 100_000 + np.arange(_n_centros(empleados))
+    df = pd.DataFrame({
+        'trabajador': [nombre_trabajador(i) for i in rng.integers(0, empleados, n)],
+        'imputacion_nomina': IMPUTACION,
+        'facturable': rng.choice(['Sí', 'No'], n),
+        'motivo': rng.choice(motivos, n),
+        'codigo_crown_destino': rng.choice(codigos, n).astype(str),
+        'empresa_destino': rng.choice(['', 'ALGADI', 'SMI', 'DISTEGSA'], n),
+        'incidencia_horas': rng.integers(1, 9, n).astype(float),
+        'incidencia_precio': rng.uniform(8, 20, n).round(2),
+        'nocturnidad_horas': rng.integers(0, 3, n).astype(float),
+        'traslados_total': rng.integers(0, 3, n).astype(float),
+        'fecha': pd.Timestamp('2025-03-01') + pd.to_timedelta(rng.integers(0, 31, n), unit='D'),
+        'observaciones': 'sintética',
+    })
+    return df.to_dict('records')
+
+
+def _ediciones_pagina(n: int) -> Dict[int, Dict]:
+    """edited_rows del editor de datos con una página entera modificada"""
+    return {i: {'Observaciones': 'editada', 'Incidencia_horas': 2.0} for i in range(min(FILAS_PAGINA, n))}
+
+# =============================================================================
+# ETAPAS (en el proceso hijo)
+# =============================================================================
+
+def _pico_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _Cronometro:
+    def __init__(self):
+        self.filas: List[Dict] = []
+
+    def medir(self, etapa: str, funcion: Callable, escala: float = 1.0):
+        inicio = time.perf_counter()
+        valor = funcion()
+        segundos = time.perf_counter() - inicio
+        self.filas.append({
+            'etapa': etapa,
+            'segundos': segundos * escala,
+            'extrapolado': escala != 1.0,
+            'pico_rss_mb': round(_pico_rss_mb(), 1),
+        })
+        return valor
+
+
+def _etapas_original(registros: List[Dict], muestra_max: int) -> List[Dict]:
+    import streamlit as st
+    import app as original
+    from costes import cost_totals
+
+    crono = _Cronometro()
+    crono.medir('carga', lambda: original._load_and_preprocess_excel('data/maestros.xlsx'))
+    dm = crono.medir('preprocesado', original.DataManager)
+    tabla = original.TablaUnificadaIncidencias(dm)
+    jefe = dm.get_jefes()[0]
+
+    # Lo que depende de las filas recorre el maestro por cada una: muestra y extrapolación
+    muestra = registros[:muestra_max]
+    escala = len(registros) / len(muestra)
+
+    def alta():
+        incidencias = []
+        for registro in muestra:
+            incidencia = original.Incidencia(**{k: v for k, v in registro.items() if k != 'trabajador'})
+            tabla._actualizar_datos_empleado(incidencia, registro['trabajador'], jefe)
+            incidencias.append(incidencia)
+        return incidencias
+
+    incidencias = crono.medir('enriquecimiento', alta, escala)
+    st.session_state.incidencias = incidencias
+    st.session_state.selected_imputacion = IMPUTACION
+    # app.py pinta todas las filas en cada rerun
+    crono.medir('pagina', lambda: tabla._render_main_table(incidencias, jefe), escala)
+
+    # El guardado va dentro del render de la tabla: se simula el clic en "Guardar cambios"
+    st.session_state['unificado_editor'] = {'edited_rows': _ediciones_pagina(len(incidencias))}
+    boton = original.st.button
+    original.st.button = lambda etiqueta, *args, **kwargs: etiqueta.startswith('💾')
+    try:
+        crono.medir('guardado', lambda: tabla._render_main_table(incidencias, jefe), escala)
+    finally:
+        original.st.button = boton
+
+    def metricas():
+        validas = [inc for inc in incidencias if inc.is_valid()]
+        df, costes = original.ExportManager.build_export_frame(validas, dm)
+        return df, cost_totals(costes)
+
+    # Como en el rerun de app.py: el Excel se escribe desde el frame de las métricas
+    df, _ = crono.medir('metricas', metricas, escala)
+    crono.medir('export_xlsx', lambda: original.ExportManager.frame_to_excel(df), escala)
+    return crono.filas
+
+
+def _etapas_optimizada(registros: List[Dict], max_xlsx: int) -> List[Dict]:
+    import streamlit as st
+    import app_optimized as optimizada
+
+    ruta = 'data/maestros.xlsx'
+    crono = _Cronometro()
+
+    def carga():
+        for hoja in ['centros', 'trabajadores', 'maestro_centros', 'cuenta_motivos']:
+            optimizada._load_single_sheet(ruta, hoja)
+        optimizada._load_single_sheet(ruta, 'tarifas_incidencias', skiprows=3, usecols="A:C")
+
+    crono.medir('carga', carga)
+    dm = optimizada.OptimizedDataManager()
+    crono.medir('preprocesado', lambda: (dm.df_centros, dm.df_trabajadores))
+    crono.medir('lookups', dm._ensure_cache_built)
+    incidencias, _ = crono.medir('enriquecimiento', lambda: optimizada.incidencias_desde_registros(registros, dm))
+
+    optimizada.OptimizedIncidenciasApp()
+    jefe = dm.get_jefes()[0]
+    st.session_state.selected_imputacion = IMPUTACION
+    st.session_state.selected_jefe = jefe
+    tabla = optimizada.OptimizedTablaIncidencias(dm)
+
+    def alta():
+        almacen = optimizada.get_almacen(IMPUTACION, jefe)
+        for incidencia in incidencias:
+            almacen.cas(incidencia, 0)
+
+    crono.medir('alta_almacen', alta)
+    crono.medir('sincronizacion', tabla.sincronizar)
+    pagina = st.session_state.incidencias[:FILAS_PAGINA]
+    crono.medir('pagina', lambda: tabla._render_table_page(pagina, jefe, 0))
+    st.session_state['unificado_editor_page_1'] = {'edited_rows': _ediciones_pagina(len(pagina))}
+    crono.medir('guardado', lambda: tabla._aplicar_cambios_pagina(0, jefe))
+    crono.medir('metricas', st.session_state.metricas.totales)
+
+    datos = crono.medir('export_frame', lambda: optimizada.OptimizedExportManager.get_export_data(
+        st.session_state.incidencias, dm, st.session_state.version_vista))
+    df = datos['df']
+    parte = df.head(max_xlsx)
+    crono.medir('export_xlsx', lambda: optimizada.OptimizedExportManager.generar_export(parte, 'xlsx', None, datos['resumenes']),
+                len(df) / len(parte))
+    crono.medir('export_parquet', lambda: optimizada.OptimizedExportManager.generar_export(df, 'parquet'))
+    return crono.filas
+
+
+def medir_implementacion(implementacion: str, directorio: str, empleados: int, n_incidencias: int,
+                         muestra_original: int, max_xlsx: int, seed: int, memoria: bool = False) -> Dict:
+    """Proceso hijo: todas las etapas de una implementación sobre un escenario (y su perfil de memoria)"""
+    os.environ['INCIDENCIAS_AUTOGUARDADO'] = '0'
+    if memoria:
+        os.environ['INCIDENCIAS_PERFIL_MEMORIA'] = '1'
+    os.chdir(directorio)  # Las dos implementaciones leen data/maestros.xlsx
+    sys.path.insert(0, str(RAIZ))
+    from streamlit import logger as st_logger
+    st_logger.set_log_level('error')
+
+    registros = generar_incidencias(n_incidencias, empleados, seed)
+    if implementacion == 'app.py':
+        # app.py no tiene etapas perfiladas
+        return {'etapas': _etapas_original(registros, muestra_original), 'memoria': {}}
+    etapas = _etapas_optimizada(registros, max_xlsx)
+    import app_optimized
+    return {'etapas': etapas, 'memoria': app_optimized.get_perfil_memoria().informe()}
+
+# =============================================================================
+# INFORME
+# =============================================================================
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _clave(fila: Dict) -> tuple:
+    return fila['implementacion'], fila['empleados'], fila['incidencias'], fila['etapa']
+
+
+def comparar(actual: Dict, anterior: Dict, umbral: float) -> int:
+    """Imprime actual/anterior por etapa y devuelve cuántas etapas empeoran más que el umbral"""
+    previas = {_clave(fila): fila for fila in anterior['resultados']}
+    print(f"\nComparación con {anterior.get('fecha')} (commit {anterior.get('commit')}):")
+    if anterior['parametros'].get('memoria') != actual['parametros'].get('memoria'):
+        print("  (solo una de las dos ejecuciones tiene --memoria: los tiempos no son comparables)")
+    print(f"{'implementación':>17} {'escenario':>16} {'etapa':>16} {'antes (s)':>10} {'ahora (s)':>10} {'ratio':>7}")
+    regresiones = 0
+    for fila in actual['resultados']:
+        previa = previas.get(_clave(fila))
+        if previa is None or previa['segundos'] <= 0:
+            continue
+        ratio = fila['segundos'] / previa['segundos']
+        marca = ''
+        if ratio > umbral:
+            regresiones += 1
+            marca = ' ⚠️'
+        print(f"{fila['implementacion']:>17} {fila['empleados']:>7}x{fila['incidencias']:<8} {fila['etapa']:>16} "
+              f"{previa['segundos']:>10.3f} {fila['segundos']:>10.3f} {ratio:>7.2f}{marca}")
+
+    previas = {_clave(fila): fila for fila in anterior.get('memoria', [])}
+    if actual.get('memoria') and previas:
+        print(f"\n{'implementación':>17} {'escenario':>16} {'etapa':>24} {'pico antes':>11} {'pico ahora':>11} {'ratio':>7}")
+    for fila in actual.get('memoria', []):
+        previa = previas.get(_clave(fila))
+        if previa is None or previa['pico_mb'] <= 0:
+            continue
+        ratio = fila['pico_mb'] / previa['pico_mb']
+        marca = ''
+        if ratio > umbral:
+            regresiones += 1
+            marca = ' ⚠️'
+        print(f"{fila['implementacion']:>17} {fila['empleados']:>7}x{fila['incidencias']:<8} {fila['etapa']:>24} "
+              f"{previa['pico_mb']:>8,.1f} MB {fila['pico_mb']:>8,.1f} MB {ratio:>7.2f}{marca}")
+    return regresiones
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--escenarios', nargs='+', default=ESCENARIOS,
+                        help="TRABAJADORESxINCIDENCIAS, p. ej. 200000x1000000")
+    parser.add_argument('--implementaciones', nargs='+', choices=IMPLEMENTACIONES, default=IMPLEMENTACIONES)
+    parser.add_argument('--muestra-original', type=int, default=MUESTRA_ORIGINAL,
+                        help="Incidencias medidas en app.py; por encima se extrapola")
+    parser.add_argument('--max-xlsx', type=int, default=MAX_XLSX, help="Filas del Excel medidas; por encima se extrapola")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--regenerar', action='store_true', help="Volver a generar los maestros sintéticos")
+    parser.add_argument('--salida', type=Path, default=None, help="Informe JSON (por defecto en benchmarks/resultados/)")
+    parser.add_argument('--comparar', type=Path, default=None, help="Informe JSON anterior con el que comparar")
+    parser.add_argument('--umbral', type=float, default=1.2, help="Ratio a partir del cual una etapa cuenta como regresión")
+    parser.add_argument('--memoria', action='store_true',
+                        help="Perfil de memoria por etapa de app_optimized.py (tracemalloc; encarece los tiempos)")
+    args = parser.parse_args()
+
+    escenarios = []
+    for escenario in args.escenarios:
+        empleados, _, incidencias = escenario.partition('x')
+        escenarios.append((int(empleados), int(incidencias)))
+
+    informe = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parametros': {'muestra_original': args.muestra_original, 'max_xlsx': args.max_xlsx, 'seed': args.seed,
+                       'memoria': args.memoria},
+        'resultados': [],
+        'memoria': [],
+    }
+    print(f"{'implementación':>17} {'escenario':>16} {'etapa':>16} {'segundos':>10} {'pico RSS (MB)':>14}")
+    for empleados, n_incidencias in escenarios:
+        directorio = DATOS_DIR / f"trabajadores_{empleados}"
+        maestros = directorio / 'data' / 'maestros.xlsx'
+        if args.regenerar or not maestros.exists():
+            inicio = time.perf_counter()
+            generar_maestros(maestros, empleados, args.seed)
+            print(f"  (maestro sintético de {empleados:,} trabajadores generado en {time.perf_counter() - inicio:.1f}s)")
+        for implementacion in args.implementaciones:
+            # Proceso nuevo por medida: ni cachés ni memoria de la anterior
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn')) as pool:
+                medida = pool.submit(medir_implementacion, implementacion, str(directorio), empleados, n_incidencias,
+                                     args.muestra_original, args.max_xlsx, args.seed, args.memoria).result()
+            for etapa, datos in medida['memoria'].items():
+                informe['memoria'].append({'implementacion': implementacion, 'empleados': empleados,
+                                           'incidencias': n_incidencias, 'etapa': etapa, **datos})
+            for fila in medida['etapas']:
+                fila = {'implementacion': implementacion, 'empleados': empleados, 'incidencias': n_incidencias, **fila}
+                informe['resultados'].append(fila)
+                extrapolado = ' *' if fila['extrapolado'] else ''
+                print(f"{implementacion:>17} {empleados:>7}x{n_incidencias:<8} {fila['etapa']:>16} "
+                      f"{fila['segundos']:>10.3f}{extrapolado:2} {fila['pico_rss_mb']:>12,.0f}")
+    print("  * extrapolado desde una muestra")
+    if informe['memoria']:
+        print(f"\n{'implementación':>17} {'escenario':>16} {'etapa':>24} {'pico (MB)':>10} {'neto (MB)':>10}  sitio que más retiene")
+        for fila in informe['memoria']:
+            sitio = fila['sitios'][0]['sitio'] if fila['sitios'] else ''
+            print(f"{fila['implementacion']:>17} {fila['empleados']:>7}x{fila['incidencias']:<8} {fila['etapa']:>24} "
+                  f"{fila['pico_mb']:>10,.1f} {fila['neto_mb']:>10,.1f}  {sitio}")
+
+    salida = args.salida or RESULTADOS_DIR / f"pipeline_{datetime.now():%Y%m%d_%H%M%S}.json"
+    salida.parent.mkdir(parents=True, exist_ok=True)
+    salida.write_text(json.dumps(informe, indent=2, ensure_ascii=False), encoding='utf-8')
+    print(f"Informe: {salida}")
+
+    if args.comparar:
+        regresiones = comparar(informe, json.loads(args.comparar.read_text(encoding='utf-8')), args.umbral)
+        if regresiones:
+            print(f"⚠️ {regresiones} etapas empeoran más de {args.umbral:.2f}x (tiempo o pico de memoria)")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Benchmark de carga del servicio HTTP (servicio.py).
+
+Arranca el servicio en un proceso aparte y lo ataca con un generador de
+carga local: varios clientes concurrentes con conexión keep-alive durante
+un tiempo fijo por escenario. Informa peticiones/s, filas/s y latencias
+p50/p99. Ejecutar desde la raíz del repo:
+
+    python -m benchmarks.bench_servicio [--clientes 8] [--segundos 10] [--filas 1000]
+"""
+import argparse
+import http.client
+import json
+import multiprocessing as mp
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def _servir(cola: mp.Queue) -> None:
+    import servicio
+    servidor = servicio.crear_servidor(puerto=0)
+    cola.put(servidor.server_address[1])
+    servidor.serve_forever()
+
+
+def _registros(n: int, empleados: list, rng: np.random.Generator) -> list:
+    motivos = ['Absentismo', 'Refuerzo', 'Eventos', 'Festivos y Fines de Semana', 'Nocturnidad']
+    return [
+        {
+            'trabajador': empleados[i],
+            'imputacion_nomina': '03 Marzo',
+            'facturable': 'Sí',
+            'motivo': motivos[m],
+            'codigo_crown_destino': 100002,
+            'incidencia_horas': float(h),
+            'incidencia_precio': 12.5,
+            'nocturnidad_horas': float(nh),
+            'traslados_total': 0.0,
+            'fecha': f"2025-03-{d:02d}",
+            'observaciones': 'bench',
+        }
+        for i, m, h, nh, d in zip(
+            rng.integers(0, len(empleados), n), rng.integers(0, len(motivos), n),
+            rng.integers(1, 8, n), rng.integers(0, 3, n), rng.integers(1, 29, n)
+        )
+    ]
+
+
+def _cliente(puerto: int, ruta: str, cuerpo: bytes, hasta: float, latencias: list) -> None:
+    conexion = http.client.HTTPConnection('127.0.0.1', puerto)
+    cabeceras = {'Content-Type': 'application/json'}
+    while time.perf_counter() < hasta:
+        inicio = time.perf_counter()
+        conexion.request('POST', ruta, body=cuerpo, headers=cabeceras)
+        respuesta = conexion.getresponse()
+        respuesta.read()
+        if respuesta.status >= 400:
+            raise RuntimeError(f"{ruta}: HTTP {respuesta.status}")
+        latencias.append(time.perf_counter() - inicio)
+    conexion.close()
+
+
+def medir(puerto: int, ruta: str, cuerpo: bytes, clientes: int, segundos: float) -> list:
+    latencias: list = []
+    hasta = time.perf_counter() + segundos
+    hilos = [threading.Thread(target=_cliente, args=(puerto, ruta, cuerpo, hasta, latencias)) for _ in range(clientes)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return latencias
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clientes', type=int, default=8)
+    parser.add_argument('--segundos', type=float, default=10.0)
+    parser.add_argument('--filas', type=int, default=1000, help="Filas por petición de lote")
+    args = parser.parse_args()
+
+    empleados = pd.read_excel('data/maestros.xlsx', sheet_name='trabajadores')['Nombre empleado'].dropna().str.upper().tolist()
+    rng = np.random.default_rng(0)
+    registros = _registros(args.filas, empleados, rng)
+    pares = [{'categoria': 'ASL', 'cod_reg_convenio': '99100165012016'}] * args.filas
+    escenarios = [
+        ('/empleados/lote', {'trabajadores': [r['trabajador'] for r in registros]}),
+        ('/nocturnidad/lote', {'pares': pares}),
+        ('/costes/lote', {'incidencias': registros}),
+        ('/export/lote?formato=parquet', {'incidencias': registros}),
+    ]
+
+    ctx = mp.get_context('spawn')
+    cola = ctx.Queue()
+    servidor = ctx.Process(target=_servir, args=(cola,), daemon=True)
+    servidor.start()
+    puerto = cola.get()
+    try:
+        print(f"{args.clientes} clientes, {args.filas} filas por petición, {args.segundos:.0f}s por escenario")
+        print(f"{'endpoint':>30} {'peticiones':>11} {'pet/s':>8} {'filas/s':>10} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+        for ruta, cuerpo in escenarios:
+            latencias = np.array(medir(puerto, ruta, json.dumps(cuerpo).encode(), args.clientes, args.segundos))
+            por_segundo = len(latencias) / args.segundos
+            p50, p99 = np.percentile(latencias, [50, 99]) * 1e3
+            print(f"{ruta:>30} {len(latencias):>11,} {por_segundo:>8.1f} {por_segundo * args.filas:>10,.0f} {p50:>9.1f} {p99:>9.1f}")
+    finally:
+        servidor.terminate()
+        servidor.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Consolida los exports de cada supervisor en un fichero mensual de nómina.
+
+Lee en paralelo los ficheros incidencias_<jefe>_<timestamp>.xlsx de un
+directorio, comprueba que todos tienen el esquema del export, concatena y
+elimina filas duplicadas, y escribe un consolidado por imputación de nómina
+con hojas de resumen por supervisor y por cuenta:
+
+    python consolidacion.py exports/ --salida consolidados/
+"""
+import argparse
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from export_writers import (
+    CUENTA_EXPORT_COLUMNS, EXCEL_MAX_ROWS, EXPORT_DTYPES, EXPORT_NUMBER_FORMATS,
+    StreamingXlsxWriter, apply_export_dtypes, supervisor_de_nombre
+)
+
+PATRON_EXPORTS = 'incidencias_*.xlsx'
+_NOMBRE_EXPORT_RE = re.compile(r'^incidencias_(?P<jefe>.+)_\d{8}_\d{6}$')
+
+# Columnas añadidas al export cuando ya había ficheros descargados: si faltan se completan con este valor
+COLUMNAS_OPCIONALES = {'duplicada': False}
+
+
+class EsquemaIncompatibleError(ValueError):
+    """Algún fichero no tiene las columnas del export"""
+
+
+def supervisor_de_fichero(path: Path) -> str:
+    """Supervisor que descargó el export, según el nombre incidencias_<jefe>_<timestamp>.xlsx"""
+    match = _NOMBRE_EXPORT_RE.match(path.stem)
+    return supervisor_de_nombre(match.group('jefe')) if match else path.stem
+
+
+def leer_export(path: Path) -> Tuple[Path, pd.DataFrame]:
+    """Lee un export de supervisor (se ejecuta en un proceso trabajador)"""
+    df = pd.read_excel(path, sheet_name=0, engine='openpyxl')
+    return path, completar_columnas_opcionales(df)
+
+
+def completar_columnas_opcionales(df: pd.DataFrame) -> pd.DataFrame:
+    """Añade en su posición del export las COLUMNAS_OPCIONALES que falten (exports anteriores a ellas)"""
+    columnas = [str(col) for col in df.columns]
+    for columna, valor in COLUMNAS_OPCIONALES.items():
+        if columna not in columnas:
+            esperado = list(EXPORT_DTYPES)
+            anteriores = set(esperado[:esperado.index(columna)])
+            # Tras la última columna presente de las que la preceden en el export
+            posicion = max((i + 1 for i, col in enumerate(columnas) if col in anteriores), default=0)
+            df.insert(posicion, columna, valor)
+            columnas.insert(posicion, columna)
+    return df
+
+
+def validar_esquemas(frames: Dict[Path, pd.DataFrame]) -> None:
+    """Todos los ficheros deben tener exactamente las columnas de EXPORT_DTYPES"""
+    esperado = list(EXPORT_DTYPES)
+    errores = []
+    for path, df in frames.items():
+        columnas = [str(col) for col in df.columns]
+        if columnas != esperado:
+            faltan = sorted(set(esperado) - set(columnas))
+            sobran = sorted(set(columnas) - set(esperado))
+            detalle = f"faltan {faltan}, sobran {sobran}" if (faltan or sobran) else "orden de columnas distinto"
+            errores.append(f"  {path.name}: {detalle}")
+    if errores:
+        raise EsquemaIncompatibleError("Esquema incompatible en:\n" + "\n".join(errores))
+
+
+def consolidar(frames: Dict[Path, pd.DataFrame]) -> pd.DataFrame:
+    """Concatena y deduplica las filas de todos los exports.
+
+    Se añade la columna 'supervisor' (quién descargó el fichero): las filas
+    repetidas de un mismo supervisor (descargas repetidas) se eliminan, las
+    coincidencias entre supervisores distintos se conservan.
+    """
+    df = pd.concat(
+        [f.assign(supervisor=supervisor_de_fichero(path)) for path, f in frames.items()],
+        ignore_index=True
+    )
+    apply_export_dtypes(df)
+    df['supervisor'] = df['supervisor'].astype('string')
+    return df.drop_duplicates(ignore_index=True)
+
+
+def resumen_por_supervisor(df: pd.DataFrame) -> pd.DataFrame:
+    return (
+        df.groupby('supervisor', dropna=False)
+        .agg(
+            incidencias=('nombre_empleado', 'size'),
+            trabajadores=('nombre_empleado', 'nunique'),
+            incidencia_horas=('incidencia_horas', 'sum'),
+            nocturnidad_horas=('nocturnidad_horas', 'sum'),
+            traslados_total=('traslados_total', 'sum'),
+            **{col: (col, 'sum') for col in CUENTA_EXPORT_COLUMNS},
+            Coste_total=('Coste_total', 'sum'),
+        )
+        .reset_index()
+        .sort_values('Coste_total', ascending=False)
+    )
+
+
+def resumen_por_cuenta(df: pd.DataFrame) -> pd.DataFrame:
+    importes = df[CUENTA_EXPORT_COLUMNS]
+    return pd.DataFrame({
+        'cuenta': CUENTA_EXPORT_COLUMNS,
+        'filas_con_importe': (importes != 0).sum().to_numpy(),
+        'importe': importes.sum().to_numpy(),
+    })
+
+
+def escribir_consolidado(df: pd.DataFrame, path: Path, max_rows: int = EXCEL_MAX_ROWS) -> None:
+    """Escribe datos y resúmenes; los datos se parten en varias hojas si superan max_rows"""
+    writer = StreamingXlsxWriter(EXPORT_NUMBER_FORMATS)
+    with open(path, 'wb') as f:
+        writer.write_sheets(
+            {
+                'incidencias': df,
+                'resumen_supervisor': resumen_por_supervisor(df),
+                'resumen_cuenta': resumen_por_cuenta(df),
+            },
+            f,
+            max_rows=max_rows,
+        )
+
+
+def _nombre_mes(imputacion) -> str:
+    return str(imputacion).strip().replace(' ', '_') if pd.notna(imputacion) and str(imputacion).strip() else 'sin_imputacion'
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Consolida los exports de incidencias de los supervisores")
+    parser.add_argument('directorio', type=Path, help="Directorio con los ficheros incidencias_*.xlsx")
+    parser.add_argument('--salida', type=Path, default=Path('.'), help="Directorio de salida")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos lectores (por defecto, nº de CPUs)")
+    parser.add_argument('--filas-por-hoja', type=int, default=EXCEL_MAX_ROWS, help="Máximo de filas de datos por hoja")
+    args = parser.parse_args(argv)
+
+    paths = sorted(args.directorio.glob(PATRON_EXPORTS))
+    if not paths:
+        print(f"No hay ficheros {PATRON_EXPORTS} en {args.directorio}", file=sys.stderr)
+        return 1
+
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.procesos) as pool:
+        frames = dict(pool.map(leer_export, paths))
+
+    try:
+        validar_esquemas(frames)
+    except EsquemaIncompatibleError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    df = consolidar(frames)
+    filas_leidas = sum(len(f) for f in frames.values())
+    print(f"Leídos {len(paths)} ficheros, {filas_leidas:,} filas ({filas_leidas - len(df):,} duplicadas)")
+
+    args.salida.mkdir(parents=True, exist_ok=True)
+    for imputacion, df_mes in df.groupby('imputacion_nomina', dropna=False, sort=True):
+        path = args.salida / f"consolidado_{_nombre_mes(imputacion)}.xlsx"
+        escribir_consolidado(df_mes.reset_index(drop=True), path, args.filas_por_hoja)
+        print(f"✅ {path}: {len(df_mes):,} filas")
+
+    print(f"Tiempo total: {time.perf_counter() - inicio:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
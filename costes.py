@@ -0,0 +1,130 @@
+import re
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# MOTOR DE COSTES
+# =============================================================================
+
+@dataclass(frozen=True)
+class CostingConfig:
+    # Cargas sociales de la empresa aplicadas a incidencias y nocturnidad
+    factor_seguridad_social: float = 1.3195
+    # Traslados_total se registra en horas y se valora a coste hora empresa
+    traslados_a_coste_hora: bool = True
+
+
+DEFAULT_COSTING = CostingConfig()
+
+# Columnas del export a las que se imputa el total de incidencia según la cuenta
+CUENTA_COLUMNAS = {
+    '73': '73_plus_sustitucion',
+    '72': '72_incentivos',
+    '70/71': '70_71_festivos',
+    '70': '70_71_festivos',
+    '71': '70_71_festivos',
+    '74': '74_plus_nocturnidad',
+}
+_CODIGO_CUENTA_RE = re.compile(r'(\d+)')
+
+# Columnas que calcula compute_costs, en el orden en que se añaden al export
+COST_COLUMNS = [
+    '73_plus_sustitucion', '72_incentivos', '70_71_festivos', '74_plus_nocturnidad', 'Coste_total'
+]
+
+
+def preprocess_cuenta_motivos(df: pd.DataFrame) -> Dict[str, str]:
+    """Compila cuenta_motivos en un mapeo motivo -> columna del export"""
+    if df.empty or 'Motivo' not in df.columns or 'desc_cuenta' not in df.columns:
+        return {}
+    df = df.dropna(subset=['Motivo'])
+    desc = df['desc_cuenta'].astype(str)
+    codigo = pd.Series(
+        np.where(
+            desc.str.contains('70/71', regex=False),
+            '70/71',
+            desc.str.extract(_CODIGO_CUENTA_RE, expand=False)
+        ),
+        index=df.index
+    )
+    columna = codigo.map(CUENTA_COLUMNAS)
+    mask = columna.notna()
+    return dict(zip(df.loc[mask, 'Motivo'], columna[mask]))
+
+
+def _as_float(df: pd.DataFrame, col: str) -> np.ndarray:
+    return pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float, na_value=0.0)
+
+
+def compute_costs(df: pd.DataFrame, cuenta_columnas: Dict[str, str],
+                  config: CostingConfig = DEFAULT_COSTING) -> Dict[str, np.ndarray]:
+    """Calcula todas las columnas de coste en una pasada NumPy sobre las columnas de entrada.
+
+    Devuelve además los componentes intermedios (coste_incidencia, coste_nocturnidad,
+    coste_traslados) que usan las métricas.
+    """
+    horas = _as_float(df, 'incidencia_horas')
+    precio = _as_float(df, 'incidencia_precio')
+    noct_horas = _as_float(df, 'nocturnidad_horas')
+    noct_precio = _as_float(df, 'precio_nocturnidad')
+    traslados = _as_float(df, 'traslados_total')
+
+    coste_incidencia = horas * precio
+    coste_nocturnidad = noct_horas * noct_precio
+    if config.traslados_a_coste_hora:
+        coste_traslados = traslados * _as_float(df, 'coste_hora')
+    else:
+        coste_traslados = traslados
+
+    # Un único mapeo categórico motivo -> columna (solo se evalúan los motivos distintos)
+    columna = df['motivo'].astype('category').map(cuenta_columnas).to_numpy(dtype=object)
+
+    return {
+        '73_plus_sustitucion': np.where(columna == '73_plus_sustitucion', coste_incidencia, 0.0),
+        '72_incentivos': np.where(columna == '72_incentivos', coste_incidencia, 0.0),
+        '70_71_festivos': np.where(columna == '70_71_festivos', coste_incidencia, 0.0),
+        # La cuenta 74 recoge la nocturnidad, no el total de incidencia
+        '74_plus_nocturnidad': coste_nocturnidad,
+        'Coste_total': (coste_incidencia + coste_nocturnidad) * config.factor_seguridad_social + coste_traslados,
+        'coste_incidencia': coste_incidencia,
+        'coste_nocturnidad': coste_nocturnidad,
+        'coste_traslados': coste_traslados,
+    }
+
+
+def add_cost_columns(df: pd.DataFrame, cuenta_columnas: Dict[str, str],
+                     config: CostingConfig = DEFAULT_COSTING) -> Dict[str, np.ndarray]:
+    """Añade COST_COLUMNS al DataFrame y devuelve el resultado completo de compute_costs"""
+    costes = compute_costs(df, cuenta_columnas, config)
+    for col in COST_COLUMNS:
+        df[col] = costes[col]
+    return costes
+
+
+def metric_totals(total_incidencias: float, total_nocturnidad: float, total_traslados: float,
+                  config: CostingConfig = DEFAULT_COSTING) -> Dict[str, float]:
+    """Métricas de cabecera a partir de los tres componentes ya sumados"""
+    return {
+        'total_incidencias': total_incidencias,
+        'total_nocturnidad': total_nocturnidad,
+        'total_traslados': total_traslados,
+        'total_simple': total_incidencias + total_nocturnidad + total_traslados,
+        'total_con_ss': (total_incidencias + total_nocturnidad) * config.factor_seguridad_social + total_traslados,
+    }
+
+
+def cost_totals(costes: Dict[str, np.ndarray]) -> Dict[str, float]:
+    """Métricas de cabecera a partir del resultado de compute_costs"""
+    total_incidencias = float(costes['coste_incidencia'].sum())
+    total_nocturnidad = float(costes['coste_nocturnidad'].sum())
+    total_traslados = float(costes['coste_traslados'].sum())
+    return {
+        'total_incidencias': total_incidencias,
+        'total_nocturnidad': total_nocturnidad,
+        'total_traslados': total_traslados,
+        'total_simple': total_incidencias + total_nocturnidad + total_traslados,
+        'total_con_ss': float(costes['Coste_total'].sum()),
+    }
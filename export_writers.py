@@ -0,0 +1,474 @@
+import io
+import multiprocessing as mp
+import os
+import re
+import tempfile
+import threading
+import zipfile
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+# =============================================================================
+# ESQUEMA DEL EXPORT
+# =============================================================================
+
+# Tipos explícitos de cada columna del export (Excel, CSV, Parquet y JSON Lines)
+EXPORT_DTYPES = {
+    'jefe_ope': 'string',
+    'nombre_empleado': 'string',
+    'imputacion_nomina': 'string',
+    'facturable': 'string',
+    'motivo': 'string',
+    'codigo_crown_origen': 'Int64',
+    'codigo_crown_destino': 'Int64',
+    'empresa_destino': 'string',
+    'incidencia_horas': 'float64',
+    'incidencia_precio': 'float64',
+    'nocturnidad_horas': 'float64',
+    'precio_nocturnidad': 'float64',
+    'traslados_total': 'float64',
+    'coste_hora': 'float64',
+    'fecha': 'datetime64[ns]',
+    'observaciones': 'string',
+    'centro_preferente': 'Int64',
+    'categoria': 'string',
+    'servicio': 'string',
+    'cod_reg_convenio': 'string',
+    '73_plus_sustitucion': 'float64',
+    '72_incentivos': 'float64',
+    '70_71_festivos': 'float64',
+    '74_plus_nocturnidad': 'float64',
+    'Coste_total': 'float64',
+    'duplicada': 'boolean',
+}
+
+# Columnas de imputación por cuenta contable
+CUENTA_EXPORT_COLUMNS = ['70_71_festivos', '72_incentivos', '73_plus_sustitucion', '74_plus_nocturnidad']
+
+# Formatos numéricos del Excel, fijados una vez por columna
+EXPORT_NUMBER_FORMATS = {
+    'fecha': 'dd/mm/yyyy',
+    'incidencia_precio': '#,##0.00',
+    'precio_nocturnidad': '#,##0.00',
+    'coste_hora': '#,##0.00',
+    '73_plus_sustitucion': '#,##0.00',
+    '72_incentivos': '#,##0.00',
+    '70_71_festivos': '#,##0.00',
+    '74_plus_nocturnidad': '#,##0.00',
+    'Coste_total': '#,##0.00',
+}
+
+
+def apply_export_dtypes(df: pd.DataFrame) -> None:
+    """Fija los dtypes del export con una conversión vectorizada por columna"""
+    for col, dtype in EXPORT_DTYPES.items():
+        if col not in df.columns:
+            continue
+        if dtype in ('Int64', 'float64'):
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+        else:
+            df[col] = df[col].astype(dtype)
+
+# =============================================================================
+# NOMBRES DE FICHERO
+# =============================================================================
+
+# '_' separa las partes del nombre y sustituye a los espacios: los '_' propios del supervisor se escapan
+_ESCAPES_NOMBRE = {'%': '%25', '_': '%5F', '/': '%2F', '\\': '%5C'}
+
+
+def supervisor_en_fichero(supervisor: str) -> str:
+    """Supervisor tal como va en incidencias_<supervisor>_<timestamp>.xlsx; supervisor_de_nombre lo invierte"""
+    return ''.join(_ESCAPES_NOMBRE.get(c, c) for c in supervisor).replace(' ', '_')
+
+
+def supervisor_de_nombre(etiqueta: str) -> str:
+    """Inversa exacta de supervisor_en_fichero (los nombres sin escapes, de antes, se leen igual que entonces)"""
+    return unquote(etiqueta.replace('_', ' '))
+
+# =============================================================================
+# ESCRITORES DE EXCEL
+# =============================================================================
+
+def iter_row_chunks(df: pd.DataFrame, chunk_size: int) -> Iterator[List[list]]:
+    """Recorre el DataFrame en bloques de filas como listas Python (NaN/NaT -> None)"""
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size].astype(object)
+        yield chunk.where(chunk.notna(), None).to_numpy().tolist()
+
+
+EXCEL_MAX_ROWS = 1_048_575  # Filas de datos por hoja (límite de Excel menos la cabecera)
+
+
+def iter_sheet_parts(frames: Dict[str, pd.DataFrame], max_rows: int = EXCEL_MAX_ROWS) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """Hojas a escribir; las que superan max_rows se parten en nombre_2, nombre_3..."""
+    for sheet_name, df in frames.items():
+        for part, start in enumerate(range(0, max(len(df), 1), max_rows), start=1):
+            yield (sheet_name if part == 1 else f"{sheet_name}_{part}"), df.iloc[start:start + max_rows]
+
+
+class ExcelWriterBackend(ABC):
+    """Escribe uno o varios DataFrames como hojas de un .xlsx"""
+    name: str = ""
+
+    def __init__(self, number_formats: Optional[Dict[str, str]] = None):
+        # Formato numérico por nombre de columna (p.ej. {'fecha': 'dd/mm/yyyy'})
+        self.number_formats = number_formats or {}
+
+    @abstractmethod
+    def write_sheets(self, frames: Dict[str, pd.DataFrame], buffer, max_rows: int = EXCEL_MAX_ROWS) -> None:
+        ...
+
+    def write(self, df: pd.DataFrame, buffer, sheet_name: str = 'Sheet1') -> None:
+        self.write_sheets({sheet_name: df}, buffer)
+
+    def to_bytes(self, df: pd.DataFrame, sheet_name: str = 'Sheet1') -> bytes:
+        return self.sheets_to_bytes({sheet_name: df})
+
+    def sheets_to_bytes(self, frames: Dict[str, pd.DataFrame]) -> bytes:
+        buffer = io.BytesIO()
+        self.write_sheets(frames, buffer)
+        return buffer.getvalue()
+
+
+class PandasOpenpyxlWriter(ExcelWriterBackend):
+    """Motor original: df.to_excel con openpyxl (modelo de celdas completo en memoria)"""
+    name = "openpyxl"
+
+    def write_sheets(self, frames: Dict[str, pd.DataFrame], buffer, max_rows: int = EXCEL_MAX_ROWS) -> None:
+        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+            for sheet_name, df in iter_sheet_parts(frames, max_rows):
+                df.to_excel(writer, index=False, sheet_name=sheet_name)
+                ws = writer.sheets[sheet_name]
+                for col_idx, col in enumerate(df.columns, start=1):
+                    fmt = self.number_formats.get(col)
+                    if fmt:
+                        for (cell,) in ws.iter_rows(min_row=2, min_col=col_idx, max_col=col_idx):
+                            cell.number_format = fmt
+
+
+class StreamingXlsxWriter(ExcelWriterBackend):
+    """Escritura en streaming con openpyxl write-only: filas por bloques, memoria constante"""
+    name = "streaming"
+    CHUNK_SIZE = 5_000
+
+    def __init__(self, number_formats: Optional[Dict[str, str]] = None, chunk_size: int = CHUNK_SIZE,
+                 progress: Optional[Callable[[int], None]] = None):
+        super().__init__(number_formats)
+        self.chunk_size = chunk_size
+        # Se llama con las filas escritas tras cada bloque (avance de trabajos en segundo plano)
+        self.progress = progress
+
+    def write_sheets(self, frames: Dict[str, pd.DataFrame], buffer, max_rows: int = EXCEL_MAX_ROWS) -> None:
+        wb = Workbook(write_only=True)
+        try:
+            for sheet_name, df in iter_sheet_parts(frames, max_rows):
+                self.append_frame(wb.create_sheet(sheet_name), df)
+        except BaseException:
+            self._discard(wb)
+            raise
+        wb.save(buffer)
+
+    @staticmethod
+    def _discard(wb: Workbook) -> None:
+        """Borra los temporales de las hojas de un libro abandonado a medias (p. ej. export cancelado)"""
+        for ws in wb.worksheets:
+            writer = getattr(ws, '_writer', None)
+            if writer is not None:
+                if not ws.closed:
+                    ws.close()
+                writer.cleanup()
+
+    def append_frame(self, ws, df: pd.DataFrame, header: bool = True) -> None:
+        """Añade el DataFrame a una hoja write-only ya abierta"""
+        if header:
+            ws.append([str(col) for col in df.columns])
+
+        # Formatos resueltos una sola vez por columna
+        formatos = [
+            (col_idx, fmt) for col_idx, col in enumerate(df.columns)
+            if (fmt := self.number_formats.get(col))
+        ]
+
+        for rows in iter_row_chunks(df, self.chunk_size):
+            for row in rows:
+                for col_idx, fmt in formatos:
+                    cell = WriteOnlyCell(ws, value=row[col_idx])
+                    cell.number_format = fmt
+                    row[col_idx] = cell
+                ws.append(row)
+            if self.progress is not None:
+                self.progress(len(rows))
+
+
+EXCEL_WRITERS = {
+    StreamingXlsxWriter.name: StreamingXlsxWriter,
+    PandasOpenpyxlWriter.name: PandasOpenpyxlWriter,
+}
+DEFAULT_EXCEL_WRITER = StreamingXlsxWriter.name
+
+
+def get_excel_writer(name: str = DEFAULT_EXCEL_WRITER, number_formats: Optional[Dict[str, str]] = None) -> ExcelWriterBackend:
+    """Instancia el escritor registrado con ese nombre"""
+    if name not in EXCEL_WRITERS:
+        raise ValueError(f"Escritor de Excel desconocido: '{name}'. Disponibles: {', '.join(EXCEL_WRITERS)}")
+    return EXCEL_WRITERS[name](number_formats=number_formats)
+
+
+# =============================================================================
+# FORMATOS TABULARES EN STREAMING (CSV / PARQUET / JSON LINES)
+# =============================================================================
+
+STREAM_CHUNK_SIZE = 50_000
+
+
+def iter_csv(df: pd.DataFrame, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """CSV UTF-8 por bloques; la cabecera solo en el primero"""
+    for start in range(0, max(len(df), 1), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        yield chunk.to_csv(index=False, header=(start == 0), date_format='%Y-%m-%d').encode('utf-8')
+
+
+def iter_jsonl(df: pd.DataFrame, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """JSON Lines por bloques (un registro por línea, fechas ISO)"""
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        data = chunk.to_json(orient='records', lines=True, date_format='iso', force_ascii=False)
+        yield (data if data.endswith('\n') else data + '\n').encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Destino de escritura que entrega lo escrito por partes sin perder la posición"""
+
+    def __init__(self):
+        super().__init__()
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def iter_parquet(df: pd.DataFrame, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Parquet con un row group por bloque; el esquema sale de los dtypes del DataFrame"""
+    schema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for start in range(0, len(df), chunk_size):
+            chunk = df.iloc[start:start + chunk_size]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+# formato -> (generador, extensión, mime)
+STREAM_FORMATS = {
+    'csv': (iter_csv, '.csv', 'text/csv'),
+    'parquet': (iter_parquet, '.parquet', 'application/vnd.apache.parquet'),
+    'jsonl': (iter_jsonl, '.jsonl', 'application/x-ndjson'),
+}
+
+
+def iter_stream_format(df: pd.DataFrame, formato: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Genera el export en el formato pedido, bloque a bloque"""
+    if formato not in STREAM_FORMATS:
+        raise ValueError(f"Formato de export desconocido: '{formato}'. Disponibles: {', '.join(STREAM_FORMATS)}")
+    generador, _, _ = STREAM_FORMATS[formato]
+    return generador(df, chunk_size)
+
+
+# =============================================================================
+# EXPORT PARTICIONADO EN ZIP
+# =============================================================================
+
+# Claves por las que se puede partir el export (un fichero por valor)
+PARTITION_KEYS = ['codigo_crown_destino', 'empresa_destino']
+
+_export_pool: Optional[ProcessPoolExecutor] = None
+_export_pool_lock = threading.Lock()
+
+
+def get_export_pool() -> ProcessPoolExecutor:
+    """Pool de procesos compartido para generar ficheros de export.
+
+    Usa 'spawn' porque el servidor de Streamlit es multihilo y fork no es seguro.
+    Los trabajos de export corren en varios hilos: el cerrojo evita crear dos pools.
+    """
+    global _export_pool
+    if _export_pool is None:
+        with _export_pool_lock:
+            if _export_pool is None:
+                workers = min(4, os.cpu_count() or 1)
+                _export_pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'))
+    return _export_pool
+
+
+class FicheroExport:
+    """Fichero de export ya generado, en un temporal: en memoria hasta EN_MEMORIA_MAX bytes y en disco a partir de ahí.
+
+    Los escritores vuelcan en él bloque a bloque, así que generar un export
+    grande no lo retiene entero en memoria. Quien lo sirve lo lee por bloques
+    (bloques) o entero (leer); download_button de Streamlit solo acepta el
+    fichero completo, así que la aplicación lo lee cuando se pulsa descargar.
+    """
+    EN_MEMORIA_MAX = 8 * 1024 * 1024
+    BLOQUE_LECTURA = 1024 * 1024
+
+    def __init__(self):
+        self.archivo = tempfile.SpooledTemporaryFile(max_size=self.EN_MEMORIA_MAX)
+        # Varias sesiones pueden descargar el mismo resultado a la vez: cada lectura fija su posición
+        self._lock = threading.Lock()
+
+    def escribir(self, data: bytes) -> None:
+        self.archivo.write(data)
+
+    def escribir_partes(self, partes: Iterator[bytes]) -> 'FicheroExport':
+        for parte in partes:
+            self.archivo.write(parte)
+        return self
+
+    @property
+    def tamano(self) -> int:
+        with self._lock:
+            return self.archivo.seek(0, os.SEEK_END)
+
+    @property
+    def en_memoria(self) -> int:
+        """Bytes que ocupa en memoria: 0 una vez pasado a disco"""
+        tamano = self.tamano
+        return tamano if tamano <= self.EN_MEMORIA_MAX else 0
+
+    def bloques(self) -> Iterator[bytes]:
+        posicion = 0
+        while True:
+            with self._lock:
+                self.archivo.seek(posicion)
+                data = self.archivo.read(self.BLOQUE_LECTURA)
+            if not data:
+                return
+            posicion += len(data)
+            yield data
+
+    def leer(self) -> bytes:
+        return b"".join(self.bloques())
+
+
+def frame_to_fichero(df: pd.DataFrame, formato: str, number_formats: Optional[Dict[str, str]] = None,
+                     extra_sheets: Optional[Dict[str, pd.DataFrame]] = None,
+                     progress: Optional[Callable[[int], None]] = None,
+                     chunk_size: Optional[int] = None) -> FicheroExport:
+    """Fichero completo en un temporal: 'xlsx' (streaming) o cualquiera de STREAM_FORMATS.
+
+    progress(n) recibe las filas escritas tras cada bloque; extra_sheets solo se incluyen en xlsx.
+    """
+    fichero = FicheroExport()
+    if formato == 'xlsx':
+        writer = StreamingXlsxWriter(number_formats, chunk_size or StreamingXlsxWriter.CHUNK_SIZE, progress)
+        writer.write_sheets({'incidencias': df, **(extra_sheets or {})}, fichero.archivo)
+        return fichero
+    chunk_size, hechas = chunk_size or STREAM_CHUNK_SIZE, 0
+    for parte in iter_stream_format(df, formato, chunk_size):
+        fichero.escribir(parte)
+        n = min(chunk_size, len(df) - hechas)  # 0 en el bloque final del Parquet (pie del fichero)
+        hechas += n
+        if progress is not None:
+            progress(n)
+    return fichero
+
+
+def frame_to_bytes(df: pd.DataFrame, formato: str, number_formats: Optional[Dict[str, str]] = None,
+                   extra_sheets: Optional[Dict[str, pd.DataFrame]] = None) -> bytes:
+    """Fichero completo en memoria: 'xlsx' (streaming) o cualquiera de STREAM_FORMATS.
+
+    extra_sheets (p.ej. resúmenes) solo se incluyen en xlsx, detrás de la hoja de datos.
+    """
+    if formato == 'xlsx':
+        return StreamingXlsxWriter(number_formats).sheets_to_bytes({'incidencias': df, **(extra_sheets or {})})
+    return b"".join(iter_stream_format(df, formato))
+
+
+def _partition_file(nombre: str, df: pd.DataFrame, formato: str,
+                    number_formats: Optional[Dict[str, str]]) -> Tuple[str, bytes]:
+    # Se ejecuta en un proceso del pool
+    return nombre, frame_to_bytes(df, formato, number_formats)
+
+
+def _partition_filename(key: str, valor, formato: str, usados: set) -> str:
+    """Nombre del fichero de la partición, único en el zip: valores distintos que quedan iguales
+    al limpiarlos ('A/B', 'A B', 'A_B') llevan un sufijo numérico"""
+    etiqueta = 'sin_valor' if pd.isna(valor) or str(valor).strip() == '' else str(valor).strip()
+    etiqueta = re.sub(r'[^\w.-]+', '_', etiqueta)
+    nombre, n = f"{key}_{etiqueta}.{formato}", 1
+    while nombre in usados:
+        n += 1
+        nombre = f"{key}_{etiqueta}_{n}.{formato}"
+    usados.add(nombre)
+    return nombre
+
+
+def iter_partitioned_zip(df: pd.DataFrame, key: str, formato: str = 'xlsx',
+                         number_formats: Optional[Dict[str, str]] = None,
+                         pool: Optional[ProcessPoolExecutor] = None,
+                         max_in_flight: int = 4,
+                         progress: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    """Parte df por key, genera cada fichero en el pool y emite el zip por bloques.
+
+    Como mucho max_in_flight particiones están a la vez pendientes o en memoria;
+    cada fichero terminado se añade al zip y se libera. progress(1) se llama
+    al añadir cada partición.
+    """
+    if key not in PARTITION_KEYS:
+        raise ValueError(f"Clave de partición desconocida: '{key}'. Disponibles: {', '.join(PARTITION_KEYS)}")
+    pool = pool or get_export_pool()
+    particiones = iter(df.groupby(key, dropna=False, sort=True))
+    usados: set = set()
+
+    sink = _ChunkSink()
+    # Los ficheros ya van comprimidos (xlsx, parquet) o son pequeños: sin recomprimir
+    compresion = zipfile.ZIP_STORED if formato in ('xlsx', 'parquet') else zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(sink, 'w', compression=compresion) as zf:
+        pendientes = set()
+        agotadas = False
+        while pendientes or not agotadas:
+            while not agotadas and len(pendientes) < max_in_flight:
+                try:
+                    valor, parte = next(particiones)
+                except StopIteration:
+                    agotadas = True
+                    break
+                nombre = _partition_filename(key, valor, formato, usados)
+                pendientes.add(pool.submit(_partition_file, nombre, parte.reset_index(drop=True), formato, number_formats))
+            if not pendientes:
+                break
+            hechas, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in hechas:
+                nombre, data = futuro.result()
+                zf.writestr(nombre, data)
+                if progress is not None:
+                    progress(1)
+                yield sink.drain()
+    yield sink.drain()
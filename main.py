@@ -1,6 +1,230 @@
-def main():
-    print("Hello from aplicacion-incidencias!")
+"""Procesamiento por lotes de incidencias, sin navegador.
+
+Lee uno o varios ficheros de incidencias (csv, xlsx, parquet o jsonl; un
+directorio se expande a todos los que contenga, p. ej. data/envios/),
+enriquece cada fila con el maestro de trabajadores, valida, costea con el
+mismo motor que el export de la aplicación y escribe el export en el formato
+elegido. El trabajo se reparte en bloques entre procesos:
+
+    python main.py data/envios/ --formato parquet --salida exports/nomina_marzo.parquet
+
+Las filas descartadas (trabajador desconocido, fecha no válida, campos obligatorios vacíos)
+se escriben junto a la salida como <salida>.errores.csv.
+"""
+import argparse
+import multiprocessing as mp
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from streamlit import logger as st_logger
+
+st_logger.set_log_level('error')  # Sin runtime de Streamlit: silenciar avisos de "bare mode"
+
+from app_optimized import CAMPOS_ENTRADA, OptimizedDataManager, OptimizedExportManager, procesar_lote
+from costes import cost_totals
+from export_writers import DEFAULT_EXCEL_WRITER, STREAM_FORMATS, apply_export_dtypes, get_excel_writer, iter_stream_format
+
+EXTENSIONES_ENTRADA = ('.csv', '.xlsx', '.parquet', '.jsonl')
+FORMATOS_SALIDA = ['xlsx', *STREAM_FORMATS]
+TAMANO_BLOQUE = 20_000
+
+# Maestros cargados una vez por proceso trabajador (ver _iniciar_trabajador)
+_data_manager: Optional[OptimizedDataManager] = None
+
+
+# =============================================================================
+# LECTURA
+# =============================================================================
+
+def ficheros_entrada(rutas: List[Path]) -> List[Path]:
+    """Ficheros a procesar; los directorios se expanden a sus ficheros de incidencias, en orden"""
+    ficheros = []
+    for ruta in rutas:
+        if ruta.is_dir():
+            ficheros.extend(sorted(p for p in ruta.iterdir() if p.suffix in EXTENSIONES_ENTRADA))
+        else:
+            ficheros.append(ruta)
+    return ficheros
+
+
+def leer_incidencias(path: Path) -> pd.DataFrame:
+    """Columnas de entrada (CAMPOS_ENTRADA) de un fichero; las que falten quedan vacías"""
+    if path.suffix == '.csv':
+        df = pd.read_csv(path, dtype=object)
+    elif path.suffix == '.xlsx':
+        df = pd.read_excel(path, sheet_name=0, engine='openpyxl', dtype=object)
+    elif path.suffix == '.parquet':
+        df = pd.read_parquet(path)
+    elif path.suffix == '.jsonl':
+        df = pd.read_json(path, lines=True, dtype=False)
+    else:
+        raise ValueError(f"Formato de entrada desconocido: '{path.suffix}'. Disponibles: {', '.join(EXTENSIONES_ENTRADA)}")
+    return df.reindex(columns=CAMPOS_ENTRADA)
+
+
+def iter_bloques(ficheros: List[Path], tamano: int) -> Iterator[Tuple[Path, int, pd.DataFrame]]:
+    """(fichero, fila inicial, bloque) de cada fichero, en orden"""
+    for path in ficheros:
+        df = leer_incidencias(path)
+        for inicio in range(0, len(df), tamano):
+            yield path, inicio, df.iloc[inicio:inicio + tamano]
+
+# =============================================================================
+# PROCESOS TRABAJADORES
+# =============================================================================
+
+def _iniciar_trabajador() -> None:
+    global _data_manager
+    st_logger.set_log_level('error')
+    _data_manager = OptimizedDataManager()
+    _data_manager._ensure_cache_built()
+
+
+def procesar_bloque(bloque: pd.DataFrame) -> Tuple[Optional[pd.DataFrame], List[Dict], Dict[str, float]]:
+    """Enriquece, valida y costea un bloque (se ejecuta en un proceso trabajador)"""
+    registros = bloque.astype(object).where(bloque.notna(), None).to_dict('records')
+    df, costes, errores = procesar_lote(registros, _data_manager)
+    return df, errores, cost_totals(costes) if df is not None else {}
+
+# =============================================================================
+# SALIDA
+# =============================================================================
+
+def marcar_duplicadas(df: pd.DataFrame) -> None:
+    """Marca las filas repetidas en toda la ejecución con la clave de IndiceDuplicados.
+
+    Cada proceso solo ve su bloque, así que la marca se recalcula sobre el
+    resultado completo: mismo trabajador, día, motivo y centro destino.
+    """
+    clave = pd.DataFrame({
+        'trabajador': df['nombre_empleado'].str.strip().str.upper(),
+        'fecha': df['fecha'].dt.normalize(),
+        'motivo': df['motivo'],
+        'destino': df['codigo_crown_destino'],
+    })
+    completa = clave.notna().all(axis=1)
+    df['duplicada'] = (completa & clave.duplicated(keep=False)).astype('boolean')
+
+
+def escribir_export(df: pd.DataFrame, formato: str, path: Path) -> None:
+    if formato == 'xlsx':
+        # El libro write-only se guarda directamente en el fichero de salida
+        get_excel_writer(DEFAULT_EXCEL_WRITER, OptimizedExportManager.NUMBER_FORMATS).write_sheets(
+            {'incidencias': df, **OptimizedExportManager.build_summaries(df)}, path
+        )
+        return
+    with open(path, 'wb') as f:
+        for parte in iter_stream_format(df, formato):
+            f.write(parte)
+
+
+def _ruta_errores(salida: Path) -> Path:
+    return salida.with_name(salida.name + '.errores.csv')
+
+
+def _progreso(filas: int, total: int, validas: int, inicio: float) -> None:
+    segundos = time.perf_counter() - inicio
+    ritmo = filas / segundos if segundos > 0 else 0.0
+    # En terminal se reescribe la misma línea; en el log de cron, una línea por bloque
+    fin = '' if sys.stderr.isatty() else '\n'
+    inicio_linea = '\r' if sys.stderr.isatty() else ''
+    print(f"{inicio_linea}  {filas:,}/{total:,} filas ({filas / total:.0%}) · {validas:,} válidas · {ritmo:,.0f} filas/s",
+          end=fin, file=sys.stderr, flush=True)
+
+# =============================================================================
+# LÍNEA DE COMANDOS
+# =============================================================================
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Enriquece, valida y costea incidencias y escribe el export de nómina")
+    parser.add_argument('entradas', type=Path, nargs='+', help="Ficheros de incidencias o directorios (p. ej. data/envios/)")
+    parser.add_argument('--salida', type=Path, required=True, help="Fichero de export a escribir")
+    parser.add_argument('--formato', choices=FORMATOS_SALIDA, default=None,
+                        help="Formato del export (por defecto, según la extensión de --salida)")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos trabajadores (por defecto, nº de CPUs)")
+    parser.add_argument('--tamano-bloque', type=int, default=TAMANO_BLOQUE, help="Filas por bloque de trabajo")
+    args = parser.parse_args(argv)
+
+    formato = args.formato or args.salida.suffix.lstrip('.')
+    if formato not in FORMATOS_SALIDA:
+        parser.error(f"formato de salida desconocido: '{formato}'. Disponibles: {', '.join(FORMATOS_SALIDA)}")
+
+    ficheros = ficheros_entrada(args.entradas)
+    if not ficheros:
+        print("No hay ficheros de incidencias que procesar", file=sys.stderr)
+        return 1
+    invalidos = [p for p in ficheros if not p.is_file() or p.suffix not in EXTENSIONES_ENTRADA]
+    if invalidos:
+        print(f"❌ No existen o no son ficheros de incidencias ({', '.join(EXTENSIONES_ENTRADA)}): "
+              f"{', '.join(map(str, invalidos))}", file=sys.stderr)
+        return 1
+
+    inicio = time.perf_counter()
+    # El total se conoce tras leer todo; leer primero permite informar el porcentaje
+    bloques = list(iter_bloques(ficheros, args.tamano_bloque))
+    total = sum(len(bloque) for _, _, bloque in bloques)
+    print(f"Leídos {len(ficheros)} ficheros, {total:,} filas en {len(bloques)} bloques "
+          f"({time.perf_counter() - inicio:.1f}s)", file=sys.stderr)
+    if total == 0:
+        print("Los ficheros no contienen incidencias", file=sys.stderr)
+        return 1
+
+    frames: List[pd.DataFrame] = []
+    errores: List[Dict] = []
+    metricas: Dict[str, float] = {}
+    filas = validas = 0
+    inicio_proceso = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.procesos, mp_context=mp.get_context('spawn'),
+                             initializer=_iniciar_trabajador) as pool:
+        # Los resultados se recogen en orden de envío: el export conserva el orden de la entrada
+        pendientes: Deque[Tuple[Path, int, int, Future]] = deque(
+            (path, fila_inicial, len(bloque), pool.submit(procesar_bloque, bloque))
+            for path, fila_inicial, bloque in bloques
+        )
+        while pendientes:
+            path, fila_inicial, n, futuro = pendientes.popleft()
+            df, errores_bloque, totales = futuro.result()
+            if df is not None:
+                frames.append(df)
+                validas += len(df)
+            for clave, valor in totales.items():
+                metricas[clave] = metricas.get(clave, 0.0) + valor
+            errores.extend(
+                {'fichero': path.name, 'fila': fila_inicial + error['fila'], 'error': error['error']}
+                for error in errores_bloque
+            )
+            filas += n
+            _progreso(filas, total, validas, inicio_proceso)
+    if sys.stderr.isatty():
+        print(file=sys.stderr)
+
+    args.salida.parent.mkdir(parents=True, exist_ok=True)
+    # Sin errores no debe quedar el fichero de una ejecución anterior
+    _ruta_errores(args.salida).unlink(missing_ok=True)
+    if errores:
+        pd.DataFrame(errores).to_csv(_ruta_errores(args.salida), index=False)
+        print(f"⚠️ {len(errores):,} filas descartadas → {_ruta_errores(args.salida)}", file=sys.stderr)
+    if not frames:
+        print("❌ Ninguna incidencia válida: no se escribe el export", file=sys.stderr)
+        return 1
+
+    df = pd.concat(frames, ignore_index=True)
+    apply_export_dtypes(df)
+    marcar_duplicadas(df)
+    escribir_export(df, formato, args.salida)
+
+    segundos = time.perf_counter() - inicio
+    print(f"✅ {args.salida}: {len(df):,} filas · {int(df['duplicada'].sum()):,} duplicadas · "
+          f"coste total {metricas['total_con_ss']:,.2f} €", file=sys.stderr)
+    print(f"Tiempo total: {segundos:.1f}s ({total / segundos:,.0f} filas/s)", file=sys.stderr)
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import itertools
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# MEDIDA DE TAMAÑOS
+# =============================================================================
+
+def tamano_bytes(valor, muestra: Optional[int] = None, _vistos: Optional[set] = None) -> int:
+    """Bytes que ocupa un valor con lo que contiene (DataFrames en profundidad, contenedores recorridos).
+
+    Con muestra, los contenedores de más de muestra elementos se estiman
+    midiendo muestra elementos repartidos y extrapolando: el coste queda
+    acotado aunque la sesión tenga decenas de miles de incidencias.
+    """
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(index=True, deep=True).sum())
+    if isinstance(valor, (pd.Series, pd.Index)):
+        return int(valor.memory_usage(deep=True))
+    if isinstance(valor, np.ndarray):
+        return int(valor.nbytes)
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        return len(valor)
+    _vistos = set() if _vistos is None else _vistos
+    if id(valor) in _vistos:
+        return 0
+    _vistos.add(id(valor))
+    tamano = sys.getsizeof(valor)
+    if isinstance(valor, dict):
+        elementos = valor.items()
+    elif isinstance(valor, (list, tuple, set, frozenset)):
+        elementos = ((e,) for e in valor)
+    elif hasattr(valor, '__dict__'):
+        return tamano + tamano_bytes(vars(valor), muestra, _vistos)
+    else:
+        return tamano
+    n = len(valor)
+    if muestra is not None and n > muestra:
+        paso = n // muestra
+        elementos = itertools.islice(elementos, 0, paso * muestra, paso)
+    medidos = sum(tamano_bytes(parte, muestra, _vistos) for elemento in elementos for parte in elemento)
+    return tamano + (medidos * n // muestra if muestra is not None and n > muestra else medidos)
+
+# =============================================================================
+# PRESUPUESTO GLOBAL CON EXPULSIÓN LRU
+# =============================================================================
+
+class PresupuestoMemoria:
+    """Contabilidad de memoria por sesión y expulsión LRU de datos derivados.
+
+    Los propietarios (la caché derivada de cada sesión, el gestor de exports)
+    registran cada dato reconstruible con su tamaño. Cuando la suma supera el
+    límite se expulsan los menos usados de cualquier sesión llamando a
+    propietario._expulsar(nombre); el propietario lo reconstruye cuando se
+    vuelva a pedir. Los propietarios se referencian débilmente: al terminar
+    una sesión sus entradas desaparecen de la cuenta.
+    """
+
+    def __init__(self, limite_bytes: int):
+        self.limite_bytes = limite_bytes
+        self._lock = threading.RLock()
+        self._refs: Dict[int, weakref.ref] = {}
+        self._lru: 'OrderedDict[Tuple[int, Hashable], Tuple[str, int]]' = OrderedDict()
+        self._estado: Dict[int, Tuple[str, int]] = {}  # Estado base (no expulsable) por propietario
+        self._muertos: List[int] = []
+        self._total = 0
+        self.expulsiones = 0
+
+    @property
+    def total_derivados(self) -> int:
+        return self._total
+
+    def _ref(self, propietario) -> int:
+        clave = id(propietario)
+        if clave not in self._refs:
+            # El callback puede llegar en mitad de otra operación (lo dispara el GC): solo se anota
+            self._refs[clave] = weakref.ref(propietario, lambda _, clave=clave: self._muertos.append(clave))
+        return clave
+
+    def _purgar(self) -> None:
+        """Quita las entradas de los propietarios que ya no existen (sesiones terminadas)"""
+        while self._muertos:
+            clave = self._muertos.pop()
+            self._refs.pop(clave, None)
+            self._estado.pop(clave, None)
+            for entrada in [e for e in self._lru if e[0] == clave]:
+                self._total -= self._lru.pop(entrada)[1]
+
+    def registrar(self, propietario, sesion: str, nombre: Hashable, tamano: int) -> None:
+        """Alta o sustitución de un dato derivado; puede expulsar otros para respetar el límite"""
+        with self._lock:
+            self._purgar()
+            entrada = (self._ref(propietario), nombre)
+            if entrada in self._lru:
+                self._total -= self._lru.pop(entrada)[1]
+            self._lru[entrada] = (sesion, tamano)
+            self._total += tamano
+            self._expulsar_excedente(proteger=entrada)
+
+    def tocar(self, propietario, nombre: Hashable) -> None:
+        with self._lock:
+            self._purgar()
+            entrada = (id(propietario), nombre)
+            if entrada in self._lru:
+                self._lru.move_to_end(entrada)
+
+    def quitar(self, propietario, nombre: Hashable) -> None:
+        with self._lock:
+            self._purgar()
+            datos = self._lru.pop((id(propietario), nombre), None)
+            if datos is not None:
+                self._total -= datos[1]
+
+    def informar_estado(self, propietario, sesion: str, tamano: int) -> None:
+        """Bytes del estado base de la sesión (incidencias, registros...): cuenta, pero no se expulsa"""
+        with self._lock:
+            self._purgar()
+            self._estado[self._ref(propietario)] = (sesion, tamano)
+
+    def _expulsar_excedente(self, proteger: Tuple) -> None:
+        for entrada in list(self._lru):
+            if self._total <= self.limite_bytes:
+                break
+            if entrada == proteger:
+                continue
+            _, tamano = self._lru.pop(entrada)
+            self._total -= tamano
+            self.expulsiones += 1
+            propietario = self._refs[entrada[0]]()
+            if propietario is not None:
+                propietario._expulsar(entrada[1])
+
+    def informe(self) -> pd.DataFrame:
+        """Bytes por sesión: estado base, datos derivados y número de entradas derivadas"""
+        with self._lock:
+            self._purgar()
+            filas: Dict[str, Dict] = {}
+            for (_, nombre), (sesion, tamano) in self._lru.items():
+                fila = filas.setdefault(sesion, {'sesion': sesion, 'estado': 0, 'derivados': 0, 'entradas': 0})
+                fila['derivados'] += tamano
+                fila['entradas'] += 1
+            for sesion, tamano in self._estado.values():
+                filas.setdefault(sesion, {'sesion': sesion, 'estado': 0, 'derivados': 0, 'entradas': 0})['estado'] += tamano
+        informe = pd.DataFrame(list(filas.values()), columns=['sesion', 'estado', 'derivados', 'entradas'])
+        informe['total'] = informe['estado'] + informe['derivados']
+        return informe.sort_values('total', ascending=False, ignore_index=True)
+
+
+class CacheDerivada:
+    """Datos derivados de una sesión (frames de página, export...), reconstruibles bajo demanda.
+
+    obtener() devuelve el dato de la versión pedida si sigue en memoria y si
+    no lo construye y lo registra en el presupuesto, que puede expulsarlo
+    más adelante.
+    """
+
+    def __init__(self, presupuesto: PresupuestoMemoria, sesion: str):
+        self.presupuesto = presupuesto
+        self.sesion = sesion
+        self._datos: Dict[Hashable, Tuple[Hashable, object]] = {}
+
+    def obtener(self, nombre: Hashable, version: Hashable, construir: Callable[[], object]):
+        actual = self._datos.get(nombre)
+        if actual is not None and actual[0] == version:
+            self.presupuesto.tocar(self, nombre)
+            return actual[1]
+        valor = construir()
+        self._datos[nombre] = (version, valor)
+        self.presupuesto.registrar(self, self.sesion, nombre, tamano_bytes(valor))
+        return valor
+
+    def descartar(self, nombre: Hashable) -> None:
+        """Invalida un dato (los de entrada han cambiado)"""
+        self._datos.pop(nombre, None)
+        self.presupuesto.quitar(self, nombre)
+
+    def _expulsar(self, nombre: Hashable) -> None:
+        self._datos.pop(nombre, None)
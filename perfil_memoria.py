@@ -0,0 +1,235 @@
+"""Perfil de memoria por etapa del flujo con tracemalloc (opcional).
+
+etapa(nombre) mide lo que asigna una etapa: la memoria asignada en ella
+que sigue viva al terminar (neto), el pico sobre la de partida y los sitios
+de código que más memoria retienen (instantáneas de tracemalloc antes y
+después, comparadas). Cada sitio se nombra por la línea del repositorio que
+lo provoca y, si la asignación ocurre dentro de una librería, por la línea
+de la librería.
+
+tracemalloc solo está activo mientras hay alguna etapa abierta: fuera de
+ellas el proceso va a la velocidad normal, dentro cada asignación cuesta
+varias veces más. Cuenta las asignaciones de todos los hilos, así que las
+medidas son fiables desde el benchmark o con el servidor con una sola
+sesión activa.
+
+Cada medida se guarda en memoria y, con jsonl, como una línea JSON.
+informe() agrega por etapa y comparar() contrasta dos informes (dos
+ejecuciones, antes y después de un cambio). Desde la línea de comandos:
+
+    python perfil_memoria.py antes.jsonl despues.jsonl
+"""
+import argparse
+import functools
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional
+
+import pandas as pd
+
+RAIZ = Path(__file__).resolve().parent
+
+_NULO = nullcontext()
+
+# Lo que no es del flujo medido: el propio tracemalloc y la maquinaria de importación
+_FILTROS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+
+def _del_repositorio(fichero: str) -> bool:
+    return fichero.startswith(str(RAIZ)) and 'site-packages' not in fichero and fichero != __file__
+
+def _sitio(traza: tracemalloc.Traceback) -> str:
+    """'fichero.py:línea' del repositorio más interno, con la línea de librería donde se asigna si es otra"""
+    interno = traza[-1]
+    propio = next((marco for marco in reversed(traza) if _del_repositorio(marco.filename)), None)
+    if propio is None:
+        return f"{Path(interno.filename).name}:{interno.lineno}"
+    sitio = f"{Path(propio.filename).relative_to(RAIZ)}:{propio.lineno}"
+    if propio != interno:
+        sitio += f" → {Path(interno.filename).name}:{interno.lineno}"
+    return sitio
+
+# =============================================================================
+# MEDIDA POR ETAPA
+# =============================================================================
+
+class PerfilMemoria:
+    """Medidas de memoria por etapa de todo el proceso"""
+    MARCOS = 10  # Profundidad de las trazas: suele alcanzar el código del repositorio; cada marco más encarece cada asignación
+    MAX_SITIOS = 10
+
+    def __init__(self, activo: bool = True, max_medidas: int = 200, jsonl: Optional[str] = None):
+        self.activo = activo
+        self.jsonl = Path(jsonl) if jsonl else None
+        self._medidas: Deque[Dict] = deque(maxlen=max_medidas)
+        self._lock = threading.Lock()
+        self._pila: List['_ContextoEtapa'] = []  # Etapas abiertas: el pico de una interna cuenta en la externa
+        self._arrancado = False  # tracemalloc lo arrancó la primera etapa abierta (no -X tracemalloc)
+
+    def etapa(self, nombre: str):
+        if not self.activo:
+            return _NULO
+        return _ContextoEtapa(self, nombre)
+
+    def medido(self, nombre: Optional[str] = None) -> Callable:
+        """Decorador: cada llamada es una etapa (por defecto con el nombre de la función)"""
+        def decorador(fn: Callable) -> Callable:
+            if not self.activo:
+                return fn
+            etiqueta = nombre or fn.__name__
+
+            @functools.wraps(fn)
+            def envoltura(*args, **kwargs):
+                with self.etapa(etiqueta):
+                    return fn(*args, **kwargs)
+            return envoltura
+        return decorador
+
+    def _sitios(self, antes: tracemalloc.Snapshot, despues: tracemalloc.Snapshot) -> List[Dict]:
+        """Sitios que más memoria retienen entre las dos instantáneas"""
+        sitios: Dict[str, List[int]] = {}
+        diferencias = despues.filter_traces(_FILTROS).compare_to(antes.filter_traces(_FILTROS), 'traceback')
+        for diferencia in diferencias:
+            if diferencia.size_diff <= 0:
+                continue
+            acumulado = sitios.setdefault(_sitio(diferencia.traceback), [0, 0])
+            acumulado[0] += diferencia.size_diff
+            acumulado[1] += diferencia.count_diff
+        mayores = sorted(sitios.items(), key=lambda s: s[1][0], reverse=True)[:self.MAX_SITIOS]
+        return [{'sitio': sitio, 'kb': round(bytes_ / 1024, 1), 'bloques': bloques} for sitio, (bytes_, bloques) in mayores]
+
+    def _anotar(self, medida: Dict) -> None:
+        with self._lock:
+            self._medidas.append(medida)
+            if self.jsonl is not None:
+                self.jsonl.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.jsonl, 'a', encoding='utf-8') as destino:
+                    destino.write(json.dumps(medida, ensure_ascii=False) + '\n')
+
+    def medidas(self) -> List[Dict]:
+        with self._lock:
+            return list(self._medidas)
+
+    def tabla(self, n: Optional[int] = None) -> pd.DataFrame:
+        """Últimas medidas, la más reciente primero"""
+        filas = [{k: v for k, v in m.items() if k != 'sitios'} for m in self.medidas()[::-1][:n]]
+        return pd.DataFrame(filas, columns=['etapa', 'hora', 'segundos', 'neto_mb', 'pico_mb'])
+
+    def informe(self) -> Dict[str, Dict]:
+        return informe(self.medidas())
+
+
+class _ContextoEtapa:
+    def __init__(self, perfil: PerfilMemoria, nombre: str):
+        self.perfil = perfil
+        self.nombre = nombre
+
+    def __enter__(self) -> None:
+        with self.perfil._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.perfil.MARCOS)
+                self.perfil._arrancado = True
+        self.antes = tracemalloc.take_snapshot()
+        with self.perfil._lock:
+            self.base, pico = tracemalloc.get_traced_memory()
+            if self.perfil._pila:
+                externa = self.perfil._pila[-1]
+                externa.pico = max(externa.pico, pico)
+            tracemalloc.reset_peak()
+            self.pico = self.base
+            self.perfil._pila.append(self)
+        self.inicio = time.perf_counter()
+
+    def __exit__(self, tipo, valor, tb) -> None:
+        segundos = time.perf_counter() - self.inicio
+        with self.perfil._lock:
+            actual, pico = tracemalloc.get_traced_memory()
+            self.pico = max(self.pico, pico)
+            self.perfil._pila.remove(self)
+            if self.perfil._pila:
+                externa = self.perfil._pila[-1]
+                externa.pico = max(externa.pico, self.pico)
+        despues = tracemalloc.take_snapshot()
+        with self.perfil._lock:
+            if not self.perfil._pila and self.perfil._arrancado:
+                tracemalloc.stop()
+                self.perfil._arrancado = False
+        sitios = self.perfil._sitios(self.antes, despues)
+        self.antes = None
+        self.perfil._anotar({
+            'etapa': self.nombre,
+            'hora': datetime.now().isoformat(timespec='seconds'),
+            'segundos': round(segundos, 3),
+            'neto_mb': round((actual - self.base) / 2**20, 3),
+            'pico_mb': round((self.pico - self.base) / 2**20, 3),
+            'sitios': sitios,
+        })
+
+# =============================================================================
+# INFORMES Y COMPARACIÓN ENTRE EJECUCIONES
+# =============================================================================
+
+def informe(medidas: List[Dict]) -> Dict[str, Dict]:
+    """Por etapa: medidas, mayor pico y mayor neto, y los sitios de la medida de mayor pico"""
+    etapas: Dict[str, Dict] = {}
+    for medida in medidas:
+        etapa = etapas.setdefault(medida['etapa'], {'n': 0, 'pico_mb': -1.0, 'neto_mb': medida['neto_mb'], 'sitios': []})
+        etapa['n'] += 1
+        etapa['neto_mb'] = max(etapa['neto_mb'], medida['neto_mb'])
+        if medida['pico_mb'] > etapa['pico_mb']:
+            etapa['pico_mb'], etapa['sitios'] = medida['pico_mb'], medida['sitios']
+    return etapas
+
+def comparar(anterior: Dict[str, Dict], actual: Dict[str, Dict]) -> pd.DataFrame:
+    """Pico y neto por etapa en las dos ejecuciones, con el ratio de picos"""
+    filas = []
+    for etapa in dict.fromkeys([*anterior, *actual]):
+        antes, ahora = anterior.get(etapa, {}), actual.get(etapa, {})
+        pico_antes, pico_ahora = antes.get('pico_mb'), ahora.get('pico_mb')
+        filas.append({
+            'etapa': etapa,
+            'pico_antes_mb': pico_antes,
+            'pico_ahora_mb': pico_ahora,
+            'ratio_pico': pico_ahora / pico_antes if pico_antes and pico_ahora is not None else None,
+            'neto_antes_mb': antes.get('neto_mb'),
+            'neto_ahora_mb': ahora.get('neto_mb'),
+        })
+    return pd.DataFrame(filas)
+
+def leer_jsonl(path: Path) -> List[Dict]:
+    with open(path, encoding='utf-8') as origen:
+        return [json.loads(linea) for linea in origen if linea.strip()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compara el perfil de memoria por etapa de dos ejecuciones")
+    parser.add_argument('antes', type=Path, help="Medidas JSON Lines de la ejecución de referencia")
+    parser.add_argument('despues', type=Path, help="Medidas JSON Lines de la ejecución nueva")
+    parser.add_argument('--sitios', type=int, default=5, help="Sitios que listar por etapa de la ejecución nueva")
+    args = parser.parse_args()
+
+    anterior, actual = informe(leer_jsonl(args.antes)), informe(leer_jsonl(args.despues))
+    with pd.option_context('display.width', 200, 'display.float_format', '{:,.2f}'.format):
+        print(comparar(anterior, actual).to_string(index=False))
+    for etapa, datos in actual.items():
+        print(f"\n{etapa} (pico {datos['pico_mb']:,.1f} MB):")
+        for sitio in datos['sitios'][:args.sitios]:
+            print(f"  {sitio['kb'] / 1024:>9,.2f} MB {sitio['bloques']:>9,} bloques  {sitio['sitio']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
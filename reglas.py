@@ -0,0 +1,180 @@
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# REGLAS DE JORNADA POR TRABAJADOR Y DÍA
+# =============================================================================
+
+@dataclass(frozen=True)
+class ReglasJornada:
+    # Horas de incidencia por día para un contrato al 100 %; se escala por porcen_contrato
+    horas_max_dia: float = 12.0
+    # Horas nocturnas posibles en un día (franja 22:00-06:00)
+    horas_nocturnas_max_dia: float = 8.0
+
+
+DEFAULT_REGLAS = ReglasJornada()
+
+EXCESO_HORAS = 'exceso_horas'
+EXCESO_NOCTURNIDAD = 'exceso_nocturnidad'
+NOCTURNIDAD_NO_PERMITIDA = 'nocturnidad_no_permitida'
+REGLAS = [EXCESO_HORAS, EXCESO_NOCTURNIDAD, NOCTURNIDAD_NO_PERMITIDA]
+
+DESCRIPCION_REGLAS = {
+    EXCESO_HORAS: "horas del día por encima de la jornada",
+    EXCESO_NOCTURNIDAD: "nocturnidad del día por encima de la franja nocturna",
+    NOCTURNIDAD_NO_PERMITIDA: "nocturnidad sin tarifa para su categoría y convenio",
+}
+
+# Columnas que necesita evaluar_reglas
+INPUT_COLUMNS = ['trabajador', 'fecha', 'incidencia_horas', 'nocturnidad_horas', 'porcen_contrato', 'nocturnidad_permitida']
+
+
+def _tope_horas(porcen_contrato, reglas: ReglasJornada):
+    """Tope diario de horas; sin porcentaje conocido se asume jornada completa"""
+    porcen = pd.to_numeric(porcen_contrato, errors='coerce')
+    return reglas.horas_max_dia * np.where(np.isnan(porcen) | (porcen <= 0), 100.0, porcen) / 100.0
+
+
+def _tope_horas_fila(porcen_contrato, reglas: ReglasJornada) -> float:
+    porcen = _num(porcen_contrato)
+    return reglas.horas_max_dia * (porcen if porcen > 0 else 100.0) / 100.0
+
+
+def evaluar_reglas(df: pd.DataFrame, reglas: ReglasJornada = DEFAULT_REGLAS) -> pd.DataFrame:
+    """Máscara booleana por fila y regla sobre todo el conjunto de incidencias.
+
+    Suma horas y nocturnidad por (trabajador, fecha) con un groupby vectorizado;
+    una fila incumple una regla de día si su grupo la incumple. Las filas sin
+    trabajador o fecha no se evalúan.
+    """
+    horas = pd.to_numeric(df['incidencia_horas'], errors='coerce').fillna(0.0)
+    nocturnas = pd.to_numeric(df['nocturnidad_horas'], errors='coerce').fillna(0.0)
+    claves = [df['trabajador'], df['fecha']]
+    suma_horas = horas.groupby(claves, sort=False, dropna=False).transform('sum')
+    suma_nocturnas = nocturnas.groupby(claves, sort=False, dropna=False).transform('sum')
+    evaluable = df['trabajador'].notna() & (df['trabajador'] != "") & df['fecha'].notna()
+
+    return pd.DataFrame({
+        EXCESO_HORAS: evaluable & (suma_horas > _tope_horas(df['porcen_contrato'], reglas)),
+        EXCESO_NOCTURNIDAD: evaluable & (suma_nocturnas > reglas.horas_nocturnas_max_dia),
+        NOCTURNIDAD_NO_PERMITIDA: (nocturnas > 0) & ~df['nocturnidad_permitida'].fillna(False).astype(bool),
+    }, index=df.index)
+
+
+class MotorReglas:
+    """Reglas de jornada mantenidas por grupo (trabajador, fecha).
+
+    cargar() evalúa el conjunto entero con evaluar_reglas(); después cada
+    alta, modificación o baja solo vuelve a comprobar los grupos que toca
+    (el anterior y el nuevo de la fila), no todo el mes.
+    """
+
+    def __init__(self, reglas: ReglasJornada = DEFAULT_REGLAS):
+        self.reglas = reglas
+        self._filas: Dict[Hashable, Dict] = {}
+        self._grupos: Dict[Tuple, set] = {}
+        self._infracciones: Dict[Hashable, Tuple[str, ...]] = {}
+
+    @staticmethod
+    def _grupo(registro: Dict) -> Optional[Tuple]:
+        if not registro['trabajador'] or registro['fecha'] is None or pd.isna(registro['fecha']):
+            return None
+        return (registro['trabajador'], pd.Timestamp(registro['fecha']).normalize())
+
+    def cargar(self, registros: Dict[Hashable, Dict]) -> None:
+        """Carga masiva (id -> registro con INPUT_COLUMNS) con una sola evaluación vectorizada"""
+        self._filas, self._grupos, self._infracciones = {}, {}, {}
+        if not registros:
+            return
+        df = pd.DataFrame.from_dict(registros, orient='index', columns=INPUT_COLUMNS)
+        df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce').dt.normalize()
+        mascara = evaluar_reglas(df, self.reglas)
+        for id_fila, registro in registros.items():
+            self._filas[id_fila] = registro
+            grupo = self._grupo(registro)
+            if grupo is not None:
+                self._grupos.setdefault(grupo, set()).add(id_fila)
+        for id_fila, fila in zip(mascara.index, mascara.to_numpy()):
+            if fila.any():
+                self._infracciones[id_fila] = tuple(regla for regla, incumple in zip(REGLAS, fila) if incumple)
+
+    def actualizar(self, id_fila: Hashable, registro: Dict) -> None:
+        """Alta o modificación de una fila: recomprueba su grupo anterior y el nuevo"""
+        anterior = self._filas.get(id_fila)
+        grupo_anterior = self._grupo(anterior) if anterior is not None else None
+        if grupo_anterior is not None:
+            self._grupos[grupo_anterior].discard(id_fila)
+        self._filas[id_fila] = registro
+        grupo = self._grupo(registro)
+        if grupo is not None:
+            self._grupos.setdefault(grupo, set()).add(id_fila)
+        self._recomprobar({grupo_anterior, grupo}, id_fila)
+
+    def quitar(self, id_fila: Hashable) -> None:
+        anterior = self._filas.pop(id_fila, None)
+        self._infracciones.pop(id_fila, None)
+        if anterior is None:
+            return
+        grupo = self._grupo(anterior)
+        if grupo is not None:
+            self._grupos[grupo].discard(id_fila)
+            self._recomprobar({grupo}, None)
+
+    def _recomprobar(self, grupos, id_fila: Optional[Hashable]) -> None:
+        reglas = self.reglas
+        if id_fila is not None:
+            self._infracciones.pop(id_fila, None)
+        for grupo in grupos:
+            if grupo is None:
+                continue
+            ids = self._grupos.get(grupo)
+            if not ids:
+                self._grupos.pop(grupo, None)
+                continue
+            filas = [self._filas[i] for i in ids]
+            suma_horas = sum(_num(f['incidencia_horas']) for f in filas)
+            suma_nocturnas = sum(_num(f['nocturnidad_horas']) for f in filas)
+            for i, fila in zip(ids, filas):
+                infracciones = []
+                if suma_horas > _tope_horas_fila(fila['porcen_contrato'], reglas):
+                    infracciones.append(EXCESO_HORAS)
+                if suma_nocturnas > reglas.horas_nocturnas_max_dia:
+                    infracciones.append(EXCESO_NOCTURNIDAD)
+                if _num(fila['nocturnidad_horas']) > 0 and not fila['nocturnidad_permitida']:
+                    infracciones.append(NOCTURNIDAD_NO_PERMITIDA)
+                if infracciones:
+                    self._infracciones[i] = tuple(infracciones)
+                else:
+                    self._infracciones.pop(i, None)
+        # Una fila sin grupo (sin trabajador o fecha) solo puede incumplir la regla de nocturnidad
+        if id_fila is not None and id_fila in self._filas and self._grupo(self._filas[id_fila]) is None:
+            fila = self._filas[id_fila]
+            if _num(fila['nocturnidad_horas']) > 0 and not fila['nocturnidad_permitida']:
+                self._infracciones[id_fila] = (NOCTURNIDAD_NO_PERMITIDA,)
+
+    def infracciones(self, id_fila: Hashable) -> Tuple[str, ...]:
+        return self._infracciones.get(id_fila, ())
+
+    @property
+    def n_infracciones(self) -> int:
+        """Filas que incumplen alguna regla"""
+        return len(self._infracciones)
+
+    def mascara(self, ids: List[Hashable]) -> pd.DataFrame:
+        """Máscara booleana por fila y regla para los ids pedidos (p. ej. la página del editor)"""
+        return pd.DataFrame(
+            [[regla in self._infracciones.get(i, ()) for regla in REGLAS] for i in ids],
+            index=ids, columns=REGLAS, dtype=bool
+        )
+
+
+def _num(valor) -> float:
+    try:
+        valor = float(valor)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if np.isnan(valor) else valor
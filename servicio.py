@@ -0,0 +1,258 @@
+"""Servicio HTTP local sobre el motor de la aplicación, sin interfaz Streamlit.
+
+Carga una vez los maestros (OptimizedDataManager) y comparte esa instantánea
+en caliente entre todas las peticiones. Los endpoints de lote enriquecen y
+costean miles de filas por petición con el mismo motor que el export:
+
+    GET  /salud
+    GET  /empleados?nombre=<nombre>
+    POST /empleados/lote      {"trabajadores": [...]}
+    POST /nocturnidad/lote    {"pares": [{"categoria": ..., "cod_reg_convenio": ...}, ...]}
+    POST /costes/lote         {"incidencias": [{...}, ...]}
+    POST /export/lote?formato=csv|parquet|jsonl|xlsx   {"incidencias": [...]}
+    POST /envios              {"incidencias": [...]}   (deja el lote en data/envios/ para main.py)
+
+Arrancar con:
+
+    python servicio.py --puerto 8765
+"""
+import argparse
+import json
+import math
+import uuid
+from datetime import datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from streamlit import logger as st_logger
+
+st_logger.set_log_level('error')  # Sin runtime de Streamlit: silenciar avisos de "bare mode"
+
+from app_optimized import CAMPOS_ENTRADA, OptimizedDataManager, OptimizedExportManager, procesar_lote
+from costes import cost_totals
+from export_writers import STREAM_FORMATS, FicheroExport
+
+ENVIOS_DIR = Path('data/envios')
+
+# Datos del maestro de trabajadores que devuelve el enriquecimiento
+CAMPOS_EMPLEADO = [
+    'nombre_empleado', 'cat_empleado', 'servicio', 'centro_preferente', 'cod_crown',
+    'cod_reg_convenio', 'coste_hora', 'nombre_jefe_ope', 'porcen_contrato'
+]
+
+
+class PeticionInvalida(ValueError):
+    """Cuerpo o parámetros de la petición no válidos (400)"""
+
+
+def _json_seguro(valor):
+    """Tipos NumPy/pandas a JSON; NaN y NaT a null"""
+    if valor is None or isinstance(valor, str):
+        return valor
+    if hasattr(valor, 'isoformat'):
+        return None if valor != valor else valor.isoformat()
+    if hasattr(valor, 'item'):
+        valor = valor.item()
+    if isinstance(valor, float) and math.isnan(valor):
+        return None
+    return valor
+
+
+def _empleado(data_manager: OptimizedDataManager, nombre: str) -> Optional[Dict]:
+    nombre = str(nombre or '').upper()
+    info = data_manager.get_empleado_info(nombre) or data_manager.get_empleado_info(nombre.strip())
+    if not info:
+        return None
+    empleado = {campo: _json_seguro(info.get(campo)) for campo in CAMPOS_EMPLEADO}
+    empleado['precio_nocturnidad'] = data_manager.get_precio_nocturnidad(info.get('cat_empleado'), info.get('cod_reg_convenio'))
+    return empleado
+
+
+def _lista(cuerpo: Dict, campo: str) -> List:
+    valor = cuerpo.get(campo)
+    if not isinstance(valor, list):
+        raise PeticionInvalida(f"se esperaba una lista en '{campo}'")
+    return valor
+
+
+class ManejadorServicio(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive: el cliente reutiliza la conexión entre lotes
+    # Cabeceras y cuerpo salen en escrituras separadas: sin esto Nagle + ACK retardado suman ~40 ms
+    disable_nagle_algorithm = True
+    server: 'ServidorIncidencias'
+
+    # -- Rutas ---------------------------------------------------------------
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/salud':
+            self._responder_json({'estado': 'ok', 'cargado': self.server.cargado.isoformat(timespec='seconds')})
+        elif url.path == '/empleados':
+            nombre = parse_qs(url.query).get('nombre', [''])[0]
+            empleado = _empleado(self.server.data_manager, nombre)
+            if empleado is None:
+                self._responder_error(HTTPStatus.NOT_FOUND, f"trabajador desconocido: {nombre!r}")
+            else:
+                self._responder_json(empleado)
+        else:
+            self._responder_error(HTTPStatus.NOT_FOUND, f"ruta desconocida: {url.path}")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        rutas = {
+            '/empleados/lote': self._empleados_lote,
+            '/nocturnidad/lote': self._nocturnidad_lote,
+            '/costes/lote': self._costes_lote,
+            '/export/lote': self._export_lote,
+            '/envios': self._envios,
+        }
+        ruta = rutas.get(url.path)
+        if ruta is None:
+            self._responder_error(HTTPStatus.NOT_FOUND, f"ruta desconocida: {url.path}")
+            return
+        try:
+            ruta(self._leer_json(), parse_qs(url.query))
+        except PeticionInvalida as e:
+            self._responder_error(HTTPStatus.BAD_REQUEST, str(e))
+        except (AttributeError, TypeError, KeyError, ValueError) as e:
+            # Elementos de la lista con forma inesperada (un número donde va un objeto, un valor que no se convierte)
+            self._responder_error(HTTPStatus.BAD_REQUEST, f"elemento no válido en el lote: {e}")
+
+    def _empleados_lote(self, cuerpo: Dict, _query) -> None:
+        dm = self.server.data_manager
+        self._responder_json({'empleados': [_empleado(dm, nombre) for nombre in _lista(cuerpo, 'trabajadores')]})
+
+    def _nocturnidad_lote(self, cuerpo: Dict, _query) -> None:
+        dm = self.server.data_manager
+        pares = _lista(cuerpo, 'pares')
+        precios = dm.get_precios_nocturnidad([par.get('categoria') for par in pares],
+                                             [par.get('cod_reg_convenio') for par in pares])
+        self._responder_json({'precios': precios.tolist()})
+
+    def _costes_lote(self, cuerpo: Dict, _query) -> None:
+        df, costes, errores = procesar_lote(_lista(cuerpo, 'incidencias'), self.server.data_manager)
+        if df is None:
+            self._responder_json({'filas': [], 'errores': errores, 'metricas': {}})
+            return
+        metricas = cost_totals(costes)
+        filas = df.to_json(orient='records', date_format='iso', force_ascii=False)
+        self._responder_bytes(
+            f'{{"filas": {filas}, "errores": {json.dumps(errores)}, "metricas": {json.dumps(metricas)}}}'.encode(),
+            'application/json'
+        )
+
+    def _export_lote(self, cuerpo: Dict, query) -> None:
+        formato = query.get('formato', ['csv'])[0]
+        if formato != 'xlsx' and formato not in STREAM_FORMATS:
+            raise PeticionInvalida(f"formato no soportado: {formato!r}")
+        df, _, errores = procesar_lote(_lista(cuerpo, 'incidencias'), self.server.data_manager)
+        if df is None:
+            self._responder_json({'filas': [], 'errores': errores}, HTTPStatus.UNPROCESSABLE_ENTITY)
+            return
+        if formato == 'xlsx':
+            mime = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        else:
+            mime = STREAM_FORMATS[formato][2]
+        self._responder_fichero(OptimizedExportManager.generar_export(df, formato), mime,
+                                {'X-Filas-Descartadas': str(len(errores))})
+
+    def _envios(self, cuerpo: Dict, _query) -> None:
+        """Valida el lote y lo deja como JSON Lines para el procesamiento nocturno (main.py)"""
+        registros = _lista(cuerpo, 'incidencias')
+        _, _, errores = procesar_lote(registros, self.server.data_manager)
+        descartadas = {error['fila'] for error in errores}
+        ENVIOS_DIR.mkdir(parents=True, exist_ok=True)
+        nombre = ENVIOS_DIR / f"envio_{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}.jsonl"
+        with open(nombre, 'w', encoding='utf-8') as f:
+            for fila, registro in enumerate(registros):
+                if fila not in descartadas:
+                    f.write(json.dumps({c: registro.get(c) for c in CAMPOS_ENTRADA}, ensure_ascii=False, default=str))
+                    f.write('\n')
+        self._responder_json({'envio': nombre.name, 'aceptadas': len(registros) - len(descartadas), 'errores': errores},
+                             HTTPStatus.CREATED)
+
+    # -- E/S -----------------------------------------------------------------
+
+    def _leer_json(self) -> Dict:
+        longitud = int(self.headers.get('Content-Length') or 0)
+        try:
+            cuerpo = json.loads(self.rfile.read(longitud) or b'{}')
+        except json.JSONDecodeError as e:
+            raise PeticionInvalida(f"JSON no válido: {e}") from e
+        if not isinstance(cuerpo, dict):
+            raise PeticionInvalida("el cuerpo debe ser un objeto JSON")
+        return cuerpo
+
+    def _responder_json(self, datos, estado: HTTPStatus = HTTPStatus.OK) -> None:
+        self._responder_bytes(json.dumps(datos, ensure_ascii=False, default=_json_seguro).encode(),
+                              'application/json', estado=estado)
+
+    def _responder_error(self, estado: HTTPStatus, mensaje: str) -> None:
+        self._responder_json({'error': mensaje}, estado)
+
+    def _responder_bytes(self, datos: bytes, mime: str, cabeceras: Optional[Dict[str, str]] = None,
+                         estado: HTTPStatus = HTTPStatus.OK) -> None:
+        self.send_response(estado)
+        self.send_header('Content-Type', mime)
+        self.send_header('Content-Length', str(len(datos)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _responder_fichero(self, fichero: FicheroExport, mime: str, cabeceras: Optional[Dict[str, str]] = None) -> None:
+        """Envía el export por bloques desde su temporal, sin pasarlo entero a memoria"""
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', mime)
+        self.send_header('Content-Length', str(fichero.tamano))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        for bloque in fichero.bloques():
+            self.wfile.write(bloque)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ServidorIncidencias(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion, data_manager: OptimizedDataManager, verbose: bool = False):
+        super().__init__(direccion, ManejadorServicio)
+        self.data_manager = data_manager
+        self.cargado = datetime.now()
+        self.verbose = verbose
+
+
+def crear_servidor(host: str = '127.0.0.1', puerto: int = 8765, verbose: bool = False) -> ServidorIncidencias:
+    """Servidor con la instantánea de maestros ya cargada (puerto 0: uno libre)"""
+    data_manager = OptimizedDataManager()
+    data_manager._ensure_cache_built()
+    return ServidorIncidencias((host, puerto), data_manager, verbose)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Servicio HTTP de enriquecimiento, costes y export de incidencias")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--verbose', action='store_true', help="Registrar cada petición")
+    args = parser.parse_args(argv)
+
+    servidor = crear_servidor(args.host, args.puerto, args.verbose)
+    print(f"Servicio de incidencias en http://{args.host}:{servidor.server_address[1]}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,61 @@
+"""Utilidades comunes de las pruebas: maestros reales de data/ y registros de entrada"""
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import pytest
+from streamlit import logger as st_logger
+
+st_logger.set_log_level('error')  # Sin runtime de Streamlit: silenciar avisos de "bare mode"
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+# Las rutas de los maestros (data/maestros.xlsx) son relativas a la raíz del repositorio
+os.chdir(RAIZ)
+
+import app_optimized  # noqa: E402
+from app_optimized import (  # noqa: E402
+    OptimizedDataManager, get_almacenes, get_guardado_diferido, get_imputaciones_indexadas, get_indice_duplicados
+)
+from autoguardado import directorio_guardado  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def data_manager() -> OptimizedDataManager:
+    data_manager = OptimizedDataManager()
+    data_manager._ensure_cache_built()
+    return data_manager
+
+
+@pytest.fixture(scope='session')
+def empleados(data_manager):
+    return data_manager.get_all_employees()
+
+
+def registro(trabajador: str, **campos) -> dict:
+    """Registro de entrada válido (CAMPOS_ENTRADA) para el trabajador"""
+    return {
+        'trabajador': trabajador, 'imputacion_nomina': '03 Marzo', 'facturable': 'Sí', 'motivo': 'Refuerzo',
+        'codigo_crown_destino': 100002, 'incidencia_horas': 3, 'incidencia_precio': 10.0, 'nocturnidad_horas': 1,
+        'traslados_total': 0, 'fecha': '2025-03-04', 'observaciones': 'prueba', **campos,
+    }
+
+
+def reiniciar_proceso() -> None:
+    """Lo que pierde un reinicio: almacenes abiertos e índice en memoria (el autoguardado sigue en disco)"""
+    get_guardado_diferido().vaciar()
+    get_almacenes().clear()
+    get_imputaciones_indexadas().clear()
+    get_indice_duplicados.clear()
+
+
+@pytest.fixture
+def imputacion(monkeypatch):
+    """Imputación propia de la prueba con autoguardado; su directorio se borra al terminar"""
+    monkeypatch.setattr(app_optimized, 'AUTOGUARDADO', True)
+    imputacion = f"prueba-{uuid.uuid4().hex[:8]}"
+    reiniciar_proceso()
+    yield imputacion
+    reiniciar_proceso()
+    shutil.rmtree(directorio_guardado(imputacion), ignore_errors=True)
@@ -0,0 +1,48 @@
+"""Archivo histórico: cada supervisor sustituye solo su partición aunque comparta personal"""
+import pytest
+
+from app_optimized import OptimizedExportManager, incidencias_desde_registros
+from archivo import archivar_mes, consultar, coste_interanual
+from conftest import registro
+
+
+def _export(data_manager, empleados, jefes_ope, observaciones):
+    """Export de un mes con un trabajador distinto por fila y el jefe_ope de maestro dado"""
+    registros = [registro(empleados[i], observaciones=observaciones) for i in range(len(jefes_ope))]
+    incidencias, errores = incidencias_desde_registros(registros, data_manager)
+    assert not errores
+    for inc, jefe in zip(incidencias, jefes_ope):
+        inc.nombre_jefe_ope = jefe
+    df, _ = OptimizedExportManager._build_export(incidencias, data_manager)
+    return df
+
+
+def test_supervisores_que_comparten_personal_no_se_pisan(tmp_path, data_manager, empleados):
+    raiz = tmp_path / 'archivo'
+    assert archivar_mes(_export(data_manager, empleados, ['JEFE B'] * 3, 'de B'), 2025, 'JEFE B', raiz) == 3
+    # A registra a dos de los suyos y a uno prestado por B (su jefe_ope en el maestro es B)
+    assert archivar_mes(_export(data_manager, empleados, ['JEFE A', 'JEFE A', 'JEFE B'], 'de A'), 2025, 'JEFE A', raiz) == 3
+
+    archivado = consultar(['supervisor', 'jefe_ope', 'observaciones'], raiz=raiz)
+    assert archivado.groupby('supervisor')['observaciones'].unique().map(list).to_dict() == {
+        'JEFE A': ['de A'], 'JEFE B': ['de B'],
+    }
+    assert len(consultar(supervisores=['JEFE B'], raiz=raiz)) == 3
+    assert len(consultar(jefes=['JEFE B'], raiz=raiz)) == 4
+
+    # Volver a archivar sustituye solo lo de ese supervisor
+    archivar_mes(_export(data_manager, empleados, ['JEFE A'], 'de A otra vez'), 2025, 'JEFE A', raiz)
+    archivado = consultar(['supervisor', 'observaciones'], raiz=raiz)
+    assert archivado['supervisor'].value_counts().to_dict() == {'JEFE B': 3, 'JEFE A': 1}
+    assert set(archivado.loc[archivado['supervisor'] == 'JEFE A', 'observaciones']) == {'de A otra vez'}
+
+
+def test_coste_interanual_por_supervisor(tmp_path, data_manager, empleados):
+    raiz = tmp_path / 'archivo'
+    df = _export(data_manager, empleados, ['JEFE A', 'JEFE B'], 'x')
+    archivar_mes(df, 2024, 'JEFE A', raiz)
+    archivar_mes(df, 2025, 'JEFE A', raiz)
+    tabla = coste_interanual('03 Marzo', raiz=raiz)
+    assert list(tabla.index) == ['JEFE A']
+    assert tabla.loc['JEFE A', 2024] == pytest.approx(df['Coste_total'].sum())
+    assert tabla.loc['JEFE A', 2025] == pytest.approx(df['Coste_total'].sum())
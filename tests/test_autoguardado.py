@@ -0,0 +1,69 @@
+"""Autoguardado: instantánea + deltas ida y vuelta, compactación y un hilo que sobrevive a los fallos"""
+import threading
+
+import pandas as pd
+import pyarrow as pa
+
+from autoguardado import GuardadoDiferido, PuntoGuardado
+
+ESQUEMA = pa.schema([('nombre', pa.string()), ('horas', pa.float64()), ('fecha', pa.timestamp('ns'))])
+
+
+def _fila(i, version=1, **valores):
+    return (f"id{i}", version, {'nombre': f"T{i}", 'horas': float(i), 'fecha': pd.Timestamp('2026-03-01'), **valores})
+
+
+def _ficheros(punto):
+    return [tipo for _, tipo, _ in punto._ficheros()]
+
+
+def test_deltas_sobre_la_instantanea_se_restauran_en_orden(tmp_path):
+    punto = PuntoGuardado(tmp_path, ESQUEMA)
+    punto.guardar_completa([_fila(i) for i in range(3)])
+    punto.guardar_delta([_fila(1, 2, horas=7.5), ("id2", 2, None), _fila(3, fecha=None)])
+    punto.guardar_delta([_fila(1, 3, nombre="T1 bis")])
+    punto.guardar_delta([])  # Sin cambios no escribe fichero
+    assert _ficheros(punto) == ['base', 'delta', 'delta']
+
+    # Un proceso nuevo lee el mismo directorio
+    filas = PuntoGuardado(tmp_path, ESQUEMA).restaurar()
+    assert filas == {
+        'id0': (1, {'nombre': "T0", 'horas': 0.0, 'fecha': pd.Timestamp('2026-03-01')}),
+        'id1': (3, {'nombre': "T1 bis", 'horas': 1.0, 'fecha': pd.Timestamp('2026-03-01')}),
+        'id3': (1, {'nombre': "T3", 'horas': 3.0, 'fecha': None}),
+    }
+
+
+def test_al_acumular_segmentos_se_compacta_en_una_instantanea(tmp_path, monkeypatch):
+    monkeypatch.setattr(PuntoGuardado, 'SEGMENTOS_MAX', 3)
+    punto = PuntoGuardado(tmp_path, ESQUEMA)
+    for version in range(1, 4):
+        punto.guardar_delta([_fila(0, version)])
+    # Al reabrir se cuentan los segmentos que ya hay
+    punto = PuntoGuardado(tmp_path, ESQUEMA)
+    assert punto.compactar
+    punto.guardar_completa([_fila(0, 3), _fila(1)])
+    assert _ficheros(punto) == ['base'] and not punto.compactar
+    punto.guardar_delta([("id0", 4, None)])
+    assert PuntoGuardado(tmp_path, ESQUEMA).restaurar() == {'id1': _fila(1)[1:]}
+
+
+class _Guardable:
+    def __init__(self, fallos=0):
+        self.fallos = fallos
+        self.guardado = threading.Event()
+
+    def guardar(self):
+        if self.fallos:
+            self.fallos -= 1
+            raise OSError("disco lleno")
+        self.guardado.set()
+
+
+def test_un_guardado_que_falla_se_reintenta_sin_parar_el_hilo():
+    guardado = GuardadoDiferido(espera=0.01, espera_max=0.05)
+    fallido, otro = _Guardable(fallos=2), _Guardable()
+    guardado.avisar(fallido)
+    guardado.avisar(otro)
+    assert otro.guardado.wait(5) and fallido.guardado.wait(5)
+    assert fallido.fallos == 0 and not guardado._pendientes
@@ -0,0 +1,118 @@
+"""Export "Solo cambios": compartido entre editores y persistente entre reinicios"""
+from dataclasses import replace
+
+from app_optimized import (
+    IncidenciaChangeLog, OptimizedExportManager, get_almacen, get_guardado_diferido, incidencias_desde_registros
+)
+from conftest import registro, reiniciar_proceso
+
+ALTA, MODIFICACION, BAJA = IncidenciaChangeLog.ALTA, IncidenciaChangeLog.MODIFICACION, IncidenciaChangeLog.BAJA
+
+
+def _alta(almacen, data_manager, empleados, n, imputacion):
+    registros = [registro(empleados[i], imputacion_nomina=imputacion) for i in range(n)]
+    incidencias, _ = incidencias_desde_registros(registros, data_manager)
+    for inc in incidencias:
+        assert almacen.cas(inc, 0)[0]
+    return incidencias
+
+
+def _descargar(almacen):
+    """Lo que hace el botón de descarga del delta: exportar y avanzar el watermark del almacén"""
+    watermark, cambios = almacen.cambios_export()
+    almacen.avanzar_watermark_export(watermark)
+    return {inc.id_incidencia: operacion for operacion, inc in cambios}
+
+
+def _modificar(almacen, inc, **campos):
+    modificada = replace(inc, **campos)
+    ok, _ = almacen.cas(modificada, almacen.version(inc.id_incidencia))
+    assert ok
+    return modificada
+
+
+def test_lo_descargado_por_un_editor_no_vuelve_a_salir_para_otro(imputacion, data_manager, empleados):
+    # Dos sesiones del mismo (imputación, jefe) comparten el almacén, y con él el registro de cambios
+    almacen = get_almacen(imputacion, 'JEFE A')
+    incidencias = _alta(almacen, data_manager, empleados, 3, imputacion)
+    assert _descargar(almacen) == {inc.id_incidencia: ALTA for inc in incidencias}
+
+    assert get_almacen(imputacion, 'JEFE A').cambios_export()[1] == []
+    modificada = _modificar(almacen, incidencias[0], observaciones="corregida")
+    _, cambios = get_almacen(imputacion, 'JEFE A').cambios_export()
+    assert [(operacion, inc.id_incidencia, inc.observaciones) for operacion, inc in cambios] == [
+        (MODIFICACION, modificada.id_incidencia, "corregida")
+    ]
+
+
+def test_tras_reiniciar_solo_salen_los_cambios_sin_exportar(imputacion, data_manager, empleados):
+    almacen = get_almacen(imputacion, 'JEFE A')
+    incidencias = _alta(almacen, data_manager, empleados, 4, imputacion)
+    _descargar(almacen)
+    _modificar(almacen, incidencias[0], observaciones="corregida")
+    assert almacen.borrar(incidencias[1], almacen.version(incidencias[1].id_incidencia))
+    nueva, = _alta(almacen, data_manager, empleados[10:], 1, imputacion)
+    # Alta y baja sin descargar entre medias: no hay nada que emitir
+    assert almacen.borrar(nueva, almacen.version(nueva.id_incidencia))
+    otra, = _alta(almacen, data_manager, empleados[20:], 1, imputacion)
+
+    reiniciar_proceso()
+
+    almacen = get_almacen(imputacion, 'JEFE A')
+    watermark, cambios = almacen.cambios_export()
+    assert {inc.id_incidencia: operacion for operacion, inc in cambios} == {
+        incidencias[0].id_incidencia: MODIFICACION,
+        incidencias[1].id_incidencia: BAJA,
+        otra.id_incidencia: ALTA,
+    }
+    delta = OptimizedExportManager.build_delta_frame(cambios, data_manager)
+    assert delta.set_index('id_incidencia')['operacion'].to_dict() == {
+        incidencias[0].id_incidencia: MODIFICACION, incidencias[1].id_incidencia: BAJA, otra.id_incidencia: ALTA,
+    }
+    assert delta.loc[delta['operacion'] == MODIFICACION, 'observaciones'].tolist() == ["corregida"]
+
+    # Descargado tras el reinicio: el siguiente reinicio ya no tiene nada pendiente
+    almacen.avanzar_watermark_export(watermark)
+    reiniciar_proceso()
+    assert get_almacen(imputacion, 'JEFE A').cambios_export()[1] == []
+
+
+def test_autoguardado_sin_metadatos_deja_todo_pendiente(imputacion, data_manager, empleados):
+    almacen = get_almacen(imputacion, 'JEFE A')
+    incidencias = _alta(almacen, data_manager, empleados, 2, imputacion)
+    _descargar(almacen)
+    get_guardado_diferido().vaciar()
+    (almacen._punto.directorio / 'metadatos.json').unlink()
+
+    reiniciar_proceso()
+
+    # Guardado de antes del registro persistente: no se sabe qué se exportó, así que sale todo
+    _, cambios = get_almacen(imputacion, 'JEFE A').cambios_export()
+    assert {inc.id_incidencia: operacion for operacion, inc in cambios} == {inc.id_incidencia: ALTA for inc in incidencias}
+
+
+def test_el_registro_de_escrituras_se_recorta_y_un_lector_rezagado_se_resincroniza(imputacion, data_manager, empleados):
+    almacen = get_almacen(imputacion, 'JEFE A')
+    incidencias = _alta(almacen, data_manager, empleados, 3, imputacion)
+    seq_rezagado, _, _ = almacen.cambios_desde(0, 'rezagado')
+    assert almacen.borrar(incidencias[2], almacen.version(incidencias[2].id_incidencia))
+    _modificar(almacen, incidencias[0], observaciones="corregida")
+
+    # El lector 'rezagado' sigue contando: descargar y guardar no recortan lo que le falta
+    _descargar(almacen)
+    get_guardado_diferido().vaciar()
+    assert len(almacen._log) == almacen.seq - seq_rezagado
+
+    # Inactivo más de LECTOR_INACTIVO: deja de contar y el registro se vacía al descargar
+    almacen._lectores['rezagado'] = (seq_rezagado, 0.0)
+    _modificar(almacen, incidencias[1], observaciones="otra")
+    get_guardado_diferido().vaciar()
+    _descargar(almacen)
+    assert almacen._log == [] and almacen._base == almacen.seq
+
+    # Si vuelve recibe todas las filas vigentes, con la versión actual
+    seq, cambios, completo = almacen.cambios_desde(seq_rezagado, 'rezagado')
+    assert completo and seq == almacen.seq
+    assert {i: version for i, version, _ in cambios} == {
+        inc.id_incidencia: almacen.version(inc.id_incidencia) for inc in incidencias[:2]
+    }
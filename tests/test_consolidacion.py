@@ -0,0 +1,56 @@
+"""Consolidación de exports descargados antes y después de la columna 'duplicada'"""
+import pandas as pd
+
+import consolidacion
+from app_optimized import OptimizedExportManager, incidencias_desde_registros
+from consolidacion import consolidar, leer_export, supervisor_de_fichero, validar_esquemas
+from conftest import registro
+from export_writers import EXPORT_DTYPES, supervisor_en_fichero
+
+
+def _export(data_manager, empleados, desde):
+    incidencias, _ = incidencias_desde_registros([registro(empleados[i]) for i in range(desde, desde + 3)], data_manager)
+    df, _ = OptimizedExportManager._build_export(incidencias, data_manager)
+    return df
+
+
+def test_exports_sin_columna_duplicada_se_consolidan(tmp_path, data_manager, empleados):
+    nuevo = _export(data_manager, empleados, 0)
+    nuevo.loc[0, 'duplicada'] = True
+    nuevo.to_excel(tmp_path / 'incidencias_JEFE_A_20250301_120000.xlsx', index=False)
+    _export(data_manager, empleados, 3).drop(columns='duplicada').to_excel(
+        tmp_path / 'incidencias_JEFE_B_20250301_120000.xlsx', index=False
+    )
+
+    frames = dict(leer_export(path) for path in sorted(tmp_path.glob(consolidacion.PATRON_EXPORTS)))
+    validar_esquemas(frames)
+    df = consolidar(frames)
+    assert list(df.columns) == [*EXPORT_DTYPES, 'supervisor']
+    assert df.groupby('supervisor')['duplicada'].sum().to_dict() == {'JEFE A': 1, 'JEFE B': 0}
+    assert not df['duplicada'].isna().any()
+
+
+def test_main_consolida_exports_anteriores(tmp_path, data_manager, empleados):
+    entrada, salida = tmp_path / 'exports', tmp_path / 'consolidados'
+    entrada.mkdir()
+    _export(data_manager, empleados, 0).drop(columns='duplicada').to_excel(
+        entrada / 'incidencias_JEFE_A_20250301_120000.xlsx', index=False
+    )
+    assert consolidacion.main([str(entrada), '--salida', str(salida), '--procesos', '1']) == 0
+    consolidado = pd.read_excel(salida / 'consolidado_03_Marzo.xlsx', sheet_name='incidencias')
+    assert len(consolidado) == 3 and not consolidado['duplicada'].any()
+
+
+def test_supervisor_con_guion_bajo_se_lee_tal_cual(tmp_path, data_manager, empleados):
+    for supervisor in ['JEFE_A', 'JEFE A', 'PEÑA 50%/B']:
+        path = tmp_path / f"incidencias_{supervisor_en_fichero(supervisor)}_20250301_120000.xlsx"
+        assert supervisor_de_fichero(path) == supervisor
+    # Nombres de antes del escape: '_' era un espacio
+    assert supervisor_de_fichero(tmp_path / 'incidencias_JEFE_B_20250301_120000.xlsx') == 'JEFE B'
+
+    # La misma descarga repetida de 'JEFE_A' se deduplica; la de 'JEFE A' es otro supervisor
+    export = _export(data_manager, empleados, 0)
+    for dia, nombre in enumerate(['JEFE_A', 'JEFE_A', 'JEFE A'], start=1):
+        export.to_excel(tmp_path / f"incidencias_{supervisor_en_fichero(nombre)}_2025030{dia}_120000.xlsx", index=False)
+    df = consolidar(dict(leer_export(path) for path in sorted(tmp_path.glob(consolidacion.PATRON_EXPORTS))))
+    assert df['supervisor'].value_counts().to_dict() == {'JEFE_A': 3, 'JEFE A': 3}
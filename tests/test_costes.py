@@ -0,0 +1,147 @@
+"""Las métricas de cabecera, el export y las dos aplicaciones valoran igual cada incidencia"""
+import io
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+from app_optimized import (
+    Incidencia, MetricasIncrementales, OptimizedExportManager, enriquecer_incidencia
+)
+from costes import COST_COLUMNS, cost_totals
+
+MOTIVOS = ["Absentismo", "Refuerzo", "Eventos", "Festivos y Fines de Semana", "Nocturnidad", "Otros"]
+N = 300
+
+
+def _campos(i: int) -> dict:
+    return dict(
+        imputacion_nomina="03 Marzo", facturable="Sí", motivo=MOTIVOS[i % len(MOTIVOS)], codigo_crown_destino=100002,
+        fecha=pd.Timestamp('2025-03-01') + pd.Timedelta(days=i % 28), observaciones="prueba",
+        incidencia_horas=2.0 + i % 3, incidencia_precio=12.5, nocturnidad_horas=float(i % 2), traslados_total=float(i % 4),
+    )
+
+
+@pytest.fixture(scope='module')
+def nombres(data_manager, empleados):
+    """Trabajadores con y sin tarifa de nocturnidad, para que la cuenta 74 no quede a cero"""
+    con_tarifa = [n for n in empleados if data_manager.precio_incidencia(_incidencia(n, 0, data_manager)) > 0]
+    sin_tarifa = [n for n in empleados if n not in set(con_tarifa)]
+    assert con_tarifa and sin_tarifa
+    return [(con_tarifa if i % 2 else sin_tarifa)[i % min(len(con_tarifa), len(sin_tarifa))] for i in range(N)]
+
+
+def _incidencia(nombre: str, i: int, data_manager) -> Incidencia:
+    incidencia = Incidencia(**_campos(i))
+    assert enriquecer_incidencia(incidencia, nombre, data_manager)
+    return incidencia
+
+
+@pytest.fixture
+def incidencias(nombres, data_manager):
+    return [_incidencia(nombre, i, data_manager) for i, nombre in enumerate(nombres)]
+
+
+def _export(incidencias, data_manager):
+    return OptimizedExportManager._build_export(incidencias, data_manager)
+
+
+def _coinciden(a: dict, b: dict) -> None:
+    assert a.keys() == b.keys()
+    for nombre in a:
+        assert a[nombre] == pytest.approx(b[nombre], rel=1e-9, abs=1e-6), nombre
+
+
+def test_metricas_coinciden_con_el_export(incidencias, data_manager):
+    df, costes = _export(incidencias, data_manager)
+    totales = cost_totals(costes)
+    assert totales['total_nocturnidad'] > 0
+    assert totales['total_con_ss'] == pytest.approx(df['Coste_total'].sum(), rel=1e-12)
+
+    # El Excel descargado lleva los mismos importes que la tabla de la que se genera
+    excel = pd.read_excel(io.BytesIO(OptimizedExportManager.export_to_excel(incidencias, data_manager)))
+    assert excel['Coste_total'].sum() == pytest.approx(totales['total_con_ss'], rel=1e-9)
+
+
+def test_metricas_incrementales_tras_altas_ediciones_y_bajas(incidencias, data_manager):
+    rnd = random.Random(0)
+    metricas = MetricasIncrementales()
+    vivas = []
+    for inc in incidencias:
+        vivas.append(inc)
+        metricas.actualizar(inc, data_manager)
+    _coinciden(metricas.totales(), cost_totals(_export(vivas, data_manager)[1]))
+
+    for inc in rnd.sample(vivas, 80):
+        inc.incidencia_horas = rnd.uniform(0, 8)
+        inc.nocturnidad_horas = rnd.choice([0.0, 1.5, 3.0])
+        inc.traslados_total = None if rnd.random() < .2 else 2.0
+        metricas.actualizar(inc, data_manager)
+    for inc in rnd.sample(vivas, 20):
+        inc.observaciones = ""  # Pasa a inválida: deja de contar
+        metricas.actualizar(inc, data_manager)
+    _coinciden(metricas.totales(), cost_totals(_export(vivas, data_manager)[1]))
+
+    for inc in rnd.sample(vivas, 60):
+        vivas.remove(inc)
+        metricas.quitar(inc)
+    _, costes = _export(vivas, data_manager)
+    _coinciden(metricas.totales(), cost_totals(costes))
+    assert metricas.n_validas == sum(inc.is_valid() for inc in vivas)
+
+
+def _originales(incidencias):
+    originales = []
+    for inc in incidencias:
+        original = app.Incidencia(**_campos(0))
+        for campo in ('imputacion_nomina', 'facturable', 'motivo', 'codigo_crown_destino', 'fecha', 'observaciones',
+                      'incidencia_horas', 'incidencia_precio', 'nocturnidad_horas', 'traslados_total', 'trabajador',
+                      'categoria', 'servicio', 'centro_preferente', 'codigo_crown_origen', 'cod_reg_convenio',
+                      'coste_hora', 'nombre_jefe_ope'):
+            setattr(original, campo, getattr(inc, campo))
+        originales.append(original)
+    return originales
+
+
+def test_app_y_app_optimized_valoran_igual(incidencias, data_manager):
+    df, costes = _export(incidencias, data_manager)
+    df_app, costes_app = app.ExportManager.build_export_frame(_originales(incidencias), app.DataManager())
+    for columna in COST_COLUMNS:
+        np.testing.assert_allclose(df[columna].to_numpy(float), df_app[columna].to_numpy(float), rtol=1e-12)
+    _coinciden(cost_totals(costes), cost_totals(costes_app))
+
+
+def test_app_construye_el_frame_una_vez_por_rerun(incidencias, monkeypatch):
+    construir = app.ExportManager.build_export_frame
+    llamadas = []
+
+    def contar(*args):
+        llamadas.append(1)
+        return construir(*args)
+
+    monkeypatch.setattr(app.ExportManager, 'build_export_frame', staticmethod(contar))
+    monkeypatch.setattr(app.st, 'session_state', SimpleNamespace(incidencias=_originales(incidencias), selected_jefe='JEFE A'))
+    descargas = []
+    monkeypatch.setattr(app.st, 'download_button', lambda **kwargs: descargas.append(kwargs['data']))
+
+    app.IncidenciasApp._render_export_section(object.__new__(app.IncidenciasApp), app.DataManager())
+    assert len(llamadas) == 1
+    assert len(pd.read_excel(io.BytesIO(descargas[0]))) == len(incidencias)
+
+
+def test_codigos_de_tarifa_normalizan_y_los_pares_sin_tarifa_valen_cero(data_manager):
+    (categoria, convenio), precio = next(iter(data_manager._tarifa_lookup.items()))
+    categorias = [categoria, f"  {categoria.lower()} ", "NO EXISTE", None, categoria, np.nan]
+    convenios = [convenio, f" {convenio}", convenio, convenio, "", convenio]
+    codigos = data_manager.codigos_tarifa(categorias, convenios)
+    esperado = data_manager.codigo_tarifa(categoria, convenio)
+    assert esperado != data_manager.SIN_TARIFA
+    assert codigos.tolist() == [esperado, esperado] + [data_manager.SIN_TARIFA] * 4
+    # Uno a uno da lo mismo que en bloque, y SIN_TARIFA apunta al precio 0.0
+    assert [data_manager.codigo_tarifa(c, v) for c, v in zip(categorias, convenios)] == codigos.tolist()
+    assert data_manager.get_precios_nocturnidad(categorias, convenios).tolist() == [precio, precio, 0.0, 0.0, 0.0, 0.0]
+    assert data_manager.get_precio_nocturnidad("NO EXISTE", convenio) == 0.0
+    assert data_manager.codigos_tarifa([], []).tolist() == []
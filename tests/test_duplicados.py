@@ -0,0 +1,67 @@
+"""Índice de duplicados entre supervisores tras reiniciar el proceso"""
+from app_optimized import get_almacen, get_almacenes, get_indice_duplicados, incidencias_desde_registros
+from conftest import registro, reiniciar_proceso
+
+
+def _incidencia(data_manager, trabajador, imputacion):
+    (incidencia,), _ = incidencias_desde_registros([registro(trabajador, imputacion_nomina=imputacion)], data_manager)
+    return incidencia
+
+
+def test_tras_reiniciar_marca_duplicadas_con_almacenes_no_abiertos(imputacion, data_manager, empleados):
+    almacen_b = get_almacen(imputacion, 'JEFE B')
+    assert almacen_b.cas(_incidencia(data_manager, empleados[0], imputacion), 0)[0]
+    almacen_b.guardar()
+
+    reiniciar_proceso()
+
+    # Tras el reinicio solo entra A: la fila de B está en disco, en un almacén que nadie ha abierto
+    almacen_a = get_almacen(imputacion, 'JEFE A')
+    incidencia = _incidencia(data_manager, empleados[0], imputacion)
+    assert almacen_a.cas(incidencia, 0)[0]
+    indice = get_indice_duplicados()
+    assert indice.es_duplicada(incidencia)
+    assert indice.otros_propietarios(incidencia) == ['JEFE B']
+    assert set(get_almacenes()) == {(imputacion, 'JEFE A'), (imputacion, 'JEFE B')}
+
+
+def test_sin_coincidencias_no_marca(imputacion, data_manager, empleados):
+    get_almacen(imputacion, 'JEFE B').cas(_incidencia(data_manager, empleados[0], imputacion), 0)
+    get_almacen(imputacion, 'JEFE B').guardar()
+    reiniciar_proceso()
+
+    incidencia = _incidencia(data_manager, empleados[1], imputacion)
+    get_almacen(imputacion, 'JEFE A').cas(incidencia, 0)
+    assert not get_indice_duplicados().es_duplicada(incidencia)
+
+
+def test_la_version_de_un_grupo_solo_cambia_si_cambia_la_marca_de_sus_filas(imputacion, data_manager, empleados):
+    indice = get_indice_duplicados()
+    almacen_a, almacen_b = get_almacen(imputacion, 'JEFE A'), get_almacen(imputacion, 'JEFE B')
+    grupo_a, grupo_b = (imputacion, 'JEFE A'), (imputacion, 'JEFE B')
+    fila_b = _incidencia(data_manager, empleados[0], imputacion)
+    almacen_b.cas(fila_b, 0)
+    version_b = indice.version(grupo_b)
+
+    # Las ediciones de A que no chocan con B no invalidan lo cacheado por las sesiones de B
+    otra = _incidencia(data_manager, empleados[1], imputacion)
+    almacen_a.cas(otra, 0)
+    almacen_a.borrar(otra, almacen_a.version(otra.id_incidencia))
+    assert indice.version(grupo_b) == version_b and indice.n_duplicadas(grupo_b) == 0
+
+    primera, segunda = (_incidencia(data_manager, empleados[0], imputacion) for _ in range(2))
+    almacen_a.cas(primera, 0)
+    assert indice.version(grupo_b) != version_b
+    assert (indice.n_duplicadas(grupo_a), indice.n_duplicadas(grupo_b)) == (1, 1)
+
+    # Una tercera fila con la misma clave no cambia la marca de la de B
+    version_b = indice.version(grupo_b)
+    almacen_a.cas(segunda, 0)
+    assert indice.version(grupo_b) == version_b
+    assert (indice.n_duplicadas(grupo_a), indice.n_duplicadas(grupo_b)) == (2, 1)
+
+    for inc in (primera, segunda):
+        almacen_a.borrar(inc, almacen_a.version(inc.id_incidencia))
+    assert indice.version(grupo_b) != version_b
+    assert (indice.n_duplicadas(grupo_a), indice.n_duplicadas(grupo_b)) == (0, 0)
+    assert not indice.es_duplicada(fila_b)
@@ -0,0 +1,110 @@
+"""Fechas de entrada con zona horaria o en formato no ISO, en cada vía de ingestión"""
+import http.client
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+
+import main
+import servicio
+from app_optimized import fechas_invalidas, incidencias_desde_registros, normalize_fechas
+from conftest import registro
+
+MARZO_4 = pd.Timestamp('2025-03-04')
+
+
+@pytest.mark.parametrize('valor', [
+    '2025-03-04',
+    '2025-03-04T10:00:00Z',
+    '2025-03-04Z',
+    '2025-03-04T23:30:00-05:00',
+    '2025-03-04T00:30:00.250+01:00',
+    '2025-03-04 08:15+0200',
+    datetime(2025, 3, 4, 23, 0, tzinfo=timezone(timedelta(hours=-8))),
+    pd.Timestamp('2025-03-04 00:10', tz='Europe/Madrid'),
+])
+def test_normalize_fechas_conserva_el_dia_local(valor):
+    fechas = normalize_fechas([valor])
+    assert fechas.dtype == 'datetime64[ns]'
+    assert fechas.iloc[0] == MARZO_4
+
+
+def test_normalize_fechas_admite_desfases_mezclados_en_un_lote():
+    fechas = normalize_fechas(['2025-03-04T10:00:00+02:00', '2025-03-05T10:00:00-05:00', '2025-03-06', None])
+    assert fechas.tolist()[:3] == [MARZO_4, pd.Timestamp('2025-03-05'), pd.Timestamp('2025-03-06')]
+    assert pd.isna(fechas.iloc[3])
+
+
+def test_fechas_invalidas_distingue_vacias_de_no_reconocidas():
+    valores = ['2025-03-04', None, '', '  ', '01/03/2025', 'mañana']
+    assert fechas_invalidas(valores, normalize_fechas(valores)).tolist() == [False, False, False, False, True, True]
+
+
+def test_lote_informa_fechas_no_validas(data_manager, empleados):
+    registros = [
+        registro(empleados[0], fecha='2025-03-04T10:00:00Z'),
+        registro(empleados[1], fecha='01/03/2025'),
+        registro(empleados[2], fecha=None),
+    ]
+    incidencias, errores = incidencias_desde_registros(registros, data_manager)
+    assert [inc.fecha for inc in incidencias] == [MARZO_4]
+    assert errores[0]['fila'] == 1 and 'fecha no válida' in errores[0]['error']
+    assert errores[1] == {'fila': 2, 'error': "faltan campos obligatorios"}
+
+
+@pytest.fixture(scope='module')
+def servidor():
+    srv = servicio.crear_servidor(puerto=0)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _post(srv, ruta, cuerpo):
+    conexion = http.client.HTTPConnection('127.0.0.1', srv.server_address[1], timeout=30)
+    try:
+        conexion.request('POST', ruta, json.dumps(cuerpo), {'Content-Type': 'application/json'})
+        respuesta = conexion.getresponse()
+        return respuesta.status, json.loads(respuesta.read())
+    finally:
+        conexion.close()
+
+
+def test_servicio_costea_fechas_con_zona(servidor, empleados):
+    estado, datos = _post(servidor, '/costes/lote', {'incidencias': [
+        registro(empleados[0], fecha='2025-03-04T10:00:00+02:00'),
+        registro(empleados[1], fecha='2025-03-05T10:00:00-05:00'),
+        registro(empleados[2], fecha='2025-03-06T10:00:00Z'),
+        registro(empleados[3], fecha='01/03/2025'),
+    ]})
+    assert estado == 200
+    assert len(datos['filas']) == 3
+    assert [error['fila'] for error in datos['errores']] == [3]
+
+
+def test_servicio_responde_400_a_valores_que_no_se_convierten(servidor, monkeypatch):
+    def falla(*_args):
+        raise ValueError("valor imposible")
+    monkeypatch.setattr(servicio, 'procesar_lote', falla)
+    estado, datos = _post(servidor, '/costes/lote', {'incidencias': []})
+    assert estado == 400
+    assert 'valor imposible' in datos['error']
+
+
+@pytest.mark.parametrize('extension', ['parquet', 'jsonl'])
+def test_main_procesa_fechas_con_zona(tmp_path, empleados, extension):
+    entrada = pd.DataFrame([registro(empleados[i]) for i in range(3)])
+    if extension == 'parquet':
+        entrada['fecha'] = pd.to_datetime(['2025-03-04 10:00', '2025-03-05 10:00', '2025-03-06 10:00']).tz_localize('Europe/Madrid')
+        entrada.to_parquet(tmp_path / 'entrada.parquet')
+    else:
+        entrada['fecha'] = ['2025-03-04T10:00:00+01:00', '2025-03-05T10:00:00-05:00', '2025-03-06T10:00:00Z']
+        entrada.to_json(tmp_path / 'entrada.jsonl', orient='records', lines=True)
+    salida = tmp_path / 'export.parquet'
+
+    assert main.main([str(tmp_path / f'entrada.{extension}'), '--salida', str(salida), '--procesos', '1']) == 0
+    fechas = pd.read_parquet(salida)['fecha']
+    assert fechas.tolist() == [MARZO_4, pd.Timestamp('2025-03-05'), pd.Timestamp('2025-03-06')]
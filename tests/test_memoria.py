@@ -0,0 +1,58 @@
+"""Presupuesto de memoria: expulsión LRU entre sesiones y limpieza al terminar una sesión"""
+import gc
+
+from memoria import CacheDerivada, PresupuestoMemoria
+
+
+def _obtener(cache, nombre, version=1, tamano=400):
+    construidos = []
+
+    def construir():
+        construidos.append(nombre)
+        return b'x' * tamano
+    cache.obtener(nombre, version, construir)
+    return bool(construidos)
+
+
+def test_expulsa_lo_menos_usado_de_cualquier_sesion():
+    presupuesto = PresupuestoMemoria(1000)
+    a, b = CacheDerivada(presupuesto, 'a'), CacheDerivada(presupuesto, 'b')
+    assert _obtener(a, 'pagina') and _obtener(b, 'pagina')
+    assert not _obtener(a, 'pagina')  # Acierto: pasa a ser la más reciente
+    assert _obtener(b, 'export')  # 1200 bytes: sale la página de b, la menos usada
+    assert presupuesto.expulsiones == 1 and presupuesto.total_derivados == 800
+    assert _obtener(b, 'pagina')  # Se reconstruye al volver a pedirla...
+    assert not _obtener(b, 'export') and not _obtener(b, 'pagina')  # ...y ahora la expulsada fue la de a
+    assert _obtener(a, 'pagina')
+
+
+def test_un_dato_mayor_que_el_limite_se_conserva_hasta_el_siguiente():
+    presupuesto = PresupuestoMemoria(1000)
+    cache = CacheDerivada(presupuesto, 'a')
+    _obtener(cache, 'pagina')
+    _obtener(cache, 'export', tamano=1500)
+    assert not _obtener(cache, 'export', tamano=1500) and _obtener(cache, 'pagina')
+    assert presupuesto.total_derivados == 400
+
+
+def test_descartar_y_version_nueva_ajustan_la_cuenta():
+    presupuesto = PresupuestoMemoria(10_000)
+    cache = CacheDerivada(presupuesto, 'a')
+    _obtener(cache, 'pagina')
+    assert _obtener(cache, 'pagina', version=2, tamano=100)
+    assert presupuesto.total_derivados == 100
+    cache.descartar('pagina')
+    assert presupuesto.total_derivados == 0 and _obtener(cache, 'pagina', version=2)
+
+
+def test_las_sesiones_terminadas_salen_de_la_cuenta():
+    presupuesto = PresupuestoMemoria(10_000)
+    a, b = CacheDerivada(presupuesto, 'a'), CacheDerivada(presupuesto, 'b')
+    _obtener(a, 'pagina')
+    _obtener(b, 'pagina', tamano=300)
+    presupuesto.informar_estado(a, 'a', 50)
+    del a
+    gc.collect()
+    informe = presupuesto.informe()
+    assert informe[['sesion', 'estado', 'derivados', 'entradas', 'total']].values.tolist() == [['b', 0, 300, 1, 300]]
+    assert presupuesto.total_derivados == 300
@@ -0,0 +1,75 @@
+"""Export partido en zip: nombres únicos por partición, avance por partición y pool único"""
+import io
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import export_writers
+from app_optimized import OptimizedExportManager, procesar_lote
+from conftest import registro
+from export_writers import get_export_pool, iter_partitioned_zip
+
+
+def _frame(valores):
+    return pd.DataFrame({'empresa_destino': valores, 'incidencia_horas': range(len(valores))})
+
+
+def _zip(df, **kwargs):
+    with ThreadPoolExecutor(2) as pool:
+        data = b"".join(iter_partitioned_zip(df, 'empresa_destino', 'csv', pool=pool, **kwargs))
+    return zipfile.ZipFile(io.BytesIO(data))
+
+
+def test_valores_que_se_limpian_igual_no_repiten_nombre():
+    # 'A/B', 'A B' y 'A_B' quedan como 'A_B' al limpiar el nombre, 'A_B_2' choca con un sufijo y None y '' son 'sin_valor'
+    zf = _zip(_frame(['A/B', 'A B', 'A_B', 'A_B_2', None, '']))
+    contenido = {
+        nombre: pd.read_csv(zf.open(nombre), keep_default_na=False)['empresa_destino'].tolist()
+        for nombre in zf.namelist()
+    }
+    # En orden de valor: cada uno en su fichero y los repetidos con sufijo
+    assert contenido == {
+        'empresa_destino_sin_valor.csv': [''],
+        'empresa_destino_A_B.csv': ['A B'],
+        'empresa_destino_A_B_2.csv': ['A/B'],
+        'empresa_destino_A_B_3.csv': ['A_B'],
+        'empresa_destino_A_B_2_2.csv': ['A_B_2'],
+        'empresa_destino_sin_valor_2.csv': [''],
+    }
+
+
+def test_avance_una_unidad_por_particion():
+    df = _frame(['X', 'Y', 'Y', 'Z'] * 3)
+    avance = []
+    zf = _zip(df, progress=avance.append)
+    assert avance == [1, 1, 1] and len(zf.namelist()) == 3
+
+
+def test_generar_export_no_pasa_del_total(data_manager, empleados):
+    df, _, _ = procesar_lote([registro(trabajador, codigo_crown_destino=100002 + i % 3)
+                              for i, trabajador in enumerate(empleados[:12])], data_manager)
+    total = OptimizedExportManager.unidades_export(df, 'csv', 'codigo_crown_destino')
+    avance = []
+    fichero = OptimizedExportManager.generar_export(df, 'csv', 'codigo_crown_destino', avance=avance.append)
+    assert sum(avance) == total == 3
+    assert len(zipfile.ZipFile(io.BytesIO(fichero.leer())).namelist()) == 3
+
+
+def test_un_solo_pool_con_varios_hilos(monkeypatch):
+    monkeypatch.setattr(export_writers, '_export_pool', None)
+    barrera = threading.Barrier(8)
+    pools = []
+
+    def pedir():
+        barrera.wait()
+        pools.append(get_export_pool())
+
+    hilos = [threading.Thread(target=pedir) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert len({id(pool) for pool in pools}) == 1
+    pools[0].shutdown()
@@ -0,0 +1,64 @@
+"""El motor de reglas incremental coincide con la evaluación completa"""
+import random
+
+import pandas as pd
+
+from reglas import (
+    EXCESO_HORAS, EXCESO_NOCTURNIDAD, NOCTURNIDAD_NO_PERMITIDA, REGLAS, MotorReglas, evaluar_reglas
+)
+
+
+def _registro(rnd: random.Random) -> dict:
+    return {
+        'trabajador': f"T{rnd.randrange(50)}",
+        'fecha': pd.Timestamp('2025-03-01') + pd.Timedelta(days=rnd.randrange(5)) if rnd.random() > .05 else None,
+        'incidencia_horas': rnd.choice([1, 2, 4, 8, None]),
+        'nocturnidad_horas': rnd.choice([0, 0, 2, 5]),
+        'porcen_contrato': rnd.choice([100, 50, None]),
+        'nocturnidad_permitida': rnd.random() > .2,
+    }
+
+
+def test_mascara_incremental_igual_a_evaluacion_completa():
+    rnd = random.Random(1)
+    registros = {i: _registro(rnd) for i in range(500)}
+    motor = MotorReglas()
+    motor.cargar(registros)
+    for _ in range(300):
+        i = rnd.randrange(600)
+        if i in registros and rnd.random() < .3:
+            del registros[i]
+            motor.quitar(i)
+        else:
+            registros[i] = _registro(rnd)
+            motor.actualizar(i, registros[i])
+
+    df = pd.DataFrame.from_dict(registros, orient='index')
+    df['fecha'] = pd.to_datetime(df['fecha'])
+    completa = evaluar_reglas(df)
+    mascara = motor.mascara(list(df.index))
+    assert list(mascara.columns) == REGLAS
+    assert (mascara.to_numpy() == completa[REGLAS].to_numpy()).all()
+    assert motor.n_infracciones == int(completa.any(axis=1).sum())
+
+
+def test_reglas_por_dia_y_contrato():
+    motor = MotorReglas()
+    dia = pd.Timestamp('2025-03-04')
+    motor.cargar({
+        'a': {'trabajador': 'T', 'fecha': dia, 'incidencia_horas': 4, 'nocturnidad_horas': 5,
+              'porcen_contrato': 50, 'nocturnidad_permitida': True},
+        'b': {'trabajador': 'T', 'fecha': dia, 'incidencia_horas': 3, 'nocturnidad_horas': 4,
+              'porcen_contrato': 50, 'nocturnidad_permitida': False},
+        'c': {'trabajador': 'U', 'fecha': dia, 'incidencia_horas': 6, 'nocturnidad_horas': 0,
+              'porcen_contrato': 50, 'nocturnidad_permitida': False},
+    })
+    assert motor.infracciones('a') == (EXCESO_HORAS, EXCESO_NOCTURNIDAD)
+    assert motor.infracciones('b') == (EXCESO_HORAS, EXCESO_NOCTURNIDAD, NOCTURNIDAD_NO_PERMITIDA)
+    assert motor.infracciones('c') == ()
+
+    # Bajar las horas de b solo recomprueba el día de T
+    motor.actualizar('b', {'trabajador': 'T', 'fecha': dia, 'incidencia_horas': 1, 'nocturnidad_horas': 0,
+                           'porcen_contrato': 50, 'nocturnidad_permitida': False})
+    assert motor.infracciones('a') == ()
+    assert motor.mascara(['a', 'b', 'c']).to_numpy().sum() == 0
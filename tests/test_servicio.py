@@ -0,0 +1,47 @@
+"""Servicio HTTP: peticiones mal formadas responden 400 con el motivo, sin tumbar el servidor"""
+import http.client
+import json
+import threading
+
+import pytest
+
+from conftest import registro
+from servicio import ServidorIncidencias
+
+
+@pytest.fixture(scope='module')
+def servidor(data_manager):
+    servidor = ServidorIncidencias(('127.0.0.1', 0), data_manager)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def _post(servidor, ruta, cuerpo):
+    conexion = http.client.HTTPConnection(*servidor.server_address)
+    datos = cuerpo if isinstance(cuerpo, bytes) else json.dumps(cuerpo).encode()
+    conexion.request('POST', ruta, datos, {'Content-Type': 'application/json'})
+    respuesta = conexion.getresponse()
+    contenido = respuesta.read()
+    conexion.close()
+    return respuesta.status, contenido
+
+
+@pytest.mark.parametrize('ruta, cuerpo, motivo', [
+    ('/costes/lote', b'{"incidencias": [', "JSON no válido"),
+    ('/costes/lote', [1, 2], "el cuerpo debe ser un objeto JSON"),
+    ('/empleados/lote', {'trabajadores': "PEREZ"}, "se esperaba una lista en 'trabajadores'"),
+    ('/nocturnidad/lote', {'pares': [3]}, "elemento no válido en el lote"),
+    ('/export/lote?formato=pdf', {'incidencias': []}, "formato no soportado: 'pdf'"),
+])
+def test_peticion_invalida_responde_400(servidor, ruta, cuerpo, motivo):
+    estado, contenido = _post(servidor, ruta, cuerpo)
+    assert estado == 400
+    assert json.loads(contenido)['error'].startswith(motivo)
+
+
+def test_tras_un_400_el_servidor_sigue_atendiendo(servidor, empleados):
+    assert _post(servidor, '/nocturnidad/lote', {'pares': ["x"]})[0] == 400
+    estado, contenido = _post(servidor, '/export/lote?formato=csv', {'incidencias': [registro(empleados[0])]})
+    assert estado == 200 and len(contenido.decode('utf-8-sig').splitlines()) == 2  # Cabecera y la fila
@@ -0,0 +1,21 @@
+"""Trazas: el último rerun por sesión se acota a las sesiones más recientes"""
+from trazas import INICIO, RegistroTrazas
+
+
+def _rerun(registro, sesion):
+    with registro.traza(sesion) as traza:
+        pass
+    return traza
+
+
+def test_las_sesiones_menos_recientes_se_olvidan():
+    registro = RegistroTrazas(max_sesiones=2)
+    _rerun(registro, 'a')
+    _rerun(registro, 'b')
+    _rerun(registro, 'a')  # 'a' pasa a ser la más reciente
+    _rerun(registro, 'c')
+    assert list(registro._ultimas) == ['a', 'c']
+    # 'a' sigue su cuenta de acciones; 'b' se olvidó y vuelve como sesión nueva
+    assert _rerun(registro, 'a').accion == 3
+    b = _rerun(registro, 'b')
+    assert (b.accion, b.disparador) == (1, INICIO)
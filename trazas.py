@@ -0,0 +1,263 @@
+"""Trazas de tiempo por ejecución del script (rerun).
+
+Cada rerun abre una traza con un id propio y dentro de ella tramo(nombre)
+cronometra una etapa (tiempo inclusivo: un tramo anidado cuenta también en
+el que lo contiene). Un tramo fuera de cualquier traza (un export en el
+pool de hilos, una llamada desde servicio.py) abre su propia traza con el
+nombre del tramo como origen.
+
+Cada rerun anota además qué lo disparó: los widgets que cambiaron desde la
+ejecución anterior de la sesión o, si esa terminó con st.rerun(), la línea
+que lo llamó. Las ejecuciones encadenadas por st.rerun() cuentan como la
+misma acción del usuario; disparos() resume cuántas provoca cada tipo de
+acción y cuánto cuestan las que sobran.
+
+Las trazas cerradas se guardan en memoria (las últimas max_trazas) para el
+panel de administración y, con jsonl, se añaden como una línea JSON a ese
+fichero. Del último rerun de cada sesión (para saber qué disparó el
+siguiente) se guardan las max_sesiones sesiones usadas más recientemente. Con el
+registro desactivado, traza() y tramo() devuelven un contexto nulo
+compartido y cronometrado() la función sin envolver.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, OrderedDict, deque
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+_NULO = nullcontext()
+
+# Fin de una traza según la excepción que la cierra (las de control de flujo de Streamlit no son errores)
+_FINES = {'RerunException': 'rerun', 'StopException': 'stop'}
+
+PERCENTILES = (50, 90, 99)
+
+# Disparadores sin widget: primera ejecución de la sesión, o ningún widget con key cambió
+INICIO = 'inicio'
+DESCONOCIDO = 'desconocido'
+
+
+@dataclass
+class Traza:
+    id_traza: str
+    sesion: str = ''
+    origen: str = 'rerun'
+    inicio: float = field(default_factory=time.time)
+    inicio_perf: float = field(default_factory=time.perf_counter, repr=False)
+    total_ms: float = 0.0
+    fin: str = 'ok'
+    disparador: str = ''
+    accion: int = 0        # Acción del usuario a la que pertenece dentro de la sesión
+    rerun_desde: str = ''  # 'función:línea' del st.rerun() que la terminó
+    # (nombre, ms desde el inicio de la traza, duración en ms) en orden de cierre
+    tramos: List[Tuple[str, float, float]] = field(default_factory=list)
+
+    def por_tramo(self) -> Dict[str, float]:
+        """ms por nombre de tramo, sumando las repeticiones"""
+        tiempos: Dict[str, float] = {}
+        for nombre, _, ms in self.tramos:
+            tiempos[nombre] = tiempos.get(nombre, 0.0) + ms
+        return tiempos
+
+    def to_dict(self) -> Dict:
+        return {
+            'traza': self.id_traza,
+            'sesion': self.sesion,
+            'origen': self.origen,
+            'inicio': datetime.fromtimestamp(self.inicio).isoformat(timespec='milliseconds'),
+            'total_ms': round(self.total_ms, 3),
+            'fin': self.fin,
+            'disparador': self.disparador,
+            'accion': self.accion,
+            'rerun_desde': self.rerun_desde,
+            'tramos': [{'nombre': n, 'desde_ms': round(d, 3), 'ms': round(ms, 3)} for n, d, ms in self.tramos],
+        }
+
+
+class RegistroTrazas:
+    """Trazas de las últimas ejecuciones de todas las sesiones del proceso"""
+
+    def __init__(self, activo: bool = True, max_trazas: int = 500, jsonl: Optional[str] = None,
+                 max_sesiones: int = 1000):
+        self.activo = activo
+        self.max_sesiones = max_sesiones
+        self.jsonl = Path(jsonl) if jsonl else None
+        self._trazas: Deque[Traza] = deque(maxlen=max_trazas)
+        self._lock = threading.Lock()
+        self._local = threading.local()  # Traza abierta en cada hilo (cada rerun corre en su hilo)
+        self._ultimas: 'OrderedDict[str, Traza]' = OrderedDict()  # Último rerun cerrado de cada sesión, la más reciente al final
+
+    def actual(self) -> Optional[Traza]:
+        return getattr(self._local, 'traza', None)
+
+    def traza(self, sesion: str = '', origen: str = 'rerun', widgets: Sequence[str] = ()):
+        """Contexto de una ejecución completa; widgets: los que cambiaron desde la anterior"""
+        if not self.activo:
+            return _NULO
+        return _ContextoTraza(self, sesion, origen, widgets=widgets)
+
+    def tramo(self, nombre: str):
+        """Contexto que cronometra una etapa dentro de la traza abierta"""
+        if not self.activo:
+            return _NULO
+        if self.actual() is None:
+            return _ContextoTraza(self, '', nombre, tramo=nombre)
+        return _ContextoTramo(self, nombre)
+
+    def cronometrado(self, nombre: Optional[str] = None) -> Callable:
+        """Decorador: cada llamada es un tramo (por defecto con el nombre de la función)"""
+        def decorador(fn: Callable) -> Callable:
+            if not self.activo:
+                return fn
+            etiqueta = nombre or fn.__name__
+
+            @functools.wraps(fn)
+            def envoltura(*args, **kwargs):
+                with self.tramo(etiqueta):
+                    return fn(*args, **kwargs)
+            return envoltura
+        return decorador
+
+    def _cerrar(self, traza: Traza) -> None:
+        with self._lock:
+            self._trazas.append(traza)
+            if traza.origen == 'rerun':
+                self._ultimas[traza.sesion] = traza
+                self._ultimas.move_to_end(traza.sesion)
+                if len(self._ultimas) > self.max_sesiones:
+                    self._ultimas.popitem(last=False)
+            if self.jsonl is not None:
+                self.jsonl.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.jsonl, 'a', encoding='utf-8') as destino:
+                    destino.write(json.dumps(traza.to_dict(), ensure_ascii=False) + '\n')
+
+    def recientes(self, n: Optional[int] = None) -> List[Traza]:
+        """Últimas trazas cerradas, la más reciente primero"""
+        with self._lock:
+            trazas = list(self._trazas)
+        return trazas[::-1][:n]
+
+    def tabla(self, n: Optional[int] = None) -> pd.DataFrame:
+        """Una fila por traza: id, sesión, hora, fin, total y ms por tramo"""
+        filas = [
+            {'traza': t.id_traza, 'sesion': t.sesion, 'origen': t.origen, 'accion': t.accion,
+             'disparador': t.disparador, 'hora': datetime.fromtimestamp(t.inicio).strftime('%H:%M:%S'),
+             'fin': t.fin, 'total_ms': t.total_ms, **t.por_tramo()}
+            for t in self.recientes(n)
+        ]
+        return pd.DataFrame(filas)
+
+    def percentiles(self, origen: str = 'rerun') -> pd.DataFrame:
+        """Por tramo: trazas en que aparece, percentiles y máximo de sus ms por traza"""
+        trazas = [t for t in self.recientes() if t.origen == origen]
+        muestras: Dict[str, List[float]] = {'total': [t.total_ms for t in trazas]}
+        for traza in trazas:
+            for nombre, ms in traza.por_tramo().items():
+                muestras.setdefault(nombre, []).append(ms)
+        filas = []
+        for nombre, valores in muestras.items():
+            if not valores:
+                continue
+            cuantiles = np.percentile(valores, PERCENTILES)
+            filas.append({'tramo': nombre, 'n': len(valores),
+                          **{f'p{p}_ms': q for p, q in zip(PERCENTILES, cuantiles)},
+                          'max_ms': max(valores)})
+        return pd.DataFrame(filas, columns=['tramo', 'n', *(f'p{p}_ms' for p in PERCENTILES), 'max_ms'])
+
+    def disparos(self) -> pd.DataFrame:
+        """Por disparador de acción: ejecuciones por acción y coste de los reruns que encadena.
+
+        Una acción son las ejecuciones seguidas de una sesión unidas por
+        st.rerun(); todas salvo la primera son redundantes: repintan la
+        página entera tras un cambio que la ejecución anterior ya aplicó.
+        Ordenado por los ms gastados en ejecuciones redundantes.
+        """
+        acciones: Dict[Tuple[str, int], List[Traza]] = {}
+        for traza in reversed(self.recientes()):
+            if traza.origen == 'rerun':
+                acciones.setdefault((traza.sesion, traza.accion), []).append(traza)
+        filas: Dict[str, Dict] = {}
+        for ejecuciones in acciones.values():
+            if ejecuciones[0].disparador.startswith('st.rerun'):
+                continue  # Acción empezada antes de la traza más antigua que se conserva
+            fila = filas.setdefault(ejecuciones[0].disparador, {
+                'disparador': ejecuciones[0].disparador, 'acciones': 0, 'ejecuciones': 0, 'redundantes': 0,
+                'ms_total': 0.0, 'ms_redundantes': 0.0, 'sitios': Counter(),
+            })
+            fila['acciones'] += 1
+            fila['ejecuciones'] += len(ejecuciones)
+            fila['redundantes'] += len(ejecuciones) - 1
+            fila['ms_total'] += sum(t.total_ms for t in ejecuciones)
+            fila['ms_redundantes'] += sum(t.total_ms for t in ejecuciones[1:])
+            fila['sitios'].update(t.rerun_desde for t in ejecuciones if t.rerun_desde)
+        for fila in filas.values():
+            fila['por_accion'] = fila['ejecuciones'] / fila['acciones']
+            fila['st_rerun_desde'] = ", ".join(f"{sitio} ×{n}" for sitio, n in fila.pop('sitios').most_common())
+        columnas = ['disparador', 'acciones', 'ejecuciones', 'por_accion', 'redundantes',
+                    'ms_redundantes', 'ms_total', 'st_rerun_desde']
+        tabla = pd.DataFrame(list(filas.values()), columns=columnas)
+        return tabla.sort_values(['ms_redundantes', 'redundantes'], ascending=False, ignore_index=True)
+
+
+def _sitio_rerun(tb) -> str:
+    """'función:línea' del código de la aplicación que llamó a st.rerun()"""
+    marcos = [m for m in traceback.extract_tb(tb) if f'{os.sep}streamlit{os.sep}' not in m.filename]
+    return f"{marcos[-1].name}:{marcos[-1].lineno}" if marcos else ''
+
+
+class _ContextoTraza:
+    def __init__(self, registro: RegistroTrazas, sesion: str, origen: str, tramo: Optional[str] = None,
+                 widgets: Sequence[str] = ()):
+        self.registro = registro
+        self.traza = Traza(uuid.uuid4().hex[:12], sesion, origen)
+        self.nombre_tramo = tramo
+        if origen == 'rerun':
+            with registro._lock:
+                previa = registro._ultimas.get(sesion)
+            if previa is not None and previa.fin == 'rerun':
+                self.traza.disparador, self.traza.accion = f"st.rerun · {previa.rerun_desde}", previa.accion
+            else:
+                self.traza.disparador = ", ".join(widgets) or (INICIO if previa is None else DESCONOCIDO)
+                self.traza.accion = previa.accion + 1 if previa is not None else 1
+
+    def __enter__(self) -> Traza:
+        self.anterior = self.registro.actual()
+        self.registro._local.traza = self.traza
+        self.traza.inicio, self.traza.inicio_perf = time.time(), time.perf_counter()
+        return self.traza
+
+    def __exit__(self, tipo, valor, tb) -> None:
+        self.traza.total_ms = (time.perf_counter() - self.traza.inicio_perf) * 1000
+        if tipo is not None:
+            self.traza.fin = _FINES.get(tipo.__name__, 'error')
+            if self.traza.fin == 'rerun':
+                self.traza.rerun_desde = _sitio_rerun(tb)
+        if self.nombre_tramo is not None:
+            self.traza.tramos.append((self.nombre_tramo, 0.0, self.traza.total_ms))
+        self.registro._local.traza = self.anterior
+        self.registro._cerrar(self.traza)
+
+
+class _ContextoTramo:
+    def __init__(self, registro: RegistroTrazas, nombre: str):
+        self.registro = registro
+        self.nombre = nombre
+
+    def __enter__(self) -> None:
+        self.traza = self.registro.actual()
+        self.inicio = time.perf_counter()
+
+    def __exit__(self, tipo, valor, tb) -> None:
+        fin = time.perf_counter()
+        self.traza.tramos.append((self.nombre, (self.inicio - self.traza.inicio_perf) * 1000, (fin - self.inicio) * 1000))